@@ -3,6 +3,11 @@ import matplotlib.pyplot as plt
 import pyarrow.parquet as pq 
 import seaborn as sns
 import numpy as np
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from ers_ingest import load_ers
 
 
 plt.rcParams.update({
@@ -25,13 +30,11 @@ files = [
     "Data/ers-fangstmelding-nonan-2025.csv"
 ]
 
-dfs = [pd.read_csv(f) for f in files]
+dfs = [load_ers(f) for f in files]
 df_ers = pd.concat(dfs, ignore_index=True)
 
-df_ers = df_ers[
-    df_ers["Starttidspunkt"].str.contains(" ", na=False) &
-    df_ers["Stopptidspunkt"].str.contains(" ", na=False)
-]
+# load_ers leaves NaT where the time part is missing
+df_ers = df_ers.dropna(subset=["Starttidspunkt", "Stopptidspunkt"])
 
 nr_callsigns_ers = df_ers["Radiokallesignal (ERS)"].nunique()
 
@@ -40,15 +43,8 @@ print(df_ers["Redskap - gruppe"].unique())
 df_ers = df_ers.dropna(subset=["Starttidspunkt", "Stopptidspunkt", "Radiokallesignal (ERS)", "Redskap - gruppe", "Varighet"])
 df_ers = df_ers.drop_duplicates(keep="first")
 
-fmt = "%d.%m.%Y %H:%M:%S"
-df_ers["Starttidspunkt"] = pd.to_datetime(df_ers["Starttidspunkt"], format=fmt)
-df_ers["Stopptidspunkt"] = pd.to_datetime(df_ers["Stopptidspunkt"], format=fmt)
-
 #df_ers = df_ers.loc[df_ers["Starttidspunkt"].between("2024-01-01", "2024-01-31 23:59:59")] # CHANGE for month
 
-df_ers["Radiokallesignal (ERS)"] = df_ers["Radiokallesignal (ERS)"].astype("string").str.strip().str.upper()
-df_ers["Redskap - gruppe"] = df_ers["Redskap - gruppe"].astype("string").str.strip()
-df_ers["Varighet"] = pd.to_numeric(df_ers["Varighet"], errors="coerce")
 df_ers = df_ers.loc[df_ers["Varighet"] < 2880].copy()
 
 gears = ["Trål", "Krokredskap", "Bur og ruser", "Garn", "Not", "Snurrevad"]
@@ -1,7 +1,11 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 
-df = pd.read_parquet("../Data/AIS/whole_month/01clean2.parquet", columns=["mmsi", "date_time_utc", "lon", "lat"], engine="pyarrow")
+from gap_events import gap_events_table
+
+AIS_PATH = "../Data/AIS/whole_month/01clean2.parquet"
+
+df = pd.read_parquet(AIS_PATH, columns=["mmsi"], engine="pyarrow")
 
 first_mmsis = df["mmsi"].drop_duplicates()
 
@@ -38,18 +42,13 @@ plt.show()
 
 threshold = pd.Timedelta(hours=1)
 
-df_small["date_time_utc"] = pd.to_datetime(df_small["date_time_utc"])
+# gaps per vessel from the gap-event table, vessels without gaps count as 0
+events = gap_events_table(AIS_PATH)
+events = events[events["duration_s"] > threshold.total_seconds()]
+n_gaps = events["mmsi"].astype(str).str.strip().value_counts()
 
-df_small = df_small.sort_values(by=["mmsi", "date_time_utc"])
-df_small["gap"] = df_small.groupby("mmsi")["date_time_utc"].diff()
-df_small["large_gap"] = df_small["gap"] > threshold
-
-gap_per_mmsi = (
-    df_small
-    .groupby(["country", "mmsi"])["large_gap"]
-    .sum()
-    .reset_index(name="n_large_gaps")
-)
+gap_per_mmsi = df_small_dropped.dropna(subset=["country"])[["country", "mmsi"]].copy()
+gap_per_mmsi["n_large_gaps"] = gap_per_mmsi["mmsi"].map(n_gaps).fillna(0).astype(int)
 
 # Then average per country
 avg_gap_country = (
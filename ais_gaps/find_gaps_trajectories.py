@@ -4,7 +4,14 @@ import numpy as np
 import seaborn as sns
 import matplotlib.colors as colors
 
-df = pd.read_parquet("../Data/AIS/whole_month/01clean2.parquet", columns=["mmsi", "date_time_utc", "lon", "lat"], engine="pyarrow")
+from gap_events import gap_events_table
+
+AIS_PATH = "../Data/AIS/whole_month/01clean2.parquet"
+MMSI = 257079000
+
+# only the messages of the vessel are read, its gaps come from the gap-event table
+df = pd.read_parquet(AIS_PATH, columns=["mmsi", "date_time_utc", "lon", "lat"],
+                     filters=[("mmsi", "==", MMSI)], engine="pyarrow")
 
 df["date_time_utc"] = pd.to_datetime(df["date_time_utc"])
 
@@ -12,10 +19,11 @@ df["date_time_utc"] = pd.to_datetime(df["date_time_utc"])
 
 #df = df.loc[df["lon"] > 10].copy()
 
-df = df.loc[df["mmsi"] == 257079000]
-
 threshold = pd.Timedelta(hours=1)
 
+events = gap_events_table(AIS_PATH)
+events = events[events["duration_s"] > threshold.total_seconds()]
+
 
 
 for mmsi, d in df.groupby("mmsi"):
@@ -25,11 +33,11 @@ for mmsi, d in df.groupby("mmsi"):
     d = d.iloc[91000:92000]
     min_time = d["date_time_utc"].min()
     max_time = d["date_time_utc"].max()
-    d["gap"] = d["date_time_utc"].diff()
-    d["large_gap"] = (d["gap"] > threshold)
-    nr_gaps = d["large_gap"].sum()
-    gap_messages = d.loc[d["large_gap"] == True].copy()
-    before_gap = d.loc[d["large_gap"].shift(-1, fill_value=False)].copy()
+    # gaps whose both ends are inside the plotted stretch
+    gaps = events[(events["mmsi"] == mmsi) & (events["t_before"] >= min_time) & (events["t_after"] <= max_time)]
+    nr_gaps = len(gaps)
+    gap_messages = pd.DataFrame({"lon": gaps["lon_after"], "lat": gaps["lat_after"]})
+    before_gap = pd.DataFrame({"lon": gaps["lon_before"], "lat": gaps["lat_before"]})
     #print(d.shape)
     #print(gap_messages.shape)
     #print(f"{mmsi}, nr of gaps: {nr_gaps}")
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from geodesy import haversine
+
+# AIS gaps as events: one row per pair of consecutive messages of a vessel
+# that are more than MIN_GAP apart, found with one sort by (mmsi, time) and
+# one diff over the whole file. The table is small next to the messages and
+# is kept next to the AIS file (<stem>.gaps.parquet), so the heatmap, the
+# per-country statistics and the trajectory plots query it instead of each
+# looping over the vessels. Longer thresholds are a filter on duration_s.
+
+GAPS_VERSION = 1
+GAPS_META_KEY = b"gap_events"
+MIN_GAP = pd.Timedelta(hours=1)
+MS_TO_KNOTS = 1.94384
+
+GAP_COLUMNS = ["mmsi", "t_before", "t_after", "duration_s", "lon_before", "lat_before",
+               "lon_after", "lat_after", "distance_m", "implied_speed_kn"]
+
+
+def gap_events(df, min_gap=MIN_GAP):
+    """
+    Gap-event table of df (mmsi, date_time_utc, lon, lat). Rows without a
+    time or mmsi are ignored. Positions, duration, distance and the speed
+    needed to cover the gap are float32.
+    """
+    t = pd.to_datetime(df["date_time_utc"], errors="coerce")
+    t_ns = t.to_numpy().astype("datetime64[ns]").astype(np.int64)
+    codes, _ = pd.factorize(df["mmsi"])
+
+    rows = np.flatnonzero(t.notna().to_numpy() & (codes >= 0))
+    rows = rows[np.lexsort((t_ns[rows], codes[rows]))]
+    c, ts = codes[rows], t_ns[rows]
+
+    dt = ts[1:] - ts[:-1]
+    after = np.flatnonzero((c[1:] == c[:-1]) & (dt > pd.Timedelta(min_gap).value)) + 1
+    a, b = rows[after], rows[after - 1]
+
+    lon = df["lon"].to_numpy(dtype="float64")
+    lat = df["lat"].to_numpy(dtype="float64")
+    duration = (t_ns[a] - t_ns[b]) / 1e9
+    distance = haversine(lat[b], lon[b], lat[a], lon[a])
+
+    return pd.DataFrame({
+        "mmsi": df["mmsi"].to_numpy()[a],
+        "t_before": t_ns[b].astype("datetime64[ns]"),
+        "t_after": t_ns[a].astype("datetime64[ns]"),
+        "duration_s": duration.astype(np.float32),
+        "lon_before": lon[b].astype(np.float32),
+        "lat_before": lat[b].astype(np.float32),
+        "lon_after": lon[a].astype(np.float32),
+        "lat_after": lat[a].astype(np.float32),
+        "distance_m": distance.astype(np.float32),
+        "implied_speed_kn": (distance / duration * MS_TO_KNOTS).astype(np.float32),
+    }, columns=GAP_COLUMNS)
+
+
+def _gaps_fingerprint(parquet_path, min_gap):
+    stat = Path(parquet_path).stat()
+    return {"version": GAPS_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "min_gap_s": pd.Timedelta(min_gap).total_seconds()}
+
+
+def gap_events_table(parquet_path, min_gap=MIN_GAP):
+    """
+    Gap events of one AIS parquet file, read from <stem>.gaps.parquet or
+    built (and saved) when it is missing or the source changed.
+    """
+    parquet_path = Path(parquet_path)
+    out_path = parquet_path.with_name(parquet_path.stem + ".gaps.parquet")
+    fingerprint = _gaps_fingerprint(parquet_path, min_gap)
+    if out_path.exists():
+        stored = (pq.read_schema(out_path).metadata or {}).get(GAPS_META_KEY)
+        if stored is not None and json.loads(stored) == fingerprint:
+            return pd.read_parquet(out_path)
+
+    df = pd.read_parquet(parquet_path, columns=["mmsi", "date_time_utc", "lon", "lat"], engine="pyarrow")
+    events = gap_events(df, min_gap=min_gap)
+
+    table = pa.Table.from_pandas(events, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           GAPS_META_KEY: json.dumps(fingerprint).encode()})
+    tmp = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp)
+    tmp.replace(out_path)
+    print(f"Wrote {len(events)} gap events of {parquet_path} to {out_path}")
+    return events
@@ -1,51 +1,31 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-import seaborn as sns
-import matplotlib.colors as colors
+import sys
+from pathlib import Path
 
-df = pd.read_parquet("../Data/AIS/whole_month/01clean2.parquet", columns=["mmsi", "date_time_utc", "lon", "lat"], engine="pyarrow")
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from gap_events import gap_events_table
+from heatmap_grid import STUDY_AREA, add_points, grid_store, merge_grids, plot_grid
 
-df["date_time_utc"] = pd.to_datetime(df["date_time_utc"])
-
-#first_mmsis = df["mmsi"].drop_duplicates().head(20000)
-
-#df_small = df[df["mmsi"].isin(first_mmsis)]
+# one AIS file per month, the gaps of each (see gap_events.py) are binned
+# once (<stem>.gaps_<threshold>.npz) and the map is the sum of the month grids
+AIS_PATHS = ["../Data/AIS/whole_month/01clean2.parquet"]
+BBOX = None # (lon_min, lat_min, lon_max, lat_max) to map one area instead of STUDY_AREA
+BINS = 150
 
 threshold = pd.Timedelta(hours=1)
 
-lons = []
-lats = []
-
-#fig, ax = plt.subplots(figsize=(10, 8))
-
-for mmsi, d in df.groupby("mmsi"):
-    d = d.sort_values(by="date_time_utc")
-    d["gap"] = d["date_time_utc"].diff()
-    d["large_gap"] = (d["gap"] > threshold)
-    nr_gaps = d["large_gap"].sum()
-    gap_messages = d.loc[d["large_gap"] == True].copy()
-    lons.extend(gap_messages["lon"].values)
-    lats.extend(gap_messages["lat"].values)
-    #print(d.shape)
-    #print(gap_messages.shape)
-    #print(f"{mmsi}, nr of gaps: {nr_gaps}")
-
-    #plt.plot(d["lon"], d["lat"], linewidth=1, label="Trajectory")
-    #ax.scatter(gap_messages["lon"], gap_messages["lat"], s=2, color="red")
+# the month grids share the extent so they add up
+extent = STUDY_AREA if BBOX is None else BBOX
 
-#plt.legend()
 
-fig = plt.figure(figsize=(10,8))
+def fill(grid, path):
+    # first message after every gap longer than threshold
+    events = gap_events_table(path)
+    events = events[events["duration_s"] > threshold.total_seconds()]
+    return add_points(grid, events["lon_after"].to_numpy(), events["lat_after"].to_numpy())
 
-plt.hist2d(lons, lats, bins=150, cmap="hot", norm=colors.LogNorm())
-plt.colorbar(label="Number of AIS gaps", shrink=0.5)
 
-plt.xlabel("Longitude")
-plt.ylabel("Latitude")
-plt.title("Heatmap of AIS Signal Gaps")
+name = f"gaps_{int(threshold.total_seconds())}s"
+grid = merge_grids(grid_store(path, name, extent, BINS, fill) for path in AIS_PATHS)
 
-plt.gca().set_aspect('equal', adjustable='box')
-plt.tight_layout()
-plt.show()
-    
\ No newline at end of file
+plot_grid(grid, label="Number of AIS gaps", title="Heatmap of AIS Signal Gaps")
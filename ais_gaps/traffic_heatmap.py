@@ -1,24 +1,24 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
+import sys
+from pathlib import Path
 
-df = pd.read_parquet("../Data/AIS/whole_month/01clean2.parquet", columns=["mmsi", "date_time_utc", "lon", "lat"], engine="pyarrow")
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from heatmap_grid import STUDY_AREA, add_ais, grid_store, merge_grids, plot_grid
 
-#df["date_time_utc"] = pd.to_datetime(df["date_time_utc"])
+# one AIS file per month, each is binned once (<stem>.traffic.npz) and the
+# map is the sum of the month grids
+AIS_PATHS = ["../Data/AIS/whole_month/01clean2.parquet"]
+BBOX = None # (lon_min, lat_min, lon_max, lat_max) to map one area instead of STUDY_AREA
+BINS = 400
 
-#first_mmsis = df["mmsi"].drop_duplicates().head(20000)
+# the month grids share the extent so they add up
+extent = STUDY_AREA if BBOX is None else BBOX
 
-#df_small = df[df["mmsi"].isin(first_mmsis)]
 
-plt.figure(figsize=(10,8))
+def fill(grid, path):
+    # the original file is streamed, row groups outside the extent are skipped
+    return add_ais(grid, path, bbox=extent)
 
-plt.hist2d(df["lon"], df["lat"], bins=400, cmap="hot", norm=colors.LogNorm())
-plt.colorbar(label="Number of AIS messages", shrink=0.5)
 
-plt.xlabel("Longitude")
-plt.ylabel("Latitude")
-plt.title("Heatmap of AIS messages")
-plt.gca().set_aspect('equal', adjustable='box')
-plt.tight_layout()
-plt.show()
-    
\ No newline at end of file
+grid = merge_grids(grid_store(path, "traffic", extent, BINS, fill) for path in AIS_PATHS)
+
+plot_grid(grid, label="Number of AIS messages", title="Heatmap of AIS messages")
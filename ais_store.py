@@ -0,0 +1,275 @@
+import json
+import os
+import shutil
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Hive-partitioned copy of the monthly AIS files:
+#   AIS_DATASET/year=2024/month=1/bucket=7/part-0.parquet
+# bucket is a stable hash of the (stripped, upper-cased) callsign, rows are
+# time sorted inside each file and row groups carry min/max statistics, so a
+# callsign filter only opens the matching buckets and a bbox/time filter can
+# skip row groups. read_ais also takes a plain parquet file, then it is the
+# same as pq.read_table with the equivalent filters.
+
+AIS_DATASET = "Data/AIS/dataset"
+CALLSIGN_BUCKETS = 32
+ROW_GROUP_ROWS = 256_000
+
+# Spatially clustered single-file copy for tile/bbox queries (spatial_store):
+# rows sorted by day, then by a Hilbert (or Z-order) curve over the
+# quantized (lon, lat), in small row groups whose lat/lon min/max then cover
+# a compact area, so a tile filter skips most row groups of the month.
+SPATIAL_VERSION = 1
+SPATIAL_META_KEY = b"ais_store_spatial"
+SPATIAL_ROW_GROUP_ROWS = 64_000
+CURVE_BITS = 16
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("year", pa.int16()), ("month", pa.int8()), ("bucket", pa.int16())]),
+    flavor="hive",
+)
+
+
+def normalize_callsigns(callsigns):
+    return pd.Series(callsigns, dtype="string").str.strip().str.upper()
+
+
+def callsign_bucket(callsigns, buckets=CALLSIGN_BUCKETS):
+    # crc32, not hash(): it has to be the same in every process and run
+    callsigns = normalize_callsigns(callsigns)
+    uniques, inverse = np.unique(callsigns.fillna("").to_numpy(dtype=object), return_inverse=True)
+    per_unique = np.array([zlib.crc32(c.encode()) % buckets for c in uniques], dtype=np.int16)
+    return per_unique[inverse]
+
+
+def repartition_month(parquet_path, year, month, root=AIS_DATASET, buckets=CALLSIGN_BUCKETS,
+                      row_group_rows=ROW_GROUP_ROWS):
+    """
+    Writes one monthly AIS parquet file into the dataset, replacing that
+    month if it was written before. The month is staged next to the
+    dataset and moved in place at the end, so readers never see half of it.
+    """
+    table = pq.read_table(parquet_path)
+    df_keys = pd.DataFrame({
+        "callsign": normalize_callsigns(table.column("callsign").to_pandas()),
+        "date_time_utc": pd.to_datetime(table.column("date_time_utc").to_pandas(), errors="coerce"),
+    })
+    table = table.set_column(table.schema.get_field_index("callsign"), "callsign",
+                             pa.array(df_keys["callsign"], type=pa.string()))
+    table = table.set_column(table.schema.get_field_index("date_time_utc"), "date_time_utc",
+                             pa.array(df_keys["date_time_utc"]))
+    table = table.append_column("bucket", pa.array(callsign_bucket(df_keys["callsign"], buckets)))
+    table = table.sort_by([("bucket", "ascending"), ("date_time_utc", "ascending")])
+    table = table.replace_schema_metadata(None)  # the pandas metadata still describes the old dtypes
+
+    month_dir = Path(root) / f"year={year}" / f"month={month}"
+    staging = Path(root).parent / f".staging-{Path(root).name}-{year}-{month}"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    ds.write_dataset(
+        table,
+        staging,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("bucket", pa.int16())]), flavor="hive"),
+        max_rows_per_group=row_group_rows,
+        min_rows_per_group=min(row_group_rows, 10_000),
+        basename_template="part-{i}.parquet",
+    )
+
+    month_dir.parent.mkdir(parents=True, exist_ok=True)
+    shutil.rmtree(month_dir, ignore_errors=True)
+    staging.replace(month_dir)
+    print(f"Wrote {table.num_rows} rows of {year}-{month:02d} to {month_dir}")
+    return table.num_rows
+
+
+def open_ais_dataset(source=AIS_DATASET):
+    if Path(source).is_dir():
+        return ds.dataset(source, format="parquet", partitioning=PARTITIONING)
+    return ds.dataset(source, format="parquet")
+
+
+def ais_filter(dataset, callsigns=None, bbox=None, year=None, month=None, time_range=None):
+    """
+    pyarrow.dataset expression for the given filters (None = no filter).
+    bbox is (lon_min, lat_min, lon_max, lat_max), time_range (start, stop)
+    inclusive, year and month an int or a list of ints.
+    """
+    names = dataset.schema.names
+    expr = []
+
+    def isin(field, values):
+        values = [values] if np.isscalar(values) else list(values)
+        return ds.field(field).isin(values)
+
+    if year is not None and "year" in names:
+        expr.append(isin("year", year))
+    if month is not None and "month" in names:
+        expr.append(isin("month", month))
+
+    if callsigns is not None:
+        callsigns = normalize_callsigns(callsigns).dropna().unique().tolist()
+        if "bucket" in names:
+            # partition pruning: only the buckets these callsigns hash to
+            expr.append(isin("bucket", sorted(set(callsign_bucket(callsigns).tolist()))))
+        expr.append(ds.field("callsign").isin(callsigns))
+
+    if bbox is not None:
+        lon_min, lat_min, lon_max, lat_max = bbox
+        expr.append(
+            (ds.field("lon") >= lon_min) & (ds.field("lon") <= lon_max) &
+            (ds.field("lat") >= lat_min) & (ds.field("lat") <= lat_max)
+        )
+
+    if time_range is not None:
+        t = dataset.schema.field("date_time_utc").type
+        if pa.types.is_timestamp(t):
+            start, stop = (pa.scalar(pd.Timestamp(x).to_pydatetime(), type=t) for x in time_range)
+        else:
+            # "YYYY-MM-DD HH:MM:SS" strings compare in time order
+            start, stop = (str(pd.Timestamp(x)) for x in time_range)
+        expr.append((ds.field("date_time_utc") >= start) & (ds.field("date_time_utc") <= stop))
+
+    out = None
+    for e in expr:
+        out = e if out is None else out & e
+    return out
+
+
+def read_ais(source=AIS_DATASET, columns=None, callsigns=None, bbox=None, year=None, month=None,
+             time_range=None):
+    """
+    AIS rows from the partitioned dataset (or a single parquet file) as a
+    DataFrame. Filters are pushed down to partitions and row groups.
+    """
+    dataset = open_ais_dataset(source)
+    expr = ais_filter(dataset, callsigns=callsigns, bbox=bbox, year=year, month=month, time_range=time_range)
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+
+def count_fragments(source=AIS_DATASET, **filters):
+    # how many files a filter touches, to check the pruning
+    dataset = open_ais_dataset(source)
+    return sum(1 for _ in dataset.get_fragments(filter=ais_filter(dataset, **filters)))
+
+
+def count_row_groups(source=AIS_DATASET, **filters):
+    # how many row groups survive the statistics of a filter
+    dataset = open_ais_dataset(source)
+    expr = ais_filter(dataset, **filters)
+    return sum(len(f.split_by_row_group(filter=expr)) for f in dataset.get_fragments(filter=expr))
+
+
+def _quantize(lon, lat, bits):
+    n = (1 << bits) - 1
+    x = np.clip((np.asarray(lon, dtype="float64") + 180.0) / 360.0, 0, 1) * n
+    y = np.clip((np.asarray(lat, dtype="float64") + 90.0) / 180.0, 0, 1) * n
+    valid = np.isfinite(x) & np.isfinite(y)
+    return np.where(valid, x, 0).astype(np.uint64), np.where(valid, y, 0).astype(np.uint64), valid
+
+
+def hilbert_key(lon, lat, bits=CURVE_BITS):
+    """Position of every (lon, lat) on a 2**bits x 2**bits Hilbert curve."""
+    x, y, valid = _quantize(lon, lat, bits)
+    n = np.uint64((1 << bits) - 1)
+    d = np.zeros(len(x), dtype=np.uint64)
+    s = np.uint64(1 << (bits - 1))
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx.astype(np.uint64)) ^ ry.astype(np.uint64))
+        # rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x = np.where(flip, n - x, x)
+        y = np.where(flip, n - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= np.uint64(1)
+    return np.where(valid, d, np.iinfo(np.uint64).max)
+
+
+def zorder_key(lon, lat, bits=CURVE_BITS):
+    """Morton code: the bits of the quantized lon and lat interleaved."""
+    x, y, valid = _quantize(lon, lat, bits)
+    d = np.zeros(len(x), dtype=np.uint64)
+    for b in range(bits):
+        b = np.uint64(b)
+        d |= ((x >> b) & np.uint64(1)) << (np.uint64(2) * b)
+        d |= ((y >> b) & np.uint64(1)) << (np.uint64(2) * b + np.uint64(1))
+    return np.where(valid, d, np.iinfo(np.uint64).max)
+
+
+CURVES = {"hilbert": hilbert_key, "zorder": zorder_key}
+
+
+def _spatial_fingerprint(parquet_path, curve, row_group_rows):
+    stat = Path(parquet_path).stat()
+    return {"version": SPATIAL_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "curve": curve, "bits": CURVE_BITS, "row_group_rows": row_group_rows}
+
+
+def build_spatial_store(parquet_path, out_path, curve="hilbert", row_group_rows=SPATIAL_ROW_GROUP_ROWS):
+    table = pq.read_table(parquet_path)
+    day = pd.to_datetime(table.column("date_time_utc").to_pandas(), errors="coerce").dt.floor("D")
+    day = day.to_numpy().astype("datetime64[D]").astype(np.int64)
+    key = CURVES[curve](table.column("lon").to_numpy(), table.column("lat").to_numpy())
+
+    table = table.take(np.lexsort((key, day)))
+
+    meta = dict(table.schema.metadata or {})
+    meta[SPATIAL_META_KEY] = json.dumps(_spatial_fingerprint(parquet_path, curve, row_group_rows)).encode()
+    table = table.replace_schema_metadata(meta)
+
+    out_path = Path(out_path)
+    tmp = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    try:
+        pq.write_table(table, tmp, row_group_size=row_group_rows)
+        tmp.replace(out_path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    print(f"Wrote spatially sorted {out_path} ({table.num_rows} rows)")
+
+
+def spatial_store(parquet_path, curve="hilbert", row_group_rows=SPATIAL_ROW_GROUP_ROWS):
+    """
+    Path of the spatially clustered copy of parquet_path (<stem>.spatial.parquet
+    next to it), built on first use and rebuilt when the source changes.
+    """
+    parquet_path = Path(parquet_path)
+    out_path = parquet_path.with_name(parquet_path.stem + ".spatial.parquet")
+    if out_path.exists():
+        meta = pq.read_schema(out_path).metadata or {}
+        stored = meta.get(SPATIAL_META_KEY)
+        if stored is not None and json.loads(stored) == _spatial_fingerprint(parquet_path, curve, row_group_rows):
+            return str(out_path)
+
+    build_spatial_store(parquet_path, out_path, curve=curve, row_group_rows=row_group_rows)
+    return str(out_path)
+
+
+YEARS = range(2024, 2024+1)
+MONTHS = range(1, 12+1)
+
+def ais_month_path(year, month):
+    return f"Data/AIS/whole_month_new/{month:02d}_{year}.parquet"
+
+def repartition_main():
+    for year in YEARS:
+        for month in MONTHS:
+            path = ais_month_path(year, month)
+            if not Path(path).exists():
+                print(f"Missing {path}, skipping")
+                continue
+            repartition_month(path, year, month)
+
+
+if __name__ == "__main__":
+    repartition_main()
@@ -1,6 +1,7 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import pyarrow.parquet as pq 
+
+from ais_store import read_ais
 
 # READY TO SAVE GEAR SPECIFIC AIS DATA
 
@@ -49,13 +50,13 @@ print(check[["Radiokallesignal (ERS)", "Redskap - gruppe"]].head())
 print(check["Redskap - gruppe"].unique())
 
 
-table = pq.read_table(
+df_ais = read_ais(
     "Data/AIS/whole_month_new/01_2024.parquet",
     columns=["mmsi", "callsign", "date_time_utc", "lon", "lat", "speed", "cog"],
-    filters=[("callsign", "in", callsigns)]
+    callsigns=callsigns,
+    year=2024,
+    month=1,  # only this month's partitions when pointed at AIS_DATASET
 )
-
-df_ais = table.to_pandas()
 print(df_ais.tail())
 print(df_ais.shape)
 #df_ais.to_csv(f"Data/gear_specific/not_feb_2024.csv", index=False)
@@ -1,6 +1,7 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import pyarrow.parquet as pq 
+
+from ais_store import read_ais
 
 # READY TO SAVE GEAR SPECIFIC AIS DATA
 
@@ -64,13 +65,13 @@ for month in range(1, 12+1):
     print(f"Nr of only {GEAR}: ", len(callsigns)) # Callsigns that have only registered Trål
 
     
-    table = pq.read_table(
+    df_ais = read_ais(
         f"Data/AIS/whole_month_new/{month:02d}.parquet",
         columns=["callsign", "date_time_utc", "speed"],
-        filters=[("callsign", "in", callsigns)]
+        callsigns=callsigns,
+        year=2024,
+        month=month,  # only this month's partitions when pointed at AIS_DATASET
     )
-
-    df_ais = table.to_pandas()
     df_ais.to_parquet(f"gear/not2/{month:02d}.parquet", index=False)
 
 
@@ -1,28 +1,24 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import pyarrow.parquet as pq 
+
+from interval_join import range_join
+from ers_ingest import load_ers
+from ais_store import read_ais
 
 # READY TO SAVE GEAR SPECIFIC AIS DATA
 
 def get_ers(path="Data/ers-fangstmelding-nonan.csv"):
-    df_ers = pd.read_csv(path) #whole of 2024
+    df_ers = load_ers(path) #whole of 2024, typed and cached
 
     print(df_ers["Redskap - gruppe"].unique())
 
     df_ers = df_ers.dropna(subset=["Starttidspunkt", "Stopptidspunkt", "Radiokallesignal (ERS)", "Redskap - gruppe", "Varighet"])
     df_ers = df_ers.drop_duplicates(keep="first")
 
-    fmt = "%d.%m.%Y %H:%M:%S"
-    df_ers["Starttidspunkt"] = pd.to_datetime(df_ers["Starttidspunkt"], format=fmt)
-    df_ers["Stopptidspunkt"] = pd.to_datetime(df_ers["Stopptidspunkt"], format=fmt)
-
     df_ers = df_ers.loc[df_ers["Stopptidspunkt"] >= df_ers["Starttidspunkt"]].copy()
-    df_ers["Varighet"] = pd.to_numeric(df_ers["Varighet"], errors="coerce")
 
     #df_ers = df_ers.loc[df_ers["Starttidspunkt"].between("2024-01-01", "2024-01-31 23:59:59")] # CHANGE for month
 
-    df_ers["Radiokallesignal (ERS)"] = df_ers["Radiokallesignal (ERS)"].astype("string").str.strip().str.upper()
-    df_ers["Redskap - gruppe"] = df_ers["Redskap - gruppe"].astype("string").str.strip()
     df_ers = df_ers.reset_index(drop=True)
     df_ers["ers_id"] = df_ers.index
     return df_ers
@@ -45,15 +41,13 @@ def duration_filter(df, min_duration, max_duration):
 def get_callsigns(df):
     return df["Radiokallesignal (ERS)"].unique()
 
-def read_ais_parquet(parquet_path, callsigns=None):
+def read_ais_parquet(parquet_path, callsigns=None, year=None, month=None):
     columns = ["mmsi", "trajectory_id", "callsign", "date_time_utc", "lon", "lat", "speed", "cog"]
 
-    filters = None
     if callsigns is not None and len(callsigns) > 0:
-        filters = [("callsign", "in", list(callsigns))]
-
-        table = pq.read_table(parquet_path, columns=columns, filters=filters)
-        df_ais = table.to_pandas()
+        # parquet_path can also be the partitioned AIS_DATASET (see ais_store.py),
+        # then year/month keep the read to one month
+        df_ais = read_ais(parquet_path, columns=columns, callsigns=callsigns, year=year, month=month)
     else:
         df_ais = pd.DataFrame(columns=columns)
         print("No callsigns")
@@ -74,41 +68,9 @@ def match_ais_to_ers_windows(df_ais, df_ers):
 
     Output contains AIS columns + selected ERS columns.
     """
-    out = []
-
-    # Group both by callsign so we only compare relevant rows
-    ers_groups = {
-        c: g.sort_values("Starttidspunkt").reset_index(drop=True)
-        for c, g in df_ers.groupby("Radiokallesignal (ERS)", sort=False)
-    }
-
-    for callsign, ais_g in df_ais.groupby("callsign", sort=False):
-        if callsign not in ers_groups:
-            continue
-
-        ers_g = ers_groups[callsign]
-        ais_g = ais_g.sort_values("date_time_utc").reset_index(drop=True)
-
-        # Cross join within one callsign only
-        ais_g = ais_g.assign(_tmp=1)
-        ers_g = ers_g.assign(_tmp=1)
-
-        merged = ais_g.merge(ers_g, on="_tmp", suffixes=("", "_ers")).drop(columns="_tmp")
-
-        matched = merged.loc[
-            (merged["date_time_utc"] >= merged["Starttidspunkt"]) &
-            (merged["date_time_utc"] <= merged["Stopptidspunkt"])
-        ].copy()
-
-        if not matched.empty:
-            out.append(matched)
-
-    if not out:
-        return pd.DataFrame()
-
-    result = pd.concat(out, ignore_index=True)
-
-    return result
+    # Range join per callsign: only emits (AIS row, ERS window) pairs that
+    # overlap, so memory follows the number of matches instead of AIS x ERS
+    return range_join(df_ais, df_ers)
 
 # -----------------------------------
 # Full pipeline
@@ -120,7 +82,9 @@ def create_gear_specific_ais_dataset(
     activities=None,
     min_duration=None,
     max_duration=None,
-    save_path=None
+    save_path=None,
+    year=None,
+    month=None,
 ):
     # Load ERS
     df_ers = get_ers(ers_path)
@@ -140,7 +104,7 @@ def create_gear_specific_ais_dataset(
     callsigns = df_ers["Radiokallesignal (ERS)"].dropna().unique().tolist()
 
     # Load AIS only for relevant callsigns
-    df_ais = read_ais_parquet(ais_parquet_path, callsigns=callsigns)
+    df_ais = read_ais_parquet(ais_parquet_path, callsigns=callsigns, year=year, month=month)
 
     print("AIS rows before time-window filtering:", len(df_ais))
     print("Unique AIS callsigns:", df_ais["callsign"].nunique())
@@ -189,7 +153,9 @@ for month in range(1, 8):
         activities=["Setting av redskap"],   # adjust to your actual values
         min_duration=10,
         max_duration=600,
-        save_path=None              #f"gear/not/{month:02d}.csv"
+        save_path=None,             #f"gear/not/{month:02d}.csv"
+        year=2024,
+        month=month,
     )
 
     print(matched.head())
@@ -0,0 +1,114 @@
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# One place to read the ERS fangstmelding CSVs. The first load of a CSV parses
+# it and writes a typed parquet cache next to it (datetimes, categorical gear
+# columns, normalized callsigns). Later loads read the cache, which is rebuilt
+# automatically when the CSV (size/mtime) or the read options change.
+
+CACHE_VERSION = 1
+CACHE_META_KEY = b"ers_ingest"
+
+TIME_FMT = "%d.%m.%Y %H:%M:%S"
+TIME_COLUMNS = ["Starttidspunkt", "Stopptidspunkt"]
+CALLSIGN_COLUMNS = ["Radiokallesignal (ERS)", "Pumpet fra fartøy"]
+CATEGORY_COLUMNS = ["Redskap - gruppe", "Redskap FAO", "Redskap FDIR", "Aktivitet"]
+
+
+def _parse_times(raw):
+    # Values without a time part (no space) are dropped like before, ISO
+    # strings (CSVs written back by pandas) are accepted as a fallback
+    raw = raw.astype("string")
+    has_time = raw.str.contains(" ", na=False)
+
+    times = pd.to_datetime(raw.where(has_time), format=TIME_FMT, errors="coerce")
+    retry = times.isna() & has_time
+    if retry.any():
+        times[retry] = pd.to_datetime(raw[retry], format="ISO8601", errors="coerce")
+    return times
+
+
+def _ingest_csv(csv_path, **read_csv_kwargs):
+    df_ers = pd.read_csv(csv_path, **read_csv_kwargs)
+
+    for col in TIME_COLUMNS:
+        if col in df_ers.columns:
+            df_ers[col] = _parse_times(df_ers[col])
+
+    if "Varighet" in df_ers.columns:
+        df_ers["Varighet"] = pd.to_numeric(df_ers["Varighet"], errors="coerce")
+
+    for col in CALLSIGN_COLUMNS:
+        if col in df_ers.columns:
+            df_ers[col] = df_ers[col].astype("string").str.strip().str.upper()
+
+    for col in CATEGORY_COLUMNS:
+        if col in df_ers.columns:
+            df_ers[col] = df_ers[col].astype("string").str.strip().astype("category")
+
+    return df_ers
+
+
+def _fingerprint(csv_path, read_csv_kwargs):
+    stat = Path(csv_path).stat()
+    return json.dumps({
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "read_csv": {k: repr(v) for k, v in sorted(read_csv_kwargs.items())},
+    })
+
+
+def cache_path_for(csv_path, cache_dir=None):
+    csv_path = Path(csv_path)
+    cache_dir = csv_path.parent if cache_dir is None else Path(cache_dir)
+    return cache_dir / f"{csv_path.stem}.cache.parquet"
+
+
+def _cached_fingerprint(cache_path):
+    try:
+        meta = pq.read_schema(cache_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    value = meta.get(CACHE_META_KEY)
+    return value.decode() if value is not None else None
+
+
+def load_ers(csv_path, cache_dir=None, refresh=False, **read_csv_kwargs):
+    """
+    Typed ERS frame for csv_path. Extra keyword arguments go to pd.read_csv
+    (e.g. sep=";", decimal="," for the raw DCA files) and are part of the
+    cache key. No rows are dropped here, callers keep their own filters.
+    """
+    cache_path = cache_path_for(csv_path, cache_dir)
+    fingerprint = _fingerprint(csv_path, read_csv_kwargs)
+
+    if not refresh and _cached_fingerprint(cache_path) == fingerprint:
+        return pd.read_parquet(cache_path, engine="pyarrow")
+
+    print(f"Building ERS cache {cache_path} ...")
+    df_ers = _ingest_csv(csv_path, **read_csv_kwargs)
+
+    table = pa.Table.from_pandas(df_ers, preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[CACHE_META_KEY] = fingerprint.encode()
+    table = table.replace_schema_metadata(meta)
+
+    # write to a temporary file first so an interrupted run never leaves a
+    # half-written cache with a valid fingerprint; the pid keeps concurrent
+    # builders of the same cache from writing into one temp file
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        pq.write_table(table, tmp_path)
+        tmp_path.replace(cache_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    return df_ers
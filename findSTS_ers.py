@@ -1,7 +1,8 @@
 import pandas as pd
-import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 
+from ais_store import read_ais
+
 
 df_ers = pd.read_csv("Data/elektronisk-rapportering-ers-2024-fangstmelding-dca.csv", sep=";", encoding="utf-8", decimal=",", engine="python",
                  usecols=["Meldingstidspunkt", "Radiokallesignal (ERS)", "Fartøynavn (ERS)", "Pumpet fra fartøy", 
@@ -36,13 +37,14 @@ sts_callsigns = receiver_vessels + giving_vessels
 
 #print(sts_callsigns)
 
-table = pq.read_table(
+# a single month file or the partitioned AIS_DATASET (only the callsign buckets are read)
+df_ais = read_ais(
     "Data/AIS/whole_month/01clean2.parquet",
     columns=["mmsi", "callsign", "date_time_utc", "lon", "lat"],
-    filters=[("callsign", "in", sts_callsigns)]
+    callsigns=sts_callsigns,
+    year=2024,
+    month=1,  # only this month's partitions when pointed at AIS_DATASET
 )
-
-df_ais = table.to_pandas()
 print(df_ais.shape)
 
 
@@ -1,7 +1,8 @@
 import pandas as pd
-import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 
+from ais_store import read_ais
+
 df = pd.read_csv("Data/fangstdata_2024.csv", sep=";", encoding="utf-8", decimal=",")
 
 df = df[["Fartøynavn", "Fartøy ID", "Radiokallesignal (seddel)",  "Fartøytype (kode)", "Fartøynasjonalitet (kode)", 
@@ -34,14 +35,14 @@ print(sts_callsigns)
 
 check = ["LK3887", "LCMN"]
 
-table = pq.read_table(
+df_ais = read_ais(
     "Data/AIS/whole_month/01.parquet",
     columns=["mmsi", "callsign", "date_time_utc", "lon", "lat"],
-    filters=[("callsign", "in", sts_callsigns)]
+    callsigns=sts_callsigns,
+    year=2024,
+    month=1,  # only this month's partitions when pointed at AIS_DATASET
 )
 
-df_ais = table.to_pandas()
-
 print(df_ais.shape)
 
 
@@ -1,22 +1,15 @@
 import pandas as pd
 import pyarrow.parquet as pq
-import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 import os
+import sys
+from pathlib import Path
 
-# --- your functions (unchanged) ---
-def haversine_m(lon1, lat1, lon2, lat2):
-    R = 6371000.0
-    phi1 = np.radians(lat1)
-    phi2 = np.radians(lat2)
-    dphi = np.radians(lat2 - lat1)
-    dlmb = np.radians(lon2 - lon1)
-    a = np.sin(dphi / 2.0) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2.0) ** 2
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-    return R * c
-
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from geodesy import haversine
 
+# --- your functions (unchanged) ---
 def animate_sts_with_distance(d_rec, d_giv, title="", step="2min",
                               close_threshold_m=None, save_dir="saved_sts",
                               fps=30, dpi=150):
@@ -68,7 +61,7 @@ def animate_sts_with_distance(d_rec, d_giv, title="", step="2min",
             rec_pt.set_data([rlon], [rlat])
             giv_pt.set_data([glon], [glat])
 
-            d_m = haversine_m(rlon, rlat, glon, glat)
+            d_m = haversine(rlat, rlon, glat, glon)
             dist_str = f"dist: {d_m:.0f} m" if d_m < 10_000 else f"dist: {d_m/1000:,.2f} km"
             if close_threshold_m is not None and d_m <= close_threshold_m:
                 dist_str += "  (CLOSE)"
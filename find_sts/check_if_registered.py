@@ -1,5 +1,7 @@
 import pandas as pd
 
+from interval_match import match_intervals, overlap_minutes, unordered_pairs
+
 # Finds the callsigns that are close in proximity from AIS data (sts found in AIS) in the ERS
 # some of them are yes, so we find true sts cases in the ais data!
 
@@ -7,12 +9,16 @@ callsigns = ['JWLM', 'LLMI', 'LJZH', '3YMI', 'LALD', 'LFNM', 'LDIW', 'LJSY', 'LE
              'LIRW', 'LCOV', 'LIZI', 'LCUF', 'LLWF', 'LADH', '3YVG', 'LCGV', 'LJDJ', 'JXUE', 
              'LHEA', 'LKLV', 'LDEF', 'LCJG', 'LLWG', 'LMFZ', 'LMCW', 'LGSH', 'LLLP', 'LLAS']
 
+# an AIS run matches a report of the same callsign pair when they overlap in
+# time after widening the report by BUFFER on both sides
+BUFFER = pd.Timedelta(hours=1)
+
 df_sts = pd.read_csv("consecutive.csv")
+df_sts["start_time"] = pd.to_datetime(df_sts["start_time"])
+df_sts["end_time"] = pd.to_datetime(df_sts["end_time"])
 
-df_sts["pair"] = df_sts.apply(
-    lambda r: tuple(sorted([r["callsign1"], r["callsign2"]])),
-    axis=1
-)
+sts_pairs = unordered_pairs(df_sts["callsign1"], df_sts["callsign2"])
+df_sts["pair"] = list(zip(*sts_pairs))
 
 df_ers = pd.read_csv("../Data/elektronisk-rapportering-ers-2024-fangstmelding-dca.csv", sep=";", engine="python",
                      encoding="utf-8", decimal=",", usecols=["Meldingstidspunkt", "Radiokallesignal (ERS)", 
@@ -28,6 +34,7 @@ df_ers = df_ers.drop_duplicates(
 
 fmt = "%d.%m.%Y %H:%M:%S"
 df_ers["Starttidspunkt"] = pd.to_datetime(df_ers["Starttidspunkt"], format=fmt)
+df_ers["Stopptidspunkt"] = pd.to_datetime(df_ers["Stopptidspunkt"], format=fmt)
 
 df_ers = df_ers.loc[df_ers["Starttidspunkt"].between("2024-01-01", "2024-01-31 23:59:59")]
 
@@ -47,19 +54,25 @@ df_ers["Pumpet fra fartøy"] = (
     .str.upper()
 )
 
-df_ers["pair"] = df_ers.apply(
-    lambda r: tuple(sorted([r["Radiokallesignal (ERS)"], r["Pumpet fra fartøy"]])),
-    axis=1
-)
+ers_pairs = unordered_pairs(df_ers["Radiokallesignal (ERS)"], df_ers["Pumpet fra fartøy"])
+df_ers["pair"] = list(zip(*ers_pairs))
 
 df_ers.to_csv("sts_in_ers_jan.csv", index=False)
 
-ers_pairs = set(df_ers["pair"])
+sts_idx, ers_idx = match_intervals(
+    sts_pairs, df_sts["start_time"], df_sts["end_time"],
+    ers_pairs, df_ers["Starttidspunkt"], df_ers["Stopptidspunkt"],
+    buffer=BUFFER,
+)
 
-matches = df_sts[df_sts["pair"].isin(ers_pairs)]
-matches = matches.drop(columns=["run_id"])
+# one row per (AIS run, ERS report) match
+matches = df_sts.iloc[sts_idx].drop(columns=["run_id"]).reset_index(drop=True)
+ers_cols = ["Radiokallesignal (ERS)", "Pumpet fra fartøy", "Starttidspunkt", "Stopptidspunkt", "Aktivitet"]
+matches = pd.concat([matches, df_ers.iloc[ers_idx][ers_cols].reset_index(drop=True)], axis=1)
+matches["overlap_min"] = overlap_minutes(matches["start_time"], matches["end_time"],
+                                         matches["Starttidspunkt"], matches["Stopptidspunkt"])
 print(matches.head())
-print("Matched pairs:")
+print("Matched pairs:", matches["pair"].nunique())
 matches.to_csv("match_ais_ers_jan.csv", index=False)
 print("Number of matches:", len(matches))
 
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+# Streaming STS encounter detection. Close pairs (pair_records rows) are fed
+# in time chunks, e.g. one day at a time; each pair's consecutive grid times
+# are merged into runs and the runs that reach the end of a chunk stay open
+# in the state so they can continue in the next chunk. Finished runs are
+# kept as encounter rows (start, end, n_points, min distance, mean speeds),
+# so the close-pair rows themselves never have to be written to disk.
+
+MIN_SPEED = 0.25        # both vessels moving, like consecutive.py did
+MAX_HEADING_DIFF = 30   # degrees between the two courses, None = no heading gate
+MIN_POINTS = 2          # shortest run that counts as an encounter
+
+ENCOUNTER_COLUMNS = ["mmsi1", "mmsi2", "run_id", "callsign1", "callsign2", "start_time", "end_time",
+                     "n_points", "min_distance", "mean_speed1", "mean_speed2"]
+
+
+def heading_diff(cog1, cog2):
+    # smallest angle between two courses, 0..180
+    d = np.abs(np.asarray(cog1, dtype="float64") - np.asarray(cog2, dtype="float64")) % 360
+    return np.minimum(d, 360 - d)
+
+
+def gate_pairs(samples, i, j, min_speed=MIN_SPEED, max_heading_diff=MAX_HEADING_DIFF):
+    """
+    Mask of the pairs (i, j) over the rows of samples where both vessels
+    are faster than min_speed and their courses differ by at most
+    max_heading_diff. The resampler interpolates cog along the shorter
+    arc, so courses crossing north compare correctly.
+    """
+    speed = samples["speed"].to_numpy(dtype="float64")
+    keep = (speed[i] > min_speed) & (speed[j] > min_speed)
+    if max_heading_diff is not None:
+        cog = samples["cog"].to_numpy(dtype="float64")
+        keep &= heading_diff(cog[i], cog[j]) <= max_heading_diff
+    return keep
+
+
+def new_encounter_state(step="10min", min_points=MIN_POINTS):
+    return {
+        "step": pd.Timedelta(step).value,
+        "min_points": min_points,
+        "open": None,
+        "finished": [],
+    }
+
+
+def _point_runs(records):
+    # every close pair is a run of one point
+    t = pd.to_datetime(records["time_stamp"]).to_numpy().astype("datetime64[ns]").astype(np.int64)
+    return pd.DataFrame({
+        "mmsi1": records["mmsi1"].to_numpy(dtype=np.int64),
+        "mmsi2": records["mmsi2"].to_numpy(dtype=np.int64),
+        "callsign1": records["callsign1"].to_numpy(),
+        "callsign2": records["callsign2"].to_numpy(),
+        "start_time": t,
+        "end_time": t,
+        "n_points": np.ones(len(records), dtype=np.int64),
+        "min_distance": records["distance"].to_numpy(dtype="float64"),
+        "speed1_sum": records["speed1"].to_numpy(dtype="float64"),
+        "speed2_sum": records["speed2"].to_numpy(dtype="float64"),
+    })
+
+
+def _coalesce(runs, step):
+    # merge runs of the same pair where one starts one step after the other ends
+    if len(runs) == 0:
+        return runs
+    runs = runs.sort_values(["mmsi1", "mmsi2", "start_time"], kind="stable")
+    m1 = runs["mmsi1"].to_numpy(dtype=np.int64)
+    m2 = runs["mmsi2"].to_numpy(dtype=np.int64)
+    s = runs["start_time"].to_numpy(dtype=np.int64)
+    e = runs["end_time"].to_numpy(dtype=np.int64)
+
+    new = np.r_[True, (m1[1:] != m1[:-1]) | (m2[1:] != m2[:-1]) | (s[1:] != e[:-1] + step)]
+    starts = np.flatnonzero(new)
+    ends = np.r_[starts[1:], len(runs)] - 1
+
+    return pd.DataFrame({
+        "mmsi1": m1[starts],
+        "mmsi2": m2[starts],
+        "callsign1": runs["callsign1"].to_numpy()[starts],
+        "callsign2": runs["callsign2"].to_numpy()[starts],
+        "start_time": s[starts],
+        "end_time": e[ends],
+        "n_points": np.add.reduceat(runs["n_points"].to_numpy(dtype=np.int64), starts),
+        "min_distance": np.minimum.reduceat(runs["min_distance"].to_numpy(dtype="float64"), starts),
+        "speed1_sum": np.add.reduceat(runs["speed1_sum"].to_numpy(dtype="float64"), starts),
+        "speed2_sum": np.add.reduceat(runs["speed2_sum"].to_numpy(dtype="float64"), starts),
+    })
+
+
+def _keep_finished(state, runs):
+    runs = runs[runs["n_points"] >= state["min_points"]]
+    if len(runs):
+        state["finished"].append(runs)
+
+
+def update_encounters(state, records, chunk_end=None):
+    """
+    Adds the close pairs of one chunk (pair_records rows, every grid time of
+    the chunk <= chunk_end). Runs that end before chunk_end are finished;
+    the ones that reach it stay open. chunk_end=None keeps every run open.
+    """
+    runs = _point_runs(records)
+    if state["open"] is not None:
+        runs = pd.concat([state["open"], runs], ignore_index=True)
+    runs = _coalesce(runs, state["step"])
+    if chunk_end is None:
+        state["open"] = runs
+        return
+    chunk_end = pd.Timestamp(chunk_end).value
+    done = runs["end_time"].to_numpy(dtype=np.int64) < chunk_end
+    _keep_finished(state, runs[done])
+    state["open"] = runs[~done]
+
+
+def finish_encounters(state):
+    """
+    Closes the open runs and returns all encounters, longest first:
+    mmsi1, mmsi2, run_id (per pair, in time order), callsign1, callsign2,
+    start_time, end_time, n_points, min_distance, mean_speed1, mean_speed2.
+    """
+    if state["open"] is not None:
+        _keep_finished(state, state["open"])
+        state["open"] = None
+
+    if not state["finished"]:
+        return pd.DataFrame(columns=ENCOUNTER_COLUMNS)
+    runs = pd.concat(state["finished"], ignore_index=True)
+    runs = runs.sort_values(["mmsi1", "mmsi2", "start_time"]).reset_index(drop=True)
+
+    n = runs["n_points"].to_numpy(dtype="float64")
+    out = pd.DataFrame({
+        "mmsi1": runs["mmsi1"].astype(np.int64),
+        "mmsi2": runs["mmsi2"].astype(np.int64),
+        "run_id": runs.groupby(["mmsi1", "mmsi2"]).cumcount() + 1,
+        "callsign1": runs["callsign1"],
+        "callsign2": runs["callsign2"],
+        "start_time": pd.to_datetime(runs["start_time"].astype(np.int64)),
+        "end_time": pd.to_datetime(runs["end_time"].astype(np.int64)),
+        "n_points": runs["n_points"].astype(np.int64),
+        "min_distance": runs["min_distance"].astype("float64"),
+        "mean_speed1": runs["speed1_sum"].to_numpy(dtype="float64") / n,
+        "mean_speed2": runs["speed2_sum"].to_numpy(dtype="float64") / n,
+    })
+    return out.sort_values("n_points", ascending=False, kind="stable").reset_index(drop=True)
@@ -2,8 +2,14 @@ import pandas as pd
 import numpy as np
 import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
-from sklearn.neighbors import BallTree
-import math
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from ais_store import read_ais, spatial_store
+from resampler import resample_vessels, to_frame
+from proximity import pair_records, proximity_pairs
+from encounters import finish_encounters, gate_pairs, new_encounter_state, update_encounters
 
 
 AIS_PATH = "../Data/AIS/whole_month/01clean2.parquet"
@@ -11,214 +17,74 @@ AIS_PATH = "../Data/AIS/whole_month/01clean2.parquet"
 REGION_LAT = 55 # We want all vessels north of 62 degrees north
 REGION_LON_EAST = 45
 REGION_LON_WEST = -10
+REGION_BBOX = (REGION_LON_WEST, REGION_LAT, REGION_LON_EAST, 90)
 
 D_METERS = 50
-EARTH_R = 6_371_000
-RADIUS_RAD = D_METERS / EARTH_R
 
 BIN = "10min"
 # Do not interpolate across gaps larger than this
 MAX_INTERP_GAP = pd.Timedelta("15min")
 MIN_POINTS_PER_VESSEL = 3
 
+# vessels never counted as STS candidates (consecutive.py dropped JXVS)
+EXCLUDE_CALLSIGNS = ["JXVS"]
+# the raw point pairs are only needed for debugging, the encounters are the output
+WRITE_CLOSE_PAIRS = False
 
-lat_range = np.linspace(REGION_LAT, 90, 5)
-lon_range = np.linspace(REGION_LON_WEST, REGION_LON_EAST, 5)
-
-def downsample(df, step="10min"):
-    # Ensure datetime format
-    df["date_time_utc"] = pd.to_datetime(df["date_time_utc"])
-    df = df.sort_values(["mmsi", "date_time_utc"])
-    df = df.set_index("date_time_utc")
-    #print(df.head())
-
-    def resample_and_interpolate(g, step="10min", max_gap=pd.Timedelta("15min")):
-        g = g.sort_index()
-
-        # IMPORTANT: make index unique (AIS often has duplicates)
-        if not g.index.is_unique:
-            num_cols = g.select_dtypes(include="number").columns
-            other_cols = [c for c in g.columns if c not in num_cols]
-
-            g_num = g[num_cols].groupby(level=0).mean()
-            g_other = g[other_cols].groupby(level=0).first()
-            g = pd.concat([g_num, g_other], axis=1).sort_index()
-
-        t0, t1 = g.index.min(), g.index.max()
-
-        # regular grid
-        grid = pd.date_range(t0.floor(step), t1.ceil(step), freq=step)
-
-        # union index (now safe because g.index is unique)
-        g_res = g.reindex(g.index.union(grid)).sort_index()
-
-        # mark real observations (before interpolation)
-        is_obs = g_res["lon"].notna() & g_res["lat"].notna()
-
-        # interpolate numeric columns by time
-        num_cols = g_res.select_dtypes(include="number").columns
-        g_res[num_cols] = g_res[num_cols].interpolate(method="time", limit_area="inside")
-
-        # blank out interpolation inside big gaps between consecutive observations
-        obs_times = g_res.index[is_obs]
-        if len(obs_times) >= 2:
-            gaps = obs_times.to_series().diff()
-            big_starts = obs_times[1:][gaps.iloc[1:].values > max_gap]
-
-            for t_start in big_starts:
-                t_prev = obs_times[obs_times.get_loc(t_start) - 1]
-                mask = (g_res.index > t_prev) & (g_res.index < t_start)
-                g_res.loc[mask, num_cols] = np.nan
-
-        # keep only grid timestamps inside original span
-        g_res = g_res.loc[g_res.index.isin(grid)]
-        g_res = g_res.loc[(g_res.index >= t0) & (g_res.index <= t1)]
-
-        # fill non-numeric (safe even if callsign missing)
-        for col in ["callsign", "day"]:
-            if col in g_res.columns:
-                g_res[col] = g_res[col].ffill().bfill().infer_objects(copy=False)
-
-        return g_res
-
-
-    resampled_parts = []
-
-    for mmsi_val, g in df.groupby("mmsi", sort=False):
-        g_res = resample_and_interpolate(g, step=step, max_gap=MAX_INTERP_GAP)
-        g_res["mmsi"] = mmsi_val
-        resampled_parts.append(g_res)
-
-    resampled = pd.concat(resampled_parts)
-    resampled.index.name = "date_time_utc"
-    resampled = resampled.reset_index()   # creates resampled["date_time_utc"]
-
-    return resampled
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000 # Radius of the earth in meters
-
-    dLat = (lat2 - lat1) * math.pi / 180.0
-    dLon = (lon2 - lon1) * math.pi / 180.0
-
-    # convert to radians
-    lat1 = (lat1) * math.pi / 180.0
-    lat2 = (lat2) * math.pi / 180.0
-
-    # apply formulae
-    a = (pow(np.sin(dLat / 2), 2) + 
-         pow(np.sin(dLon / 2), 2) * 
-             np.cos(lat1) * np.cos(lat2))
-    
-    c = 2 * np.arcsin(np.sqrt(a))
-
-    dist = R * c
-
-    return dist
-
-def pairs_within_radius(d_time, r_rad=RADIUS_RAD):
-    x = d_time[["mmsi", "callsign", "lat", "lon"]].dropna()
-    if len(x) < 2:
-        return set()
-
-    coords_rad = np.deg2rad(x[["lat", "lon"]].to_numpy())
-    tree = BallTree(coords_rad, metric="haversine")
-
-    # neighbors[i] = array of indices in x within radius of i (includes i itself)
-    neighbors = tree.query_radius(coords_rad, r=r_rad)
-
-    mmsis = x["mmsi"].to_numpy(dtype=np.int64)
-    pairs = set()
+COLUMNS = ["mmsi", "lat", "lon", "date_time_utc", "speed", "cog", "ship_type", "callsign"]
 
-    for i, neigh in enumerate(neighbors):
-        for j in neigh:
-            if j <= i:
-                continue  # avoid self + duplicates
-            m1 = int(mmsis[i])
-            m2 = int(mmsis[j])
-            if m1 != m2:
-                pairs.add((m1, m2) if m1 < m2 else (m2, m1))
 
-    return pairs
+# Day + Hilbert curve sorted copy of the month, so the read of one day only
+# decodes the row groups of that day
+TILE_PATH = spatial_store(AIS_PATH)
 
+month_times = pd.to_datetime(pq.read_table(TILE_PATH, columns=["date_time_utc"]).column("date_time_utc").to_pandas())
+days = pd.date_range(month_times.min().floor("D"), month_times.max().floor("D"), freq="D")
 
+# One pass per day over the whole region: all vessels resampled onto the BIN
+# grid at once and every pair closer than D_METERS found by one proximity
+# join on (grid time, 3-D cell) keys (see proximity.py). No tiles, so pairs
+# on both sides of a tile border are no longer missed. Pairs that pass the
+# speed and heading gates go straight into the encounter runs (see
+# encounters.py); a run still going at the end of the day stays open.
 close_pairs = []
-for i in range(len(lon_range)-1):
-    for j in range(len(lat_range)-1):
-
-
-        lon_min, lon_max = lon_range[i], lon_range[i+1]
-        lat_min, lat_max = lat_range[j], lat_range[j+1]
-        table = pq.read_table(
-            AIS_PATH,
-            columns=["mmsi", "lat", "lon", "date_time_utc", "speed", "cog", "ship_type", "callsign"],
-            filters=[
-                ("lat", ">=", lat_min),
-                ("lat", "<",  lat_max),
-                ("lon", ">=", lon_min),
-                ("lon", "<",  lon_max),
-            ],
-        )
-
-        df_tile = table.to_pandas()
-
-
-        if df_tile.shape[0] == 0: # no messages within this tile
-            continue # skip
-        
-        else:
-            df_tile["date_time_utc"] = pd.to_datetime(df_tile["date_time_utc"])
-            df_tile["day"] = df_tile["date_time_utc"].dt.floor("D")
-
-            for day, df_day in df_tile.groupby("day"):
-                df_resampled = downsample(df_day)
-                for time_stamp, d_time in df_resampled.groupby("date_time_utc"):
-                    #print(time_stamp, ": ", d_time.shape)
-                    
-                    # Check distance between each point (TEST)
-                    #print(d_time.iloc[0]["mmsi"], d_time.iloc[1]["mmsi"])
-                    pairs = pairs_within_radius(d_time)
-
-                    if pairs:
-                        #print(time_stamp, "pairs:", len(pairs))
-                        # print a few
-                        #print(pairs)
-                        for k, (m1, m2) in enumerate(sorted(pairs)):
-                            dm1 = d_time.loc[d_time["mmsi"] == m1].copy()
-                            dm2 = d_time.loc[d_time["mmsi"] == m2].copy()
-                            lon1, lat1 = dm1["lon"].iloc[0], dm1["lat"].iloc[0]
-                            lon2, lat2 = dm2["lon"].iloc[0], dm2["lat"].iloc[0]
-                            callsign1 = dm1["callsign"].iloc[0]
-                            callsign2 = dm2["callsign"].iloc[0]
-                            speed1 = dm1["speed"].mean()
-                            speed2 = dm2["speed"].mean()
-                            dist = haversine(lat1, lon1, lat2, lon2)
-                            append_dict = {
-                                "mmsi1": m1,
-                                "mmsi2": m2,
-                                "callsign1": callsign1,
-                                "callsign2": callsign2,
-                                "time_stamp": time_stamp,
-                                "lon1": lon1,
-                                "lat1": lat1,
-                                "lon2": lon2,
-                                "lat2": lat2,
-                                "distance": dist,
-                                "speed1": speed1,
-                                "speed2": speed2
-                            }
-                            close_pairs.append(append_dict)
-                            #print(f"Distance between {m1} and {m2} at time {time_stamp}: {dist:.2f}, speed: {speed1}, {speed2}")
-
-                            #print(" ", m1, m2)
-
-
-df_close_pairs = pd.DataFrame(close_pairs)
-dups = df_resampled.duplicated(subset=["mmsi", "date_time_utc"]).sum()
-print("duplicates (mmsi,time) in df_resampled:", dups)
-
-df_close_pairs.to_csv("close_pairs.csv", index=False)  
+encounters = new_encounter_state(step=BIN)
+for day in days:
+    df_day = read_ais(TILE_PATH, columns=COLUMNS, bbox=REGION_BBOX,
+                      time_range=(day, day + pd.Timedelta("1D") - pd.Timedelta("1ns")))
+    if df_day.shape[0] == 0: # no messages within the region this day
+        continue
+
+    df_day["date_time_utc"] = pd.to_datetime(df_day["date_time_utc"])
+    df_day["day"] = day
+    tracks = resample_vessels(df_day, step=BIN, max_gap=MAX_INTERP_GAP)
+    df_resampled = to_frame(tracks)
+
+    # the samples the BallTree used: mmsi, callsign, lat and lon known
+    usable = (
+        df_resampled[["mmsi", "callsign", "lat", "lon"]].notna().all(axis=1) &
+        ~df_resampled["callsign"].isin(EXCLUDE_CALLSIGNS)
+    ).to_numpy()
+    lat = np.where(usable, df_resampled["lat"].to_numpy(dtype="float64"), np.nan)
+    lon = np.where(usable, df_resampled["lon"].to_numpy(dtype="float64"), np.nan)
+    pair_i, pair_j, pair_dist = proximity_pairs(tracks["t_idx"], lat, lon, D_METERS)
+
+    if WRITE_CLOSE_PAIRS:
+        close_pairs.append(pair_records(df_resampled, pair_i, pair_j, pair_dist))
+
+    keep = gate_pairs(df_resampled, pair_i, pair_j)
+    records = pair_records(df_resampled, pair_i[keep], pair_j[keep], pair_dist[keep])
+    update_encounters(encounters, records, chunk_end=day + pd.Timedelta("1D") - pd.Timedelta(BIN))
+    print(f"{day.date()}: {len(pair_i)} close pairs, {keep.sum()} after gating")
+
+
+runs = finish_encounters(encounters)
+print(runs.head())
+print("Number of sts-cases found:", len(runs))
+runs.to_csv("consecutive.csv", index=False)
+
+if WRITE_CLOSE_PAIRS:
+    pd.concat(close_pairs, ignore_index=True).to_csv("close_pairs.csv", index=False)
 # Notes
 # Remove stationary doesnt work perfectly, think this works now
-# Finds cases where dist < 50, need to find consecutive 
-# Interpolates over removed stationary parts of trajectories -> fixed i think but take a look
\ No newline at end of file
+# Interpolates over removed stationary parts of trajectories -> fixed i think but take a look
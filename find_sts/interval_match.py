@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# Matches time intervals of two tables that belong to the same unordered
+# callsign pair, e.g. AIS encounter runs against ERS transshipment reports.
+# The reports are sorted by (pair, start) and every pair's running maximum
+# of the end time is kept next to it (the "max end" of an interval tree,
+# flattened into arrays). Both are non-decreasing inside a pair, so the
+# candidates of a query [start, end] are one slice found with two binary
+# searches: from the first report whose running max end reaches the query
+# start to the last report that starts before the query end.
+
+
+def unordered_pairs(a, b):
+    """Callsigns a, b (stripped, upper case) ordered so a <= b, row by row."""
+    a = pd.Series(a, dtype="string").str.strip().str.upper()
+    b = pd.Series(b, dtype="string").str.strip().str.upper()
+    swap = (a > b).fillna(False).to_numpy()
+    first = np.where(swap, b.to_numpy(dtype=object), a.to_numpy(dtype=object))
+    second = np.where(swap, a.to_numpy(dtype=object), b.to_numpy(dtype=object))
+    return first, second
+
+
+def _seconds(t):
+    return pd.to_datetime(pd.Series(t)).to_numpy().astype("datetime64[s]").astype(np.int64)
+
+
+def match_intervals(query_pairs, query_start, query_end, ref_pairs, ref_start, ref_end, buffer="0min"):
+    """
+    All (query row, reference row) combinations with the same pair whose
+    intervals overlap once the reference interval is widened by buffer on
+    both sides. Pairs are (first, second) tuples of arrays from
+    unordered_pairs, rows with a missing callsign never match.
+    Returns (query index, reference index) arrays.
+    """
+    buffer = pd.Timedelta(buffer).value // 10**9
+
+    # one integer code per pair, shared by both tables
+    n_query = len(query_pairs[0])
+    keys = pd.Series(np.r_[query_pairs[0], ref_pairs[0]], dtype="string") + "|" + \
+           pd.Series(np.r_[query_pairs[1], ref_pairs[1]], dtype="string")
+    codes, _ = pd.factorize(keys)   # missing callsign -> missing key -> -1
+    q_code, r_code = codes[:n_query], codes[n_query:]
+
+    q_start, q_end = _seconds(query_start), _seconds(query_end)
+    r_start, r_end = _seconds(ref_start) - buffer, _seconds(ref_end) + buffer
+
+    ref = np.flatnonzero(r_code >= 0)
+    ref = ref[np.lexsort((r_start[ref], r_code[ref]))]
+    empty = np.empty(0, dtype=np.int64)
+    if len(ref) == 0:
+        return empty, empty
+
+    # running max of the end time inside every pair
+    max_end = pd.Series(r_end[ref]).groupby(r_code[ref]).cummax().to_numpy()
+
+    # (pair, time) packed in one int64 so both searches cover every pair at once
+    t0 = np.r_[q_start, r_start].min()
+    span = np.r_[q_end, max_end].max() - t0 + 2
+    if (codes.max() + 1) * float(span) >= 2 ** 63:
+        raise ValueError("too many pairs over too long a period for one int64 key")
+    start_key = r_code[ref] * span + (r_start[ref] - t0)
+    end_key = r_code[ref] * span + (max_end - t0)
+
+    q = np.flatnonzero(q_code >= 0)
+    lo = np.searchsorted(end_key, q_code[q] * span + (q_start[q] - t0), side="left")
+    hi = np.searchsorted(start_key, q_code[q] * span + (q_end[q] - t0), side="right")
+    n = np.maximum(hi - lo, 0)
+
+    qi = np.repeat(q, n)
+    ri = ref[np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)]
+    # the slice can still hold shorter reports nested before the query
+    keep = (r_end[ri] >= q_start[qi]) & (r_start[ri] <= q_end[qi])
+    return qi[keep], ri[keep]
+
+
+def overlap_minutes(start1, end1, start2, end2):
+    # length of the common part of two intervals, 0 when they are apart
+    start = np.maximum(_seconds(start1), _seconds(start2))
+    end = np.minimum(_seconds(end1), _seconds(end2))
+    return np.maximum(end - start, 0) / 60
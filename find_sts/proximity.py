@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from geodesy import EARTH_R, haversine
+
+# Proximity join for resampled positions: all pairs of samples at the same
+# grid time that are within radius_m of each other, for the whole region at
+# once. Positions are hashed into (time, cell) keys on the unit sphere in 3-D
+# (cells of one chord radius, so there are no lon/lat seams or tile edges),
+# and each sample is only compared with the samples in its 27 neighbouring
+# cells. The candidates are then checked with the haversine distance.
+
+def _cells(lat, lon, cell_m):
+    lat, lon = np.radians(lat), np.radians(lon)
+    xyz = np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=1)
+    return np.floor(xyz * EARTH_R / cell_m).astype(np.int64)
+
+
+def proximity_pairs(t_idx, lat, lon, radius_m):
+    """
+    t_idx, lat, lon: one entry per sample (NaN positions are ignored).
+    Returns (i, j, dist) with i < j, t_idx[i] == t_idx[j] and
+    dist = haversine distance <= radius_m, every pair once.
+    """
+    t_idx = np.asarray(t_idx, dtype=np.int64)
+    lat = np.asarray(lat, dtype="float64")
+    lon = np.asarray(lon, dtype="float64")
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+
+    ok = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    if len(ok) < 2:
+        return empty
+
+    # chord <= arc, so two samples within radius_m are at most one cell apart per axis
+    cell = _cells(lat[ok], lon[ok], radius_m)
+    cell -= cell.min(axis=0) - 1   # >= 1, so the -1 neighbour stays >= 0
+    t = t_idx[ok] - t_idx[ok].min()
+
+    # mixed-radix int64 key (time, cx, cy, cz)
+    sizes = np.r_[t.max() + 1, cell.max(axis=0) + 2].astype(np.int64)
+    if np.prod(sizes.astype(float)) >= 2 ** 63:
+        raise ValueError("region/time range too large for one key, join smaller time chunks")
+    mult = np.r_[np.cumprod(sizes[::-1])[::-1][1:], 1].astype(np.int64)
+
+    key = t * mult[0] + cell[:, 0] * mult[1] + cell[:, 1] * mult[2] + cell[:, 2] * mult[3]
+    order = np.argsort(key, kind="stable")
+    cells, start, count = np.unique(key[order], return_index=True, return_counts=True)
+
+    # half of the 27-cell stencil: every pair of cells is visited once, from
+    # the cell with the smaller key; inside one cell only a < b is kept
+    offsets = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+    offsets = [o for o in offsets if o >= (0, 0, 0)]
+
+    ii, jj = [], []
+    for dx, dy, dz in offsets:
+        q = cells + dx * mult[1] + dy * mult[2] + dz * mult[3]
+        pos = np.minimum(np.searchsorted(cells, q), len(cells) - 1)
+        src = np.flatnonzero(cells[pos] == q)
+        if len(src) == 0:
+            continue
+        dst = pos[src]
+
+        # all (sample in src cell, sample in dst cell) combinations
+        n_pair = count[src] * count[dst]
+        c = np.repeat(np.arange(len(src)), n_pair)
+        k = np.arange(n_pair.sum()) - np.repeat(np.cumsum(n_pair) - n_pair, n_pair)
+        a = order[start[src][c] + k // count[dst][c]]
+        b = order[start[dst][c] + k % count[dst][c]]
+        if (dx, dy, dz) == (0, 0, 0):
+            keep = a < b
+            a, b = a[keep], b[keep]
+        ii.append(np.minimum(a, b))
+        jj.append(np.maximum(a, b))
+
+    if not ii:
+        return empty
+    i, j = np.concatenate(ii), np.concatenate(jj)
+    i, j = ok[i], ok[j]
+    dist = haversine(lat[i], lon[i], lat[j], lon[j])
+    keep = dist <= radius_m
+    return i[keep], j[keep], dist[keep]
+
+
+def pair_records(samples, i, j, dist):
+    """
+    close_pairs.csv rows for the pairs (i, j, dist) of proximity_pairs over
+    the rows of samples (resampled frame with mmsi, callsign, lat, lon,
+    speed, date_time_utc). Everything is gathered by position; pairs of
+    the same mmsi are dropped and mmsi1 < mmsi2.
+    """
+    mmsi = samples["mmsi"].to_numpy(dtype=np.int64)
+    keep = mmsi[i] != mmsi[j]
+    i, j, dist = i[keep], j[keep], dist[keep]
+    swap = mmsi[i] > mmsi[j]
+    a, b = np.where(swap, j, i), np.where(swap, i, j)
+
+    callsign = samples["callsign"].to_numpy()
+    lat = samples["lat"].to_numpy(dtype="float64")
+    lon = samples["lon"].to_numpy(dtype="float64")
+    speed = samples["speed"].to_numpy(dtype="float64")
+    return pd.DataFrame({
+        "mmsi1": mmsi[a],
+        "mmsi2": mmsi[b],
+        "callsign1": callsign[a],
+        "callsign2": callsign[b],
+        "time_stamp": samples["date_time_utc"].to_numpy()[a],
+        "lon1": lon[a],
+        "lat1": lat[a],
+        "lon2": lon[b],
+        "lat2": lat[b],
+        "distance": dist,
+        "speed1": speed[a],
+        "speed2": speed[b],
+    })
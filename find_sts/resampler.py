@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+
+# Batched version of downsample/resample_and_interpolate. All vessels are
+# handled at once on arrays sorted by (vessel, time): duplicate timestamps are
+# averaged with run reductions, every vessel's grid points are located with
+# one searchsorted and interpolated linearly between the two surrounding
+# observations, and grid points inside a gap longer than max_gap are NaN.
+# Angles (cog) are averaged and interpolated as sin/cos and turned back into
+# degrees with arctan2, so a course from 350 to 10 passes through 0, not 180.
+
+MAX_INTERP_GAP = pd.Timedelta("15min")
+ANGLE_COLUMNS = ["cog"]
+
+
+def _runs(*keys):
+    # start of every run of equal consecutive keys
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[:1] = True
+    for k in keys:
+        change[1:] |= k[1:] != k[:-1]
+    return np.flatnonzero(change)
+
+
+def _neighbours(keys, key_vessel, q_keys, q_vessel):
+    """
+    For sorted keys and query keys: index of the last key <= query (lo), the
+    first key >= query (hi), whether the query hits a key exactly and whether
+    both neighbours exist inside the query's own vessel.
+    """
+    if len(keys) == 0:
+        z = np.zeros(len(q_keys), dtype=np.int64)
+        return z, z, np.zeros(len(q_keys), dtype=bool), np.zeros(len(q_keys), dtype=bool)
+
+    pos = np.searchsorted(keys, q_keys, side="left")
+    hi = np.minimum(pos, len(keys) - 1)
+    exact = (pos < len(keys)) & (keys[hi] == q_keys)
+    lo = np.where(exact, hi, np.maximum(pos - 1, 0))
+    inside = (pos < len(keys)) & (exact | (pos > 0))
+    inside &= (key_vessel[hi] == q_vessel) & (key_vessel[lo] == q_vessel)
+    return lo, hi, exact, inside
+
+
+def resample_vessels(df, step="10min", max_gap=MAX_INTERP_GAP, id_col="mmsi", time_col="date_time_utc",
+                     angle_cols=ANGLE_COLUMNS):
+    """
+    Interpolates every vessel of df onto the step grid inside its own
+    [first, last] observation. Numeric columns are interpolated in time,
+    other columns take the last known value (first known before that).
+    angle_cols (degrees) are interpolated along the shorter arc.
+
+    Returns a dict with one entry per grid sample:
+      "times": sorted unique grid times, "ids": sorted vessel ids,
+      "t_idx"/"v_idx": time and vessel index of every sample,
+      "values": {numeric column: float array}, "other": {column: array}
+    """
+    step_ns = pd.Timedelta(step).value
+    max_gap_ns = pd.Timedelta(max_gap).value
+
+    t = pd.to_datetime(df[time_col]).to_numpy().astype("datetime64[ns]").astype(np.int64)
+    ids, vessel = np.unique(df[id_col].to_numpy(), return_inverse=True)
+    order = np.lexsort((t, vessel))
+    t, vessel = t[order], vessel[order]
+
+    num_cols = [c for c in df.select_dtypes(include="number").columns if c != id_col]
+    other_cols = [c for c in df.columns if c not in num_cols and c not in (id_col, time_col)]
+    angle_cols = [c for c in angle_cols if c in num_cols]
+
+    # the columns that are averaged and interpolated, angles as sin and cos
+    columns = {}
+    for c in num_cols:
+        x = df[c].to_numpy(dtype="float64")[order]
+        if c in angle_cols:
+            columns[(c, "sin")] = np.sin(np.deg2rad(x))
+            columns[(c, "cos")] = np.cos(np.deg2rad(x))
+        else:
+            columns[c] = x
+
+    # duplicate (vessel, time): mean of numeric columns, first of the rest
+    starts = _runs(vessel, t)
+    obs_t, obs_v = t[starts], vessel[starts]
+    obs_num = {}
+    for c, x in columns.items():
+        finite = ~np.isnan(x)
+        n = np.add.reduceat(finite.astype(np.int64), starts)
+        s = np.add.reduceat(np.where(finite, x, 0.0), starts)
+        with np.errstate(invalid="ignore"):
+            obs_num[c] = np.where(n > 0, s / np.maximum(n, 1), np.nan)
+    obs_other = {}
+    run_id = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(t)]))
+    for c in other_cols:
+        # first known value of the duplicates, then ffill/bfill inside each vessel
+        s = pd.Series(df[c].to_numpy()[order]).groupby(run_id).first()
+        obs_other[c] = s.groupby(obs_v).ffill().groupby(obs_v).bfill().to_numpy()
+
+    # a row counts as an observation when both coordinates are known
+    is_obs = np.ones(len(obs_t), dtype=bool)
+    for c in ("lat", "lon"):
+        if c in obs_num:
+            is_obs &= ~np.isnan(obs_num[c])
+
+    # grid points inside [first, last] of every vessel
+    seg = _runs(obs_v)
+    seg_end = np.r_[seg[1:], len(obs_t)] - 1
+    g_first = -(-obs_t[seg] // step_ns)   # ceil
+    g_last = obs_t[seg_end] // step_ns
+    n_grid = np.maximum(g_last - g_first + 1, 0)
+    g_vessel = np.repeat(obs_v[seg], n_grid)
+    g_t = (np.repeat(g_first, n_grid) + np.arange(n_grid.sum()) - np.repeat(np.cumsum(n_grid) - n_grid, n_grid)) * step_ns
+
+    # (vessel, time rank) packed in one int64 so a single searchsorted finds
+    # the neighbours of every grid point inside its own vessel
+    all_t = np.unique(np.r_[obs_t, g_t])
+    stride = np.int64(len(all_t) + 1)
+    obs_key = obs_v.astype(np.int64) * stride + np.searchsorted(all_t, obs_t)
+    g_key = g_vessel.astype(np.int64) * stride + np.searchsorted(all_t, g_t)
+
+    values = {}
+    for c in columns:
+        # like interpolate(method="time", limit_area="inside") on each column:
+        # only the observations where this column is known are used
+        valid = np.flatnonzero(~np.isnan(obs_num[c]))
+        lo, hi, exact, inside = _neighbours(obs_key[valid], obs_v[valid], g_key, g_vessel)
+        lo, hi = valid[lo], valid[hi]
+        x = obs_num[c]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            w = (g_t - obs_t[lo]) / (obs_t[hi] - obs_t[lo])
+            v = np.where(exact, x[hi], x[lo] + w * (x[hi] - x[lo]))
+        values[c] = np.where(inside, v, np.nan)
+
+    # blank grid points strictly between two observations (known lat/lon)
+    # that are more than max_gap apart
+    pos = np.flatnonzero(is_obs)
+    lo, hi, exact, inside = _neighbours(obs_key[pos], obs_v[pos], g_key, g_vessel)
+    in_gap = inside & ~exact & (obs_t[pos[hi]] - obs_t[pos[lo]] > max_gap_ns)
+    for c in columns:
+        values[c][in_gap] = np.nan
+    for c in angle_cols:
+        deg = np.rad2deg(np.arctan2(values.pop((c, "sin")), values.pop((c, "cos")))) % 360
+        values[c] = np.where(deg >= 360, deg - 360, deg)   # -0.0 % 360 rounds to 360
+    values = {c: values[c] for c in num_cols}
+
+    # other columns: last known value at or before the grid point
+    last = np.searchsorted(obs_key, g_key, side="right") - 1
+
+    times, t_idx = np.unique(g_t, return_inverse=True)
+    return {
+        "times": times.astype("datetime64[ns]"),
+        "ids": ids,
+        "t_idx": t_idx,
+        "v_idx": g_vessel,
+        "values": values,
+        "other": {c: obs_other[c][last] for c in other_cols},
+    }
+
+
+def dense(tracks, col):
+    """(time x vessel) array of one numeric column, NaN where a vessel has no sample."""
+    out = np.full((len(tracks["times"]), len(tracks["ids"])), np.nan)
+    out[tracks["t_idx"], tracks["v_idx"]] = tracks["values"][col]
+    return out
+
+
+def to_frame(tracks, id_col="mmsi", time_col="date_time_utc"):
+    # long format, one row per (vessel, grid time), like downsample returned
+    out = pd.DataFrame({time_col: tracks["times"][tracks["t_idx"]]})
+    for c, x in tracks["values"].items():
+        out[c] = x
+    for c, x in tracks["other"].items():
+        out[c] = x
+    out[id_col] = tracks["ids"][tracks["v_idx"]]
+    return out
@@ -0,0 +1,112 @@
+import time
+
+import numpy as np
+
+# Distances on the sphere for AIS positions, shared by all scripts instead of
+# a haversine copy per file. Every kernel takes degrees, broadcasts like
+# numpy and returns metres in the requested dtype. float64 is the default;
+# float32 halves the memory traffic, but a float32 latitude is itself only
+# good to about a metre, so that is the error to expect. Coordinate order
+# is always lat, lon.
+#
+#   haversine        great circle distance, exact on the sphere
+#   equirectangular  flat-earth approximation around the mean latitude, no
+#                    arcsin/sqrt of a product, for hops below a few km
+#   distance         either of the two, method="haversine"/"equirect"
+#   pairwise         n x m matrix between two sets of points
+#   to_many          one point to many points
+#   along_track      consecutive points of sorted tracks
+#
+# python geodesy.py prints the throughput of every kernel.
+
+EARTH_R = 6_371_000.0
+DEG = np.pi / 180
+
+
+def _as(dtype, *xs):
+    return [np.asarray(x, dtype=dtype) for x in xs]
+
+
+def haversine(lat1, lon1, lat2, lon2, dtype=np.float64):
+    lat1, lon1, lat2, lon2 = _as(dtype, lat1, lon1, lat2, lon2)
+    # differences before the conversion, so short distances keep their digits in float32
+    s_lat = np.sin((lat2 - lat1) * (DEG / 2))
+    s_lon = np.sin((lon2 - lon1) * (DEG / 2))
+    a = s_lat * s_lat + np.cos(lat1 * DEG) * np.cos(lat2 * DEG) * (s_lon * s_lon)
+    return (2 * EARTH_R) * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def equirectangular(lat1, lon1, lat2, lon2, dtype=np.float64):
+    lat1, lon1, lat2, lon2 = _as(dtype, lat1, lon1, lat2, lon2)
+    dlon = lon2 - lon1
+    dlon = np.where(dlon > 180, dlon - 360, np.where(dlon < -180, dlon + 360, dlon))
+    x = dlon * np.cos((lat1 + lat2) * (DEG / 2))
+    y = lat2 - lat1
+    return (EARTH_R * DEG) * np.sqrt(x * x + y * y)
+
+
+KERNELS = {"haversine": haversine, "equirect": equirectangular}
+
+
+def distance(lat1, lon1, lat2, lon2, method="haversine", dtype=np.float64):
+    return KERNELS[method](lat1, lon1, lat2, lon2, dtype=dtype)
+
+
+def pairwise(lat1, lon1, lat2, lon2, method="haversine", dtype=np.float64):
+    """(len(lat1), len(lat2)) matrix of distances between two point sets."""
+    lat1, lon1 = np.asarray(lat1)[:, None], np.asarray(lon1)[:, None]
+    return distance(lat1, lon1, np.asarray(lat2)[None, :], np.asarray(lon2)[None, :], method, dtype)
+
+
+def to_many(lat, lon, lats, lons, method="haversine", dtype=np.float64):
+    """Distance from one point to every point of lats/lons."""
+    return distance(lat, lon, lats, lons, method, dtype)
+
+
+def along_track(lat, lon, first=None, method="haversine", dtype=np.float64):
+    """
+    Distance from the previous point for points sorted by (track, time).
+    first marks the first point of every track (indices or a bool mask);
+    those points and the very first one are NaN.
+    """
+    lat, lon = _as(dtype, lat, lon)
+    out = np.full(len(lat), np.nan, dtype=dtype)
+    if len(lat) > 1:
+        out[1:] = distance(lat[:-1], lon[:-1], lat[1:], lon[1:], method, dtype)
+    if first is not None:
+        out[first] = np.nan
+    return out
+
+
+def benchmark(n=2_000_000, repeat=3, seed=0):
+    # throughput of every kernel on short AIS-like hops in the Norwegian Sea
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(55, 80, n)
+    lon = rng.uniform(-10, 45, n)
+    lat2 = lat + rng.normal(0, 0.005, n)
+    lon2 = lon + rng.normal(0, 0.01, n)
+    exact = haversine(lat, lon, lat2, lon2)
+
+    cases = [
+        ("haversine", lambda d: haversine(lat, lon, lat2, lon2, dtype=d)),
+        ("equirect", lambda d: equirectangular(lat, lon, lat2, lon2, dtype=d)),
+        ("to_many", lambda d: to_many(lat[0], lon[0], lat2, lon2, dtype=d)),
+        ("along_track", lambda d: along_track(lat, lon, dtype=d)),
+        ("pairwise", lambda d: pairwise(lat[:1000], lon[:1000], lat2[:n // 1000], lon2[:n // 1000], dtype=d)),
+    ]
+    for dtype in (np.float64, np.float32):
+        for name, fn in cases:
+            best = np.inf
+            for _ in range(repeat):
+                t = time.perf_counter()
+                d = fn(dtype)
+                best = min(best, time.perf_counter() - t)
+            line = f"{name:12s} {np.dtype(dtype).name:8s} {d.size / best / 1e6:8.1f} M points/s"
+            if name in ("haversine", "equirect"):
+                err = np.nanmax(np.abs(d.astype(np.float64) - exact))
+                line += f"   max |error| {err:.3f} m"
+            print(line)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,8 +1,10 @@
 import pandas as pd
 
+from ers_ingest import load_ers
+
 YEAR = "2024"
 
-ers_df = pd.read_csv(f"Data/elektronisk-rapportering-ers-{YEAR}-fangstmelding-dca.csv", sep=";", encoding="utf-8", decimal=",")
+ers_df = load_ers(f"Data/elektronisk-rapportering-ers-{YEAR}-fangstmelding-dca.csv", sep=";", encoding="utf-8", decimal=",")
 print(ers_df.dtypes)
 
 ers_df = ers_df[["Fartøynavn (ERS)", "Fartøynasjonalitet (kode)", "Meldingstidspunkt", "Radiokallesignal (ERS)", "Aktivitet", "Starttidspunkt",
@@ -19,9 +21,6 @@ after = len(ers_df)
 print(f"Dropped {before - after} rows ({(before-after)/before:.1%})")
 
 
-fmt = "%d.%m.%Y %H:%M:%S"
-ers_df["Starttidspunkt"] = pd.to_datetime(ers_df["Starttidspunkt"], format=fmt)
-
 test = ers_df.loc[ers_df["Radiokallesignal (ERS)"] == "LEBW"].copy()
 print("TESTY")
 print(test[["Fartøynavn (ERS)", "Radiokallesignal (ERS)", "Starttidspunkt", "Redskap FAO"]].head())
@@ -0,0 +1,142 @@
+import json
+import os
+from pathlib import Path
+
+import matplotlib.colors as colors
+import matplotlib.pyplot as plt
+import numpy as np
+
+from ais_store import ais_filter, open_ais_dataset
+
+# Streaming 2-D histograms for the density maps. A grid is a dict
+#   {"extent": (lon_min, lat_min, lon_max, lat_max), "bins": (nx, ny),
+#    "counts": int64 array (ny, nx)}
+# filled batch by batch with np.bincount on the flattened cell index, so only
+# one record batch and the counts are in memory. Grids with the same extent
+# and bins add up, a month is binned once and kept next to its AIS file as
+# <stem>.<name>.npz, and a year-scale map is the sum of the month grids.
+# Points outside the extent are dropped, the upper edges are inclusive (as
+# in np.histogram2d). The maps use the fixed STUDY_AREA (the region of
+# roi.py) so the month grids stay valid when months are added.
+
+GRID_VERSION = 1
+STUDY_AREA = (-10, 55, 45, 80) # (lon_min, lat_min, lon_max, lat_max)
+BATCH_SIZE = 1_000_000
+
+
+def _grid_shape(extent, bins):
+    # bins is one int (nx = ny) or (nx, ny), as for plt.hist2d
+    nx, ny = (bins, bins) if np.isscalar(bins) else bins
+    return tuple(float(x) for x in extent), (int(nx), int(ny))
+
+
+def new_grid(extent, bins):
+    extent, (nx, ny) = _grid_shape(extent, bins)
+    return {"extent": extent, "bins": (nx, ny), "counts": np.zeros((ny, nx), dtype=np.int64)}
+
+
+def grid_edges(grid):
+    lon_min, lat_min, lon_max, lat_max = grid["extent"]
+    nx, ny = grid["bins"]
+    return np.linspace(lon_min, lon_max, nx + 1), np.linspace(lat_min, lat_max, ny + 1)
+
+
+def add_points(grid, lon, lat):
+    """Bins lon/lat into grid (in place) and returns it."""
+    lon_min, lat_min, lon_max, lat_max = grid["extent"]
+    nx, ny = grid["bins"]
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+
+    inside = (lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+    ix = ((lon[inside] - lon_min) * (nx / (lon_max - lon_min))).astype(np.int64)
+    iy = ((lat[inside] - lat_min) * (ny / (lat_max - lat_min))).astype(np.int64)
+    np.minimum(ix, nx - 1, out=ix)
+    np.minimum(iy, ny - 1, out=iy)
+
+    grid["counts"] += np.bincount(iy * nx + ix, minlength=nx * ny).reshape(ny, nx)
+    return grid
+
+
+def add_ais(grid, source, bbox=None, batch_size=BATCH_SIZE, **filters):
+    """
+    Bins the lon/lat of every AIS message of source (a parquet file or the
+    partitioned dataset), read in record batches. bbox and the other
+    ais_filter arguments are pushed down to the scan.
+    """
+    dataset = open_ais_dataset(source)
+    expr = ais_filter(dataset, bbox=bbox, **filters)
+    scanner = dataset.scanner(columns=["lon", "lat"], filter=expr, batch_size=batch_size)
+    for batch in scanner.to_batches():
+        add_points(grid, batch.column("lon").to_numpy(zero_copy_only=False),
+                   batch.column("lat").to_numpy(zero_copy_only=False))
+    return grid
+
+
+def merge_grids(grids):
+    grids = list(grids)
+    out = new_grid(grids[0]["extent"], grids[0]["bins"])
+    for g in grids:
+        if g["extent"] != out["extent"] or g["bins"] != out["bins"]:
+            raise ValueError(f"Cannot merge grid {g['extent']} {g['bins']} into {out['extent']} {out['bins']}")
+        out["counts"] += g["counts"]
+    return out
+
+
+def save_grid(grid, path, meta=None):
+    path = Path(path)
+    tmp = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez_compressed(tmp, counts=grid["counts"], extent=np.array(grid["extent"]),
+                        bins=np.array(grid["bins"]), meta=json.dumps(meta or {}))
+    tmp.replace(path)
+
+
+def load_grid(path):
+    with np.load(path) as f:
+        grid = new_grid(f["extent"].tolist(), tuple(f["bins"].tolist()))
+        grid["counts"][:] = f["counts"]
+        grid["meta"] = json.loads(str(f["meta"]))
+    return grid
+
+
+def _grid_fingerprint(parquet_path, name, extent, bins):
+    stat = Path(parquet_path).stat()
+    extent, bins = _grid_shape(extent, bins)
+    return {"version": GRID_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "name": name, "extent": list(extent), "bins": list(bins)}
+
+
+def grid_store(parquet_path, name, extent, bins, fill):
+    """
+    Grid of one AIS file, read from <stem>.<name>.npz or built with
+    fill(grid, parquet_path) (and saved) when it is missing, the source
+    changed or the extent/bins differ.
+    """
+    parquet_path = Path(parquet_path)
+    out_path = parquet_path.with_name(f"{parquet_path.stem}.{name}.npz")
+    fingerprint = _grid_fingerprint(parquet_path, name, extent, bins)
+    if out_path.exists():
+        grid = load_grid(out_path)
+        if grid["meta"] == fingerprint:
+            return grid
+
+    grid = fill(new_grid(extent, bins), parquet_path)
+    save_grid(grid, out_path, meta=fingerprint)
+    print(f"Wrote {name} grid of {parquet_path} to {out_path} ({grid['counts'].sum()} points)")
+    return grid
+
+
+def plot_grid(grid, label, title, cmap="hot"):
+    lon_edges, lat_edges = grid_edges(grid)
+    counts = np.ma.masked_equal(grid["counts"], 0)
+
+    plt.figure(figsize=(10,8))
+    plt.pcolormesh(lon_edges, lat_edges, counts, cmap=cmap, norm=colors.LogNorm())
+    plt.colorbar(label=label, shrink=0.5)
+
+    plt.xlabel("Longitude")
+    plt.ylabel("Latitude")
+    plt.title(title)
+    plt.gca().set_aspect('equal', adjustable='box')
+    plt.tight_layout()
+    plt.show()
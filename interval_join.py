@@ -0,0 +1,315 @@
+import numpy as np
+import pandas as pd
+
+# Sorted-interval join between AIS messages and ERS activity windows.
+# Both sides are grouped by callsign, windows are sorted by start time and
+# AIS times are looked up with searchsorted instead of one mask per window.
+
+ERS_CALLSIGN = "Radiokallesignal (ERS)"
+ERS_START = "Starttidspunkt"
+ERS_STOP = "Stopptidspunkt"
+
+LABEL_COLUMNS = {
+    "label": "Redskap - gruppe",
+    "label_sub1": "Redskap FAO",
+    "label_sub2": "Redskap FDIR",
+}
+
+
+def _to_ns(times):
+    return pd.to_datetime(times).to_numpy().astype("datetime64[ns]").astype("int64")
+
+
+def _sorted_groups(codes, times):
+    # Row positions grouped by code (first appearance order), time sorted inside
+    order = np.lexsort((times, codes))
+    order = order[codes[order] >= 0]
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    return [rows for rows in np.split(order, bounds) if len(rows)]
+
+
+def _prev_greater(stops):
+    # prev[k] = last j < k with stops[j] > stops[k], -1 if there is none
+    prev = np.full(len(stops), -1, dtype=np.int64)
+    stack = []
+    for k, s in enumerate(stops):
+        while stack and stops[stack[-1]] <= s:
+            stack.pop()
+        if stack:
+            prev[k] = stack[-1]
+        stack.append(k)
+    return prev
+
+
+def build_interval_index(df_ers, callsign_col=ERS_CALLSIGN, start_col=ERS_START, stop_col=ERS_STOP):
+    """
+    Returns {callsign: (starts_ns, stops_ns, prev_greater, ers_rows)} with the
+    windows of each callsign sorted by start time. ers_rows are positions
+    into df_ers.
+    """
+    index = {}
+    if df_ers.empty:
+        return index
+
+    codes, uniques = pd.factorize(df_ers[callsign_col], sort=False)
+    starts = _to_ns(df_ers[start_col])
+    stops = _to_ns(df_ers[stop_col])
+
+    # lexsort is stable, so windows with equal start keep their ERS row order
+    for rows in _sorted_groups(codes, starts):
+        s = starts[rows]
+        e = stops[rows]
+        index[uniques[codes[rows[0]]]] = (s, e, _prev_greater(e), rows)
+
+    return index
+
+
+def last_window(entry, times_ns):
+    """
+    For each time, position (into df_ers) of the last window in start order
+    that contains it, i.e. the window that wins when later windows overwrite
+    earlier ones. -1 where no window contains the time.
+    """
+    starts, stops, prev, rows = entry
+
+    k = np.searchsorted(starts, times_ns, side="right") - 1
+
+    # Walk back along the previous-greater-stop chain until the window covers t.
+    # Windows skipped on the way all end before t, so they can never win.
+    todo = np.flatnonzero(k >= 0)
+    while len(todo):
+        miss = stops[k[todo]] < times_ns[todo]
+        todo = todo[miss]
+        k[todo] = prev[k[todo]]
+        todo = todo[k[todo] >= 0]
+
+    out = np.full(len(times_ns), -1, dtype=np.int64)
+    hit = k >= 0
+    out[hit] = rows[k[hit]]
+    return out
+
+
+def ers_row_for_ais(df_ais, ers_index, callsign_col="callsign", time_col="date_time_utc"):
+    """
+    Position into df_ers of the winning window for every AIS row (-1 if none),
+    aligned with df_ais. One searchsorted pass per callsign.
+    """
+    out = np.full(len(df_ais), -1, dtype=np.int64)
+    if df_ais.empty or not ers_index:
+        return out
+
+    times = _to_ns(df_ais[time_col])
+    codes, uniques = pd.factorize(df_ais[callsign_col], sort=False)
+
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+
+    for rows in np.split(order, bounds):
+        if len(rows) == 0:
+            continue
+        entry = ers_index.get(uniques[codes[rows[0]]])
+        if entry is None:
+            continue
+        out[rows] = last_window(entry, times[rows])
+
+    return out
+
+
+def take_labels(df_ers, ers_rows, columns=LABEL_COLUMNS):
+    # Gather label columns from df_ers, pd.NA where ers_rows == -1
+    hit = ers_rows >= 0
+    labels = {}
+    for out_col, ers_col in columns.items():
+        values = np.full(len(ers_rows), pd.NA, dtype=object)
+        src = df_ers[ers_col].astype(object).to_numpy()
+        values[hit] = src[ers_rows[hit]]
+        labels[out_col] = values
+    return labels
+
+
+def assign_labels(df_ais, df_ers, ers_index=None):
+    """
+    Vectorized replacement for the iterrows loop in assign_ais_message_to_label.
+    Returns the AIS frame grouped by callsign (first appearance order), sorted
+    by time within each callsign, with label, label_sub1 and label_sub2 set
+    from the last ERS window (by start time) that contains the message.
+    """
+    if ers_index is None:
+        ers_index = build_interval_index(df_ers)
+
+    codes, _ = pd.factorize(df_ais["callsign"], sort=False)
+    times = _to_ns(df_ais["date_time_utc"])
+    order = np.lexsort((times, codes))
+    order = order[codes[order] >= 0]  # groupby drops missing callsigns
+
+    df = df_ais.iloc[order].reset_index(drop=True)
+    ers_rows = ers_row_for_ais(df, ers_index)
+
+    for col, values in take_labels(df_ers, ers_rows).items():
+        df[col] = pd.Series(values, index=df.index, dtype=object)
+
+    return df
+
+
+def overlap_pairs(entry, times_ns):
+    """
+    All (message, window) pairs where the window contains the message, for one
+    callsign. times_ns must be sorted. Returns (message positions, positions
+    into df_ers), ordered by message and then by window start.
+    """
+    starts, stops, _, rows = entry
+
+    lo = np.searchsorted(times_ns, starts, side="left")
+    hi = np.searchsorted(times_ns, stops, side="right")
+    n = np.maximum(hi - lo, 0)
+
+    total = int(n.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    win = np.repeat(np.arange(len(starts)), n)
+    msg = np.repeat(lo - np.cumsum(n) + n, n) + np.arange(total)
+
+    order = np.lexsort((win, msg))
+    return msg[order], rows[win[order]]
+
+
+def range_join(df_ais, df_ers, ers_index=None, callsign_col="callsign", time_col="date_time_utc",
+               suffixes=("", "_ers")):
+    """
+    AIS rows joined with every ERS window of the same callsign that contains
+    them. Same rows and columns as a per-callsign cross join filtered on
+    Starttidspunkt <= date_time_utc <= Stopptidspunkt, but only the matching
+    pairs are ever built.
+    """
+    if ers_index is None:
+        ers_index = build_interval_index(df_ers)
+
+    if df_ais.empty or not ers_index:
+        return pd.DataFrame()
+
+    codes, uniques = pd.factorize(df_ais[callsign_col], sort=False)
+    times = _to_ns(df_ais[time_col])
+
+    ais_parts = []
+    ers_parts = []
+    for rows in _sorted_groups(codes, times):
+        entry = ers_index.get(uniques[codes[rows[0]]])
+        if entry is None:
+            continue
+        msg, ers_rows = overlap_pairs(entry, times[rows])
+        if len(msg):
+            ais_parts.append(rows[msg])
+            ers_parts.append(ers_rows)
+
+    if not ais_parts:
+        return pd.DataFrame()
+
+    ais_rows = np.concatenate(ais_parts)
+    ers_rows = np.concatenate(ers_parts)
+
+    left = df_ais.iloc[ais_rows].reset_index(drop=True)
+    right = df_ers.iloc[ers_rows].reset_index(drop=True)
+
+    overlap = left.columns.intersection(right.columns)
+    left = left.rename(columns={c: f"{c}{suffixes[0]}" for c in overlap})
+    right = right.rename(columns={c: f"{c}{suffixes[1]}" for c in overlap})
+
+    return pd.concat([left, right], axis=1)
+
+
+def _assign_labels_reference(df_ais, df_ers):
+    # The original per-window loop, kept to check assign_labels against
+    df_ais = df_ais.copy()
+    df_ais["label"] = pd.NA
+    df_ais["label_sub1"] = pd.NA
+    df_ais["label_sub2"] = pd.NA
+
+    ers_groups = {
+        callsign: d.sort_values(ERS_START, kind="stable").reset_index(drop=True)
+        for callsign, d in df_ers.groupby(ERS_CALLSIGN, sort=False)
+    }
+
+    labeled_parts = []
+    for callsign, d_ais in df_ais.groupby("callsign", sort=False):
+        d_ais = d_ais.sort_values("date_time_utc", kind="stable").copy()
+        if callsign in ers_groups:
+            for _, row in ers_groups[callsign].iterrows():
+                mask = (
+                    (d_ais["date_time_utc"] >= row[ERS_START]) &
+                    (d_ais["date_time_utc"] <= row[ERS_STOP])
+                )
+                d_ais.loc[mask, "label"] = row["Redskap - gruppe"]
+                d_ais.loc[mask, "label_sub1"] = row["Redskap FAO"]
+                d_ais.loc[mask, "label_sub2"] = row["Redskap FDIR"]
+        labeled_parts.append(d_ais)
+
+    return pd.concat(labeled_parts, ignore_index=True)
+
+
+def _range_join_reference(df_ais, df_ers):
+    # The cross join from ers_ais_whole_year.match_ais_to_ers_windows
+    out = []
+    ers_groups = {
+        c: g.sort_values(ERS_START, kind="stable").reset_index(drop=True)
+        for c, g in df_ers.groupby(ERS_CALLSIGN, sort=False)
+    }
+    for callsign, ais_g in df_ais.groupby("callsign", sort=False):
+        if callsign not in ers_groups:
+            continue
+        ais_g = ais_g.sort_values("date_time_utc", kind="stable").reset_index(drop=True)
+        merged = ais_g.assign(_tmp=1).merge(
+            ers_groups[callsign].assign(_tmp=1), on="_tmp", suffixes=("", "_ers")
+        ).drop(columns="_tmp")
+        matched = merged.loc[
+            (merged["date_time_utc"] >= merged[ERS_START]) &
+            (merged["date_time_utc"] <= merged[ERS_STOP])
+        ]
+        if not matched.empty:
+            out.append(matched)
+    return pd.concat(out, ignore_index=True)
+
+
+def check_equivalence(n_vessels=30, n_windows=40, n_messages=2000, seed=0):
+    # Random overlapping/nested windows, compares against the loop and cross join versions
+    rng = np.random.default_rng(seed)
+    t0 = pd.Timestamp("2024-01-01")
+    callsigns = [f"L{i:03d}" for i in range(n_vessels)]
+
+    n_ers = n_vessels * n_windows
+    start = t0 + pd.to_timedelta(rng.integers(0, 30 * 24 * 60, n_ers), unit="min")
+    dur = pd.to_timedelta(rng.integers(0, 3000, n_ers), unit="min")
+    df_ers = pd.DataFrame({
+        ERS_CALLSIGN: rng.choice(callsigns, n_ers),
+        ERS_START: start,
+        ERS_STOP: start + dur,
+        "Redskap - gruppe": rng.choice(["Trål", "Not", "Garn"], n_ers),
+        "Redskap FAO": rng.choice(["OTB", "PS", "GNS"], n_ers),
+        "Redskap FDIR": rng.choice(["51", "11", "22"], n_ers),
+    })
+
+    n_ais = n_vessels * n_messages
+    df_ais = pd.DataFrame({
+        "callsign": rng.choice(callsigns + ["NOERS"], n_ais),
+        "date_time_utc": t0 + pd.to_timedelta(rng.integers(0, 32 * 24 * 3600, n_ais), unit="s"),
+        "speed": rng.random(n_ais),
+    })
+    # a few messages exactly on window edges
+    edges = rng.integers(0, n_ers, 200)
+    df_ais.loc[:199, "callsign"] = df_ers[ERS_CALLSIGN].to_numpy()[edges]
+    df_ais.loc[:199, "date_time_utc"] = df_ers[ERS_STOP].to_numpy()[edges]
+
+    expected = _assign_labels_reference(df_ais, df_ers)
+    got = assign_labels(df_ais, df_ers)
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+    expected = _range_join_reference(df_ais, df_ers)
+    got = range_join(df_ais, df_ers)
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+    return True
+
+
+if __name__ == "__main__":
+    print("Equivalent to loop version:", check_equivalence())
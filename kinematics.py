@@ -0,0 +1,246 @@
+import json
+import os
+import sys
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from geodesy import along_track
+
+# Per-message kinematics of a cleaned monthly AIS file, computed once and
+# kept as a sidecar <stem>.kinematics.parquet (next to the source, or in
+# KINEMATICS_DIR for read-only or shared source directories) holding only
+#   row
+#       position of the message in the source file
+#   dt_s, dist_to_prev_m, speed_calc_ms, accel, jerk, dcog
+#       step from the previous message of the same trajectory (the same
+#       values features_for_clustering used to derive on every run)
+# as float32, NaN on the first message of a track. read_kinematics and
+# iter_kinematics join it onto the source columns. Rows without a time or a
+# callsign (the rows clean_ais drops) or without a track id get NaN and are
+# skipped by their neighbours. The sidecar is rebuilt when the source changes.
+#
+# The sidecar is built in a pre-pass (python kinematics.py <month files>, or
+# build_kinematics from a driver) that holds the input columns of one month
+# as NumPy arrays; iter_kinematics only reads it and never builds, so the
+# streaming labeler stays bounded by its batch size.
+
+KINEMATICS_VERSION = 2
+KINEMATICS_META_KEY = b"kinematics"
+KINEMATICS_DIR = os.environ.get("KINEMATICS_DIR")   # None = next to the source
+KINEMATICS_COLUMNS = ["dt_s", "dist_to_prev_m", "speed_calc_ms", "accel", "jerk", "dcog"]
+BATCH_SIZE = 1_000_000
+
+
+def _seg_diff(x, first):
+    # x[i] - x[i-1] inside each track, NaN on the first row of a track
+    d = np.empty(len(x), dtype="float64")
+    d[1:] = x[1:] - x[:-1]
+    d[first] = np.nan
+    return d
+
+
+def kinematics_from_arrays(first, t_ns, lat, lon, cog):
+    """
+    Arrays sorted by (track, time), first = positions of the first row of
+    every track. Returns {column: float64 array} for KINEMATICS_COLUMNS.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dt = _seg_diff(t_ns, first) / 1e9
+        dist = along_track(lat, lon, first)
+
+        speed = dist / dt
+        accel = _seg_diff(speed, first) / dt
+        jerk = _seg_diff(accel, first) / dt
+
+        dcog_raw = _seg_diff(cog, first)
+        dcog = (((dcog_raw + 180) % 360) - 180) / dt
+
+    return {"dt_s": dt, "dist_to_prev_m": dist, "speed_calc_ms": speed, "accel": accel, "jerk": jerk, "dcog": dcog}
+
+
+def _track_order(codes, t_ns, valid):
+    # rows with a track id (code >= 0) and a time, sorted by (track, time),
+    # and the positions in that order where a new track starts
+    rows = np.flatnonzero(valid & (codes >= 0))
+    rows = rows[np.lexsort((t_ns[rows], codes[rows]))]
+    c = codes[rows]
+    first = np.flatnonzero(np.r_[True, c[1:] != c[:-1]]) if len(rows) else np.empty(0, dtype=np.int64)
+    return rows, first
+
+
+def _times_ns(col):
+    # int64 ns and validity of a timestamp or "YYYY-MM-DD HH:MM:SS" column
+    if not pa.types.is_timestamp(col.type):
+        try:
+            col = pc.cast(col, pa.timestamp("ns"))
+        except pa.ArrowInvalid:
+            # malformed strings become NaT, as pd.to_datetime(errors="coerce")
+            t = pd.to_datetime(col.to_pandas(), errors="coerce")
+            return t.to_numpy().astype("datetime64[ns]").astype(np.int64), t.notna().to_numpy()
+    col = pc.cast(col, pa.timestamp("ns", tz=col.type.tz))
+    valid = col.is_valid().to_numpy(zero_copy_only=False)
+    return pc.cast(col, pa.int64()).fill_null(0).to_numpy(), valid
+
+
+def _floats(col):
+    return pc.cast(col, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def kinematics_columns(table, track_col="trajectory_id"):
+    """
+    {column: float32 array aligned with the rows of table} for
+    KINEMATICS_COLUMNS. table is a pyarrow Table; the columns are used as
+    NumPy arrays (the callsign only as a validity mask), never as pandas.
+    """
+    t_ns, valid = _times_ns(table.column("date_time_utc"))
+    if "callsign" in table.column_names:
+        valid = valid & table.column("callsign").is_valid().to_numpy(zero_copy_only=False)
+    codes = table.column(track_col).combine_chunks().dictionary_encode().indices
+    codes = codes.fill_null(-1).to_numpy(zero_copy_only=False)
+    out = {c: np.full(table.num_rows, np.nan, dtype=np.float32) for c in KINEMATICS_COLUMNS}
+
+    rows, first = _track_order(codes, t_ns, valid)
+    kin = kinematics_from_arrays(
+        first,
+        t_ns[rows],
+        _floats(table.column("lat"))[rows],
+        _floats(table.column("lon"))[rows],
+        _floats(table.column("cog"))[rows],
+    )
+    for c in KINEMATICS_COLUMNS:
+        out[c][rows] = kin[c]
+    return out
+
+
+def _kinematics_fingerprint(parquet_path, track_col):
+    stat = Path(parquet_path).stat()
+    return {"version": KINEMATICS_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "track_col": track_col}
+
+
+def build_kinematics_store(parquet_path, out_path, track_col="trajectory_id"):
+    # only the columns the kinematics need are held for the whole month
+    names = pq.read_schema(parquet_path).names
+    cols = [c for c in dict.fromkeys(["date_time_utc", "lat", "lon", "cog", "callsign", track_col]) if c in names]
+    kin = kinematics_columns(pq.read_table(parquet_path, columns=cols), track_col=track_col)
+
+    n = len(kin["dt_s"])
+    table = pa.table({"row": pa.array(np.arange(n, dtype=np.int64)),
+                      **{c: pa.array(kin[c]) for c in KINEMATICS_COLUMNS}})
+    table = table.replace_schema_metadata(
+        {KINEMATICS_META_KEY: json.dumps(_kinematics_fingerprint(parquet_path, track_col)).encode()})
+
+    out_path = Path(out_path)
+    tmp = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    try:
+        pq.write_table(table, tmp)
+        os.replace(tmp, out_path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    print(f"Wrote kinematics of {parquet_path} to {out_path} ({n} rows)")
+
+
+def kinematics_path(parquet_path, kinematics_dir=None):
+    """
+    Where the sidecar of parquet_path lives: next to it, or in
+    kinematics_dir (default KINEMATICS_DIR), there with a hash of the
+    source path in the name so months of different years do not collide.
+    """
+    parquet_path = Path(parquet_path)
+    kinematics_dir = KINEMATICS_DIR if kinematics_dir is None else kinematics_dir
+    if kinematics_dir is None:
+        return parquet_path.with_name(parquet_path.stem + ".kinematics.parquet")
+    tag = zlib.crc32(str(parquet_path.resolve()).encode())
+    return Path(kinematics_dir) / f"{parquet_path.stem}.{tag:08x}.kinematics.parquet"
+
+
+def _track_col(parquet_path, track_col):
+    # files without track_col use the mmsi as the track
+    return track_col if track_col in pq.read_schema(parquet_path).names else "mmsi"
+
+
+def _is_current(parquet_path, out_path, track_col):
+    if not out_path.exists():
+        return False
+    stored = (pq.read_schema(out_path).metadata or {}).get(KINEMATICS_META_KEY)
+    return stored is not None and json.loads(stored) == _kinematics_fingerprint(parquet_path, track_col)
+
+
+def kinematics_store(parquet_path, track_col="trajectory_id", build=True):
+    """
+    Path of the kinematics sidecar of parquet_path. A missing or outdated
+    sidecar is built when build is set and raises FileNotFoundError if not.
+    """
+    track_col = _track_col(parquet_path, track_col)
+    out_path = kinematics_path(parquet_path)
+    if _is_current(parquet_path, out_path, track_col):
+        return str(out_path)
+    if not build:
+        raise FileNotFoundError(f"No current kinematics for {parquet_path} at {out_path}, "
+                                f"build them first: python kinematics.py {parquet_path}")
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    build_kinematics_store(parquet_path, out_path, track_col=track_col)
+    return str(out_path)
+
+
+def build_kinematics(paths, track_col="trajectory_id"):
+    # pre-pass: one month at a time, skipping the ones that are current
+    for path in paths:
+        if not Path(path).exists():
+            print(f"Missing {path}, skipping")
+            continue
+        kinematics_store(path, track_col=track_col)
+
+
+def read_kinematics(parquet_path, columns=None):
+    """columns of parquet_path with KINEMATICS_COLUMNS joined on, as a DataFrame."""
+    source = pq.read_table(parquet_path, columns=columns)
+    kin = pq.read_table(kinematics_store(parquet_path))
+    if kin.num_rows != source.num_rows:
+        raise ValueError(f"{parquet_path} has {source.num_rows} rows, its kinematics {kin.num_rows}")
+    for c in KINEMATICS_COLUMNS:
+        source = source.append_column(c, kin.column(c))
+    return source.to_pandas()
+
+
+def _take(batches, pending, n):
+    # the next n rows of the sidecar batches, as one table
+    while pending.num_rows < n:
+        pending = pa.concat_tables([pending, pa.Table.from_batches([next(batches)])])
+    return pending.slice(0, n), pending.slice(n)
+
+
+def iter_kinematics(parquet_path, columns=None, batch_size=BATCH_SIZE):
+    """
+    Record batches of parquet_path (columns) with KINEMATICS_COLUMNS joined
+    on, read in lockstep with the sidecar so only one batch of each is held.
+    The sidecar must have been built (build_kinematics), it is not built here.
+    """
+    source = pq.ParquetFile(parquet_path)
+    sidecar = pq.ParquetFile(kinematics_store(parquet_path, build=False))
+    batches = sidecar.iter_batches(batch_size=batch_size)
+    pending = sidecar.schema_arrow.empty_table()
+
+    start = 0
+    for batch in source.iter_batches(batch_size=batch_size, columns=columns):
+        kin, pending = _take(batches, pending, batch.num_rows)
+        row = kin.column("row").to_numpy()
+        if len(row) and (row[0] != start or row[-1] != start + len(row) - 1):
+            raise ValueError(f"Kinematics of {parquet_path} out of step at row {start}")
+        start += batch.num_rows
+        table = pa.Table.from_batches([batch])
+        for c in KINEMATICS_COLUMNS:
+            table = table.append_column(c, kin.column(c))
+        yield from table.to_batches()
+
+
+if __name__ == "__main__":
+    build_kinematics(sys.argv[1:])
@@ -0,0 +1,70 @@
+import hashlib
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from parallel_driver import atomic_output, atomic_to_parquet
+
+# Per-stage, per-unit checkpoints. Every stage result is stored under a key
+# made from what it actually depends on (input file fingerprints, upstream
+# stage keys and the rule parameters), so a rerun loads finished stages and
+# only recomputes the ones whose inputs or parameters changed.
+
+CHECKPOINT_DIR = "checkpoints"
+
+
+def file_fingerprint(path, content=False):
+    """
+    Cheap fingerprint from size and mtime. content=True hashes the file
+    bytes instead (slow for big parquet files, but survives copies/touches).
+    """
+    path = Path(path)
+    if content:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 24), b""):
+                h.update(chunk)
+        return f"{path.name}:{h.hexdigest()}"
+
+    stat = path.stat()
+    return f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def make_key(stage, *parts):
+    # repr keeps Timedelta/sets/lists readable and stable between runs
+    parts = [sorted(p) if isinstance(p, (set, frozenset)) else p for p in parts]
+    raw = json.dumps([stage] + [repr(p) for p in parts])
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def checkpoint_path(unit_name, stage, key, suffix=".parquet"):
+    return Path(CHECKPOINT_DIR) / unit_name / f"{stage}-{key}{suffix}"
+
+
+def checkpointed(unit_name, stage, key, compute):
+    """
+    Returns the stored frame for (unit_name, stage, key) if there is one,
+    otherwise runs compute(), stores its result and returns it.
+    """
+    path = checkpoint_path(unit_name, stage, key)
+    if path.exists():
+        print(f"[{unit_name}] {stage}: using checkpoint {path.name}")
+        return pd.read_parquet(path)
+
+    out = compute()
+    atomic_to_parquet(out, path)
+    return out
+
+
+def mark_done(unit_name, stage, key):
+    with atomic_output(checkpoint_path(unit_name, stage, key, suffix=".done")) as tmp:
+        tmp.write_text(key)
+
+
+def attach_columns(df, cols):
+    # Stage checkpoints only keep row_id + the columns the stage adds
+    cols = cols.set_index("row_id").reindex(df["row_id"])
+    for c in cols.columns:
+        df[c] = cols[c].to_numpy()
+    return df
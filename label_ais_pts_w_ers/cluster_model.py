@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import joblib
+from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import MiniBatchKMeans
+
+from feature_engine import FEATURE_NAMES
+from parallel_driver import atomic_output
+
+# Out-of-core clustering of the no_fishing feature windows. The scaler and
+# MiniBatchKMeans are fitted with partial_fit over feature chunks streamed
+# from parquet (e.g. the features checkpoints of every quarter of a year),
+# saved once, and then applied quarter by quarter with a predict pass only.
+# Every chunk is shuffled and fed to MiniBatchKMeans in BATCH_SIZE slices,
+# for several epochs until the centers stop moving.
+
+CHUNK_ROWS = 500_000
+BATCH_SIZE = 4096
+MAX_EPOCHS = 10
+CENTER_TOL = 1e-3   # largest center move over one epoch, in scaled units
+
+
+def pick_no_fishing_cluster(centroids):
+    # Heuristic: confident no-fishing is fast, stable and straight
+    score = (
+        centroids["mean_speed"].rank(ascending=True) +
+        centroids["straightness"].rank(ascending=True) +
+        centroids["std_speed"].rank(ascending=False)
+    )
+    return score.idxmax()
+
+
+def no_fishing_rows(feats, feature_cols=FEATURE_NAMES):
+    return feats[
+        feats["report"].eq("no_fishing")
+    ].replace([np.inf, -np.inf], np.nan).dropna(subset=feature_cols)
+
+
+def iter_feature_chunks(paths, feature_cols=FEATURE_NAMES, chunk_rows=CHUNK_ROWS):
+    """
+    Yields no_fishing feature matrices from parquet files, chunk_rows rows
+    of the file at a time. Files without feature columns (quarters where no
+    window qualified) are skipped.
+    """
+    for path in paths:
+        pf = pq.ParquetFile(path)
+        if not set(feature_cols).issubset(pf.schema_arrow.names):
+            continue
+        for batch in pf.iter_batches(batch_size=chunk_rows, columns=["report"] + list(feature_cols)):
+            cl = no_fishing_rows(batch.to_pandas(), feature_cols)
+            if len(cl):
+                yield cl[feature_cols].to_numpy()
+
+
+def _minibatches(X, batch_size, rng):
+    # the rows of a chunk are in time order, shuffle them before slicing
+    X = X[rng.permutation(len(X))]
+    for start in range(0, len(X), batch_size):
+        yield X[start:start + batch_size]
+
+
+def fit_streaming_model(paths, n_clusters, feature_cols=FEATURE_NAMES, chunk_rows=CHUNK_ROWS,
+                        batch_size=BATCH_SIZE, max_epochs=MAX_EPOCHS, tol=CENTER_TOL):
+    """
+    One pass over the chunks fits the StandardScaler, then every epoch
+    feeds the scaled chunks to MiniBatchKMeans in batch_size slices, until
+    no center moves more than tol in an epoch (or max_epochs). Memory is
+    bounded by chunk_rows, not by the number of windows in the year.
+    """
+    # the first partial_fit call also seeds the centers (k-means++), give it
+    # a uniform sample of the whole year (the rows with the init_rows
+    # smallest random keys), as many rows as MiniBatchKMeans.fit would use
+    init_rows = max(3 * batch_size, n_clusters)
+    rng = np.random.default_rng(0)
+    scaler = StandardScaler()
+    n_rows = 0
+    sample, keys = np.empty((0, len(feature_cols))), np.empty(0)
+    for X in iter_feature_chunks(paths, feature_cols, chunk_rows):
+        scaler.partial_fit(X)
+        n_rows += len(X)
+        sample, keys = np.vstack([sample, X]), np.r_[keys, rng.random(len(X))]
+        if len(keys) > init_rows:
+            keep = np.argpartition(keys, init_rows)[:init_rows]
+            sample, keys = sample[keep], keys[keep]
+
+    if n_rows < n_clusters:
+        print("Not enough no_fishing windows to fit a clustering model.")
+        return None
+
+    km = MiniBatchKMeans(n_clusters=n_clusters, random_state=0, batch_size=batch_size)
+    km.partial_fit(scaler.transform(sample))
+    for epoch in range(max_epochs):
+        before = km.cluster_centers_.copy()
+        for X in iter_feature_chunks(paths, feature_cols, chunk_rows):
+            for B in _minibatches(scaler.transform(X), batch_size, rng):
+                km.partial_fit(B)
+
+        shift = np.abs(km.cluster_centers_ - before).max()
+        print(f"Epoch {epoch + 1}: largest center move {shift:.2e}")
+        if shift < tol:
+            break
+
+    centroids = pd.DataFrame(scaler.inverse_transform(km.cluster_centers_), columns=feature_cols)
+
+    print(f"Fitted streaming model on {n_rows} windows.")
+    print("\nCluster centroids:")
+    print(centroids.T)
+
+    return {
+        "scaler": scaler,
+        "kmeans": km,
+        "feature_cols": list(feature_cols),
+        "centroids": centroids,
+        "no_fishing_cluster": pick_no_fishing_cluster(centroids),
+    }
+
+
+def save_model(model, path):
+    with atomic_output(path) as tmp:
+        joblib.dump(model, tmp)
+    # readable copy of the centroids next to the model
+    with atomic_output(str(path) + ".centroids.csv") as tmp:
+        model["centroids"].to_csv(tmp, index_label="cluster")
+
+
+def load_model(path):
+    return joblib.load(path)
+
+
+def predict_clusters(model, cl):
+    X = model["scaler"].transform(cl[model["feature_cols"]].to_numpy())
+    return model["kmeans"].predict(X)
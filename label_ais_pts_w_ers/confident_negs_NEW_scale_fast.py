@@ -1,36 +1,19 @@
 import pandas as pd
-from tqdm import tqdm
 import numpy as np
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
-import rasterio
 import matplotlib.pyplot as plt
-from rasterio.transform import rowcol
-from pyproj import Transformer
 import gc
+from pathlib import Path
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000 # Radius of the earth in meters
-
-    lat1 = np.radians(np.asarray(lat1, dtype=float))
-    lon1 = np.radians(np.asarray(lon1, dtype=float))
-    lat2 = np.radians(np.asarray(lat2, dtype=float))
-    lon2 = np.radians(np.asarray(lon2, dtype=float))
-
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-
-    # apply formulae
-    a = (pow(np.sin(dlat / 2), 2) +  
-             np.cos(lat1) * np.cos(lat2) * pow(np.sin(dlon / 2), 2))
-    
-    c = 2 * np.arcsin(np.sqrt(a))
-
-    dist = R * c
-    #speed = (dist/dt) * 1.94384 # Convert m/s to knots
-
-    return dist #, speed
+from feature_engine import trajectory_features, high_speed_flags
+from report_mask import prepare_labels, report_summary, select_trajectories
+from trajectory_keys import with_trajectory_keys, trajectory_label
+from label_schema import read_compact, write_compact, concat_compact
+from shore_distance import sample_shore_distance, open_shore_raster
+from cluster_model import fit_streaming_model, save_model, load_model, predict_clusters, pick_no_fishing_cluster, no_fishing_rows
+from parallel_driver import run_units, N_WORKERS
+from checkpoints import file_fingerprint, make_key, checkpoint_path, checkpointed, mark_done, attach_columns
 
 def concat_year(months, path):
     print("Concating full year.")
@@ -39,7 +22,7 @@ def concat_year(months, path):
         print("Concating all of ", y)
         for m in range(1, months+1):
             df = pd.read_parquet(f"{path}{m:02d}_{y}.parquet")
-            df["trajectory_id"] = df["trajectory_id"].astype(str) + "-" + str(y) + "-" + str(m) # new unique traj_id
+            df = with_trajectory_keys(df, y, m) # new unique traj_id, packed int64
             dfs.append(df)
         year_df = pd.concat(dfs, ignore_index=True)
 
@@ -52,7 +35,7 @@ def concat_month(month, path):
     dfs = []
     for y in range(2022, 2024+1):
         df = pd.read_parquet(f"{path}{month:02d}_{y}.parquet")
-        df["trajectory_id"] = df["trajectory_id"].astype(str) + "-" + str(y) + "-" + str(month) # new unique traj_id
+        df = with_trajectory_keys(df, y, month) # new unique traj_id, packed int64
         dfs.append(df)
 
     return pd.concat(dfs, ignore_index=True)
@@ -62,31 +45,19 @@ def concat_3_months(year, path):
         dfs = []
         for i in range(start, start + 3):
             df = pd.read_parquet(f"{path}{i:02d}_{year}.parquet")
-            df["trajectory_id"] = df["trajectory_id"].astype(str) + "-" + str(year) + "-" + str(i) # new unique traj_id
+            df = with_trajectory_keys(df, year, i) # new unique traj_id, packed int64
             dfs.append(df)
 
     return pd.concat(dfs, ignore_index=True)
 
-def load_ais_w_labels(df, allowed_report, gear):
-    
-    df = df.fillna(value={"label": "no_fishing"})
-
-    df = df.rename(columns={"label": "report"})
-
-    allowed_mask = df["report"].isin(allowed_report)
-    gear_mask = df["report"].isin(gear)
-
-    valid_by_traj = (
-        allowed_mask.groupby(df["trajectory_id"]).all() &
-        gear_mask.groupby(df["trajectory_id"]).any()
-    )
-
-    valid_ids = valid_by_traj[valid_by_traj].index
-    df = df[df["trajectory_id"].isin(valid_ids)].reset_index(drop=True)
-
-    df["date_time_utc"] = pd.to_datetime(df["date_time_utc"])
+def load_ais_w_labels(df, allowed_report, gear, summary=None):
+    # df can be a raw label frame or one from prepare_labels together with its
+    # report_summary, so the gears of one base frame share the scan and sort
+    if summary is None:
+        df = prepare_labels(df)
+        summary = report_summary(df)
 
-    df = df.sort_values(["trajectory_id", "date_time_utc"]).reset_index(drop=True)
+    df = select_trajectories(df, summary, allowed_report, gear)
 
     df["row_id"] = np.arange(len(df))
 
@@ -98,256 +69,43 @@ def load_ais_w_labels(df, allowed_report, gear):
 
 # RULE 1: HIGH SPEED
 
-def speed_rule(df, speed_threshold, window_len):
+def speed_rule(df, speed_threshold, window_len, min_messages=5, sliding=False):
     print(f"Checking speed rule. Threshold: {speed_threshold} knots.")
-    df = df.copy()
-
-    window_seconds = window_len.total_seconds()
-
-    t0 = df.groupby("trajectory_id")["date_time_utc"].transform("min")
 
-    df["time_bin"] = (
-        (df["date_time_utc"] - t0)
-        .dt.total_seconds()
-        .floordiv(window_seconds)
-        .astype(int)
-    )
-
-    stats = (
-        df.groupby(["trajectory_id", "time_bin"])["speed"]
-        .agg(["mean", "size"])
-        .reset_index()
-    )
-
-    bad_bins = stats[
-        (stats["size"] >= 5) &
-        (stats["mean"] > speed_threshold)
-    ][["trajectory_id", "time_bin"]]
-
-    df = df.merge(
-        bad_bins.assign(high_speed_new=1),
-        on=["trajectory_id", "time_bin"],
-        how="left"
-    )
-
-    df["high_speed"] = df["high_speed_new"].fillna(0).astype(int)
+    # Per-(trajectory, time bin) mean/size as run reductions on the sorted
+    # arrays and broadcast straight back to the rows, so no merge/frame copy.
+    # sliding=True uses a window centred on every message instead of bins.
+    df["high_speed"] = high_speed_flags(
+        df, speed_threshold, window_len, min_messages=min_messages, sliding=sliding
+    ).astype(int)
 
-    return df.drop(columns=["time_bin", "high_speed_new"])
+    return df
 
 
-def close_to_shore(df, threshold_km, raster_path="distance-from-shore.tif"):
+def close_to_shore(df, threshold_km, raster_path="distance-from-shore.tif", decimals=4):
     print(f"Checking distance to shore. Shore threshold: {threshold_km}")
     df = df.copy()
-    print("Rounding coordinates...")
-    df["lon_r"] = df["lon"].round(4)
-    df["lat_r"] = df["lat"].round(4)
-
-    print("Finding unique coordinates...")
-    unique_pts = df[["lon_r", "lat_r"]].drop_duplicates().copy()
-
-    with rasterio.open(raster_path) as src:
-        print("Reading raster...")
-        band = src.read(1)
-        transform = src.transform
-        nodata = src.nodata
-
-        print("Preparing coordinate arrays...")
-        lon = unique_pts["lon_r"].to_numpy()
-        lat = unique_pts["lat_r"].to_numpy()
-
-        print("Converting to raster indices...")
-        cols, rows = ~transform * (lon, lat)
-        rows = rows.astype(int)
-        cols = cols.astype(int)
-
-        print("Filtering valid indices...")
-        valid = (
-            (rows >= 0) & (rows < band.shape[0]) &
-            (cols >= 0) & (cols < band.shape[1])
-        )
-
-        print("Sampling raster (vectorized)...")
-        dist = np.full(len(unique_pts), np.nan, dtype="float32")
-
-        # tqdm here to track assignment progress (optional but visible)
-        dist[valid] = band[rows[valid], cols[valid]]
-
-        if nodata is not None:
-            dist[dist == nodata] = np.nan
-
-        unique_pts["dist_to_shore_km"] = dist
 
-    print("Merging back...")
-    df = df.merge(unique_pts, on=["lon_r", "lat_r"], how="left")
+    # Every point is sampled at its rounded coordinate, which gives the same
+    # value the old unique-points + merge-back did, but the raster row/col is
+    # computed per point and gathered straight into the column (no join).
+    print("Sampling raster (direct index gather)...")
+    lon = np.round(df["lon"].to_numpy(dtype="float64"), decimals)
+    lat = np.round(df["lat"].to_numpy(dtype="float64"), decimals)
+    df["dist_to_shore_km"] = sample_shore_distance(lon, lat, raster_path=raster_path)
 
     df["close_to_shore"] = (df["dist_to_shore_km"] < threshold_km).astype(int)
 
-    print("Cleaning up...")
-    df = df.drop(columns=["lon_r", "lat_r"])
-
     return df
 
 def features_for_clustering(df, half_window, min_messages):
     print("Building features for clustering")
 
-    feat_names = [
-        "mean_speed", "std_speed", "min_speed", "max_speed",
-        "mean_acc", "std_acc", "mean_abs_acc",
-        "mean_abs_dcog", "std_dcog", "cum_abs_turn",
-        "path_length", "net_displacement", "straightness"
-    ]
-
-    def window_sum(x, lo, hi):
-        cs = np.r_[0, np.cumsum(x)]
-        return cs[hi] - cs[lo]
-
-    def features_for_trip(d):
-        d = d.sort_values("date_time_utc").reset_index(drop=True)
-
-        if len(d) < min_messages:
-            return None
-
-        d["dt"] = d["date_time_utc"].diff().dt.total_seconds()
-
-        lon = d["lon"].to_numpy()
-        lat = d["lat"].to_numpy()
-
-        dist = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
-        d["dist_to_prev"] = np.r_[np.nan, dist]
-
-        d["speed_calc_ms"] = d["dist_to_prev"] / d["dt"]
-        d["accel"] = d["speed_calc_ms"].diff() / d["dt"]
-        d["jerk"] = d["accel"].diff() / d["dt"]
-
-        # Faster than .diff().apply(ff.angle_wrap)
-        dcog_raw = d["cog"].diff().to_numpy()
-        dcog_wrapped = ((dcog_raw + 180) % 360) - 180
-        d["dcog"] = dcog_wrapped / d["dt"].to_numpy()
-
-        no_nan_cols = ["dt", "dist_to_prev", "speed_calc_ms", "accel", "jerk", "dcog"]
-        d = d.dropna(subset=no_nan_cols).reset_index(drop=True)
-
-        n = len(d)
-        if n < min_messages:
-            return None
-
-        times = d["date_time_utc"].to_numpy()
-        times_ns = times.astype("datetime64[ns]").astype("int64")
-        half_ns = int(half_window.value)
+    # Flat (trajectory, time) sorted arrays + trajectory offsets, one
+    # vectorized pass for all 13 features (see feature_engine.py)
+    return trajectory_features(df, half_window=half_window, min_messages=min_messages)
 
-        lat = d["lat"].to_numpy()
-        lon = d["lon"].to_numpy()
-        sog = d["speed_calc_ms"].to_numpy()
-        acc = d["accel"].to_numpy()
-        dcog = d["dcog"].to_numpy()
-        dist = d["dist_to_prev"].to_numpy()
-
-        abs_acc = np.abs(acc)
-        abs_dcog = np.abs(dcog)
-
-        lo_idx = np.searchsorted(times_ns, times_ns - half_ns, side="left")
-        hi_idx = np.searchsorted(times_ns, times_ns + half_ns, side="left")
-
-        counts = hi_idx - lo_idx
-        keep = counts >= min_messages
-
-        # Remove edge windows that are not fully inside trajectory
-        keep &= (times_ns - half_ns >= times_ns[0])
-        keep &= (times_ns + half_ns <= times_ns[-1])
-
-        if not keep.any():
-            return None
-
-        out = np.full((n, len(feat_names)), np.nan)
-
-        cnt = counts.astype(float)
-
-        sum_sog = window_sum(sog, lo_idx, hi_idx)
-        sum_sog2 = window_sum(sog ** 2, lo_idx, hi_idx)
-
-        sum_acc = window_sum(acc, lo_idx, hi_idx)
-        sum_acc2 = window_sum(acc ** 2, lo_idx, hi_idx)
-
-        sum_abs_acc = window_sum(abs_acc, lo_idx, hi_idx)
-
-        sum_dcog = window_sum(dcog, lo_idx, hi_idx)
-        sum_dcog2 = window_sum(dcog ** 2, lo_idx, hi_idx)
-        sum_abs_dcog = window_sum(abs_dcog, lo_idx, hi_idx)
-
-        path = window_sum(dist, lo_idx, hi_idx)
-
-        def fast_std(sum_x, sum_x2, cnt):
-            std = np.full_like(cnt, np.nan, dtype="float64")
-
-            valid = cnt > 1
-
-            var = (sum_x2[valid] - (sum_x[valid] ** 2) / cnt[valid]) / (cnt[valid] - 1)
-            var = np.maximum(var, 0)
-
-            std[valid] = np.sqrt(var)
-
-            return std
-
-        mean_sog = sum_sog / cnt
-        std_sog = fast_std(sum_sog, sum_sog2, cnt)
-
-        mean_acc = sum_acc / cnt
-        std_acc = fast_std(sum_acc, sum_acc2, cnt)
-
-        mean_dcog = sum_dcog / cnt
-        std_dcog = fast_std(sum_dcog, sum_dcog2, cnt)
-
-        net = haversine(
-            lat[lo_idx],
-            lon[lo_idx],
-            lat[hi_idx - 1],
-            lon[hi_idx - 1]
-        )
-
-        # min/max are harder to fully vectorize for variable windows.
-        # This loop is much cheaper now because only min/max remain.
-        min_sog = np.full(n, np.nan)
-        max_sog = np.full(n, np.nan)
-
-        valid_i = np.where(keep)[0]
-        for i in valid_i:
-            s = sog[lo_idx[i]:hi_idx[i]]
-            min_sog[i] = s.min()
-            max_sog[i] = s.max()
-
-        out[:, 0] = mean_sog
-        out[:, 1] = std_sog
-        out[:, 2] = min_sog
-        out[:, 3] = max_sog
-        out[:, 4] = mean_acc
-        out[:, 5] = std_acc
-        out[:, 6] = sum_abs_acc / cnt
-        out[:, 7] = sum_abs_dcog / cnt
-        out[:, 8] = std_dcog
-        out[:, 9] = sum_abs_dcog
-        out[:, 10] = path
-        out[:, 11] = net
-        out[:, 12] = np.where(path > 0, net / path, np.nan)
-
-        feat_df = pd.DataFrame(out, columns=feat_names)
-
-        small_d = d[["row_id", "report"]].reset_index(drop=True)
-        return pd.concat([small_d, feat_df], axis=1).loc[keep].reset_index(drop=True)
-
-    results = []
-
-    for traj_id, d in df.groupby("trajectory_id"):
-        feats = features_for_trip(d)
-        if feats is not None:
-            results.append(feats)
-
-    if not results:
-        return pd.DataFrame()
-
-    return pd.concat(results, ignore_index=True)
-
-def cluster_no_fishing(df, df_cluster_feats, n_clusters):
-    print(f"Clustering with K-means into {n_clusters} clusters.")
+def cluster_no_fishing(df, df_cluster_feats, n_clusters, model=None):
     df = df.copy()
 
     feature_cols = [
@@ -361,37 +119,35 @@ def cluster_no_fishing(df, df_cluster_feats, n_clusters):
         print("No clustering features found.")
         return df
 
-    cl = df_cluster_feats[
-            df_cluster_feats["report"].eq("no_fishing")
-        ].replace([np.inf, -np.inf], np.nan).dropna(subset=feature_cols).copy()
+    cl = no_fishing_rows(df_cluster_feats, feature_cols).copy()
 
-    X = cl[feature_cols].to_numpy()
+    if model is not None:
+        # Year-level model from fit_year_model: only a predict pass here
+        print(f"Predicting clusters with the persisted {len(model['centroids'])}-cluster model.")
+        cl["cluster"] = predict_clusters(model, cl)
+        no_fishing_cluster = model["no_fishing_cluster"]
+    else:
+        print(f"Clustering with K-means into {n_clusters} clusters.")
+        X = cl[feature_cols].to_numpy()
 
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
 
-    km = KMeans(n_clusters=n_clusters, random_state=0, n_init=10)
-    cl["cluster"] = km.fit_predict(X_scaled)
+        km = KMeans(n_clusters=n_clusters, random_state=0, n_init=10)
+        cl["cluster"] = km.fit_predict(X_scaled)
 
-    centroids = pd.DataFrame(
-        scaler.inverse_transform(km.cluster_centers_),
-        columns=feature_cols
-    )
-
-    print("\nCluster sizes:")
-    print(cl.groupby("cluster").size())
+        centroids = pd.DataFrame(
+            scaler.inverse_transform(km.cluster_centers_),
+            columns=feature_cols
+        )
 
-    print("\nCluster centroids:")
-    print(centroids.T)
+        print("\nCluster centroids:")
+        print(centroids.T)
 
-    # Heuristic: confident no-fishing is fast, stable and straight
-    score = (
-        centroids["mean_speed"].rank(ascending=True) +
-        centroids["straightness"].rank(ascending=True) +
-        centroids["std_speed"].rank(ascending=False)
-    )
+        no_fishing_cluster = pick_no_fishing_cluster(centroids)
 
-    no_fishing_cluster = score.idxmax()
+    print("\nCluster sizes:")
+    print(cl.groupby("cluster").size())
 
     print(f"\nChosen confident no_fishing cluster: {no_fishing_cluster}")
 
@@ -417,9 +173,11 @@ def add_confidence_flags(df):
 
 SPEED_THRESHOLD = 10  
 SPEED_WINDOW = pd.Timedelta(minutes=20)
+SPEED_SLIDING = False  # True: window centred on every message instead of fixed bins
 
 PORT_THRESHOLD_KM = 5
 SHORE_THRESHOLD_KM = 5
+SHORE_RASTER = "distance-from-shore.tif"
 
 HALF_WINDOW = pd.Timedelta(minutes=20) # looks 40 minutes in total then? maybe a bit long?
 MIN_MESSAGES = 10
@@ -433,49 +191,204 @@ ALLOWED_LIST = [["Not", "no_fishing"], ["Trål", "no_fishing"], ["Krokredskap",
 
 N_CLUSTERS = 2
 
-def main3():
-    #path = "sub_labels/ais_ers_sub_labels_"
-    path = "new_duration_limits/ais_ers_labels_"
-    for year in range(2023, 2023+1):
-        for start in range(1, 3+1, 3):   # starts at 1 and 
-            dfs = []
-            for i in range(start, start + 3):
-                df = pd.read_parquet(f"{path}{i:02d}_{year}.parquet")
-                df["trajectory_id"] = df["trajectory_id"].astype(str) + "-" + str(year) + "-" + str(i) # new unique traj_id
-                dfs.append(df)
-
-            base_df = pd.concat(dfs, ignore_index=True)
-    
-            for i in range(6):  # ALL gear
-                g = LIST[i]
-                allowed = ALLOWED_LIST[i]
-
-                print(f"Making for {g} year {year} months {start} to {start+3}")
-
-                df = load_ais_w_labels(base_df, allowed_report=allowed, gear=g)
-    
-                df = speed_rule(df, speed_threshold=SPEED_THRESHOLD, window_len=SPEED_WINDOW)
-        
-                #df = close_to_port(df, threshold_km=PORT_THRESHOLD_KM)
-                df = close_to_shore(df, threshold_km=SHORE_THRESHOLD_KM)
-        
-                feats_df_for_clustering = features_for_clustering(df, half_window=HALF_WINDOW, min_messages=MIN_MESSAGES)
-                df = cluster_no_fishing(df, df_cluster_feats=feats_df_for_clustering, n_clusters=N_CLUSTERS)
-
-                print(df.head())
-
-                df = add_confidence_flags(df)
-                
-                gear_name = next(iter(g))
-                if gear_name == "Bur og ruser": # Does not change the values in "report" == Bur og ruser ...
-                    gear_name = "Traps"
-                df.to_parquet(f"confident_new_rule_new_duration/{gear_name}_{year}_{start}_{start+2}.parquet", index=False)
+# "quarter": KMeans fitted per (year, quarter, gear) like before.
+# "year": one MiniBatchKMeans per (year, gear), fitted out-of-core on the
+# features of every quarter, persisted in MODEL_DIR and applied per quarter.
+CLUSTER_MODE = "quarter"
+MODEL_DIR = "cluster_models"
+
+#LABELS_PATH = "sub_labels/ais_ers_sub_labels_"
+LABELS_PATH = "new_duration_limits/ais_ers_labels_"
+OUT_DIR = "confident_new_rule_new_duration"
+YEARS = range(2023, 2023+1)
+QUARTER_STARTS = range(1, 3+1, 3)   # first month of each quarter
+
+def gear_file_name(g):
+    gear_name = next(iter(g))
+    if gear_name == "Bur og ruser": # Does not change the values in "report" == Bur og ruser ...
+        gear_name = "Traps"
+    return gear_name
+
+def confident_path(year, start, gear_idx):
+    return f"{OUT_DIR}/{gear_file_name(LIST[gear_idx])}_{year}_{start}_{start+2}.parquet"
+
+def quarter_files(year, start, path=LABELS_PATH):
+    return [f"{path}{i:02d}_{year}.parquet" for i in range(start, start + 3)]
+
+def load_quarter(year, start, path=LABELS_PATH, columns=None):
+    # The three months of a quarter in the compact schema, trajectory_id
+    # packed with its (year, month) so it is unique over the quarter
+    dfs = []
+    for i, f in zip(range(start, start + 3), quarter_files(year, start, path)):
+        df = read_compact(f, columns=columns)
+        df = with_trajectory_keys(df, year, i)
+        dfs.append(df)
 
-                del df, feats_df_for_clustering
-                gc.collect()
+    return concat_compact(dfs)
+
+def unit_name(unit):
+    year, start, i = unit
+    return f"{gear_file_name(LIST[i])}_{year}_{start}_{start+2}"
+
+def quarter_name(year, start):
+    return f"base_{year}_{start}_{start+2}"
+
+def base_key(year, start):
+    return make_key("base", [file_fingerprint(f) for f in quarter_files(year, start)])
+
+def base_outputs(quarter):
+    name, key = quarter_name(*quarter), base_key(*quarter)
+    return [checkpoint_path(name, "base", key), checkpoint_path(name, "summary", key)]
+
+def base_stage(year, start):
+    # Prepared quarter + per-trajectory report bitmask, shared by all gears
+    name, key = quarter_name(year, start), base_key(year, start)
+    df = checkpointed(name, "base", key, lambda: prepare_labels(load_quarter(year, start)))
+    summary = checkpointed(name, "summary", key, lambda: report_summary(df))
+    return df, summary
+
+def base_unit(quarter, shared=None):
+    base_stage(*quarter)
+
+def base_stage_keys(unit):
+    # Each stage is keyed on what it reads, so tuning one threshold only
+    # invalidates that rule (and the final flags), not the whole chain
+    year, start, i = unit
+    keys = {}
+    keys["load"] = make_key("load", base_key(year, start), ALLOWED_LIST[i], LIST[i])
+    keys["speed"] = make_key("speed", keys["load"], SPEED_THRESHOLD, SPEED_WINDOW, SPEED_SLIDING)
+    keys["shore"] = make_key("shore", keys["load"], SHORE_THRESHOLD_KM, file_fingerprint(SHORE_RASTER))
+    keys["features"] = make_key("features", keys["load"], HALF_WINDOW, MIN_MESSAGES)
+    return keys
+
+def year_units(year, i):
+    return [(year, start, i) for start in QUARTER_STARTS]
+
+def features_path(unit):
+    return checkpoint_path(unit_name(unit), "features", base_stage_keys(unit)["features"])
+
+def model_key(year, i):
+    return make_key("model", [base_stage_keys(u)["features"] for u in year_units(year, i)], N_CLUSTERS)
+
+def model_path(year, i):
+    return f"{MODEL_DIR}/kmeans_{gear_file_name(LIST[i])}_{year}_{model_key(year, i)}.joblib"
+
+def stage_keys(unit):
+    year, start, i = unit
+    keys = base_stage_keys(unit)
+    if CLUSTER_MODE == "year":
+        keys["cluster"] = make_key("cluster", keys["features"], N_CLUSTERS, model_key(year, i))
+    else:
+        keys["cluster"] = make_key("cluster", keys["features"], N_CLUSTERS)
+    keys["flags"] = make_key("flags", keys["speed"], keys["shore"], keys["cluster"])
+    return keys
+
+def unit_outputs(unit):
+    return [
+        confident_path(*unit),
+        checkpoint_path(unit_name(unit), "flags", stage_keys(unit)["flags"], suffix=".done"),
+    ]
 
-            del base_df
-            gc.collect()
+def load_stage(unit, keys):
+    year, start, i = unit
+
+    def load():
+        df, summary = base_stage(year, start)
+        return load_ais_w_labels(df, allowed_report=ALLOWED_LIST[i], gear=LIST[i], summary=summary)
+
+    return checkpointed(unit_name(unit), "load", keys["load"], load)
+
+def features_stage(unit, keys, df):
+    return checkpointed(unit_name(unit), "features", keys["features"],
+        lambda: features_for_clustering(df, half_window=HALF_WINDOW, min_messages=MIN_MESSAGES))
+
+def features_unit(unit, shared=None):
+    keys = base_stage_keys(unit)
+    features_stage(unit, keys, load_stage(unit, keys))
+
+def fit_year_model(year, i):
+    path = model_path(year, i)
+    if Path(path).exists():
+        return
+    print(f"Fitting year model for {LIST[i]} {year}")
+    paths = [features_path(u) for u in year_units(year, i) if features_path(u).exists()]
+    model = fit_streaming_model(paths, n_clusters=N_CLUSTERS)
+    if model is not None:
+        save_model(model, path)
+
+def confident_unit(unit, shared=None):
+    year, start, i = unit
+    g = LIST[i]
+    name = unit_name(unit)
+    keys = stage_keys(unit)
+
+    print(f"Making for {g} year {year} months {start} to {start+3}")
+
+    df = load_stage(unit, keys)
+
+    speed_cols = checkpointed(name, "speed", keys["speed"],
+        lambda: speed_rule(df, speed_threshold=SPEED_THRESHOLD, window_len=SPEED_WINDOW, sliding=SPEED_SLIDING)[["row_id", "high_speed"]])
+    df = attach_columns(df, speed_cols)
+
+    #df = close_to_port(df, threshold_km=PORT_THRESHOLD_KM)
+    shore_cols = checkpointed(name, "shore", keys["shore"],
+        lambda: close_to_shore(df, threshold_km=SHORE_THRESHOLD_KM, raster_path=SHORE_RASTER)[
+            ["row_id", "dist_to_shore_km", "close_to_shore"]
+        ])
+    df = attach_columns(df, shore_cols)
+
+    feats_df_for_clustering = features_stage(unit, keys, df)
+
+    model = None
+    if CLUSTER_MODE == "year":
+        # the cluster key names the year model, so never cache a per-quarter
+        # fit under it: without the model the unit fails and is rerun later
+        if not Path(model_path(year, i)).exists():
+            raise FileNotFoundError(
+                f"No year model {model_path(year, i)} for {name}: fit_year_model found no "
+                f"features or too few no_fishing windows, so this unit cannot be clustered")
+        model = load_model(model_path(year, i))
+
+    cluster_cols = checkpointed(name, "cluster", keys["cluster"],
+        lambda: cluster_no_fishing(df, df_cluster_feats=feats_df_for_clustering, n_clusters=N_CLUSTERS, model=model)[
+            ["row_id", "no_fish_cl"]
+        ])
+    df = attach_columns(df, cluster_cols)
+
+    print(df.head())
+
+    df = add_confidence_flags(df)
+
+    write_compact(df, confident_path(year, start, i))
+    mark_done(name, "flags", keys["flags"])
+
+    del df, feats_df_for_clustering
+    gc.collect()
+
+def main3(n_workers=N_WORKERS):
+    # Every (year, quarter, gear) is independent. Each worker holds one
+    # quarter in memory (see N_WORKERS in parallel_driver.py).
+    # Finished stages are read back from CHECKPOINT_DIR on reruns.
+    open_shore_raster(SHORE_RASTER)  # build the .npy cache once, the workers memory-map the same file
+    quarters = [(year, start) for year in YEARS for start in QUARTER_STARTS]
+    units = [(year, start, i) for year, start in quarters for i in range(6)]  # ALL gear
+
+    # scan, sort and summarise every quarter once before the six gears use it
+    run_units(base_unit, quarters, outputs=base_outputs, n_workers=n_workers)
+
+    if CLUSTER_MODE == "year":
+        # features for every quarter first, then one streamed fit per (year, gear)
+        run_units(features_unit, units, outputs=lambda u: [features_path(u)], n_workers=n_workers)
+        for year in YEARS:
+            for i in range(6):
+                fit_year_model(year, i)
+
+    run_units(
+        confident_unit,
+        units,
+        outputs=unit_outputs,
+        n_workers=n_workers,
+    )
     return
 
 
@@ -517,7 +430,7 @@ def plot(df, gear_set):
         ax.set_xlabel("Longitude")
         ax.set_ylabel("Latitude")
         ax.set_title(
-            f"Trajectory {traj_id} | "
+            f"Trajectory {trajectory_label(traj_id)} | "
             f"reported gear: {reported_gear}, "
             f"confident={len(confident)}, "
             f"unknown={len(unknown)}"
@@ -3,32 +3,14 @@ from tqdm import tqdm
 import numpy as np
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
-import rasterio
 import matplotlib.pyplot as plt
 import gc
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000 # Radius of the earth in meters
-
-    lat1 = np.radians(np.asarray(lat1, dtype=float))
-    lon1 = np.radians(np.asarray(lon1, dtype=float))
-    lat2 = np.radians(np.asarray(lat2, dtype=float))
-    lon2 = np.radians(np.asarray(lon2, dtype=float))
-
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-
-    # apply formulae
-    a = (pow(np.sin(dlat / 2), 2) +  
-             np.cos(lat1) * np.cos(lat2) * pow(np.sin(dlon / 2), 2))
-    
-    c = 2 * np.arcsin(np.sqrt(a))
-
-    dist = R * c
-    #speed = (dist/dt) * 1.94384 # Convert m/s to knots
-
-    return dist #, speed
+from feature_engine import trajectory_features, high_speed_flags
+from report_mask import prepare_labels, report_summary, select_trajectories
+from trajectory_keys import with_trajectory_keys, trajectory_label
+from label_schema import read_compact
+from shore_distance import sample_shore_distance
 
 def concat_year(months, path):
     print("Concating full year.")
@@ -37,7 +19,7 @@ def concat_year(months, path):
         print("Concating all of ", y)
         for m in range(1, months+1):
             df = pd.read_parquet(f"{path}{m:02d}_{y}.parquet")
-            df["trajectory_id"] = df["trajectory_id"].astype(str) + "-" + str(y) + "-" + str(m) # new unique traj_id
+            df = with_trajectory_keys(df, y, m) # new unique traj_id, packed int64
             dfs.append(df)
         year_df = pd.concat(dfs, ignore_index=True)
 
@@ -50,7 +32,7 @@ def concat_month(month, path):
     dfs = []
     for y in range(2022, 2024+1):
         df = pd.read_parquet(f"{path}{month:02d}_{y}.parquet")
-        df["trajectory_id"] = df["trajectory_id"].astype(str) + "-" + str(y) + "-" + str(month) # new unique traj_id
+        df = with_trajectory_keys(df, y, month) # new unique traj_id, packed int64
         dfs.append(df)
 
     return pd.concat(dfs, ignore_index=True)
@@ -60,31 +42,19 @@ def concat_3_months(year, path):
         dfs = []
         for i in range(start, start + 3):
             df = pd.read_parquet(f"{path}{i:02d}_{year}.parquet")
-            df["trajectory_id"] = df["trajectory_id"].astype(str) + "-" + str(year) + "-" + str(i) # new unique traj_id
+            df = with_trajectory_keys(df, year, i) # new unique traj_id, packed int64
             dfs.append(df)
 
     return pd.concat(dfs, ignore_index=True)
 
-def load_ais_w_labels(df, allowed_report, gear):
-    
-    df = df.fillna(value={"label": "no_fishing"})
+def load_ais_w_labels(df, allowed_report, gear, summary=None):
+    # df can be a raw label frame or one from prepare_labels together with its
+    # report_summary, so the gears of one base frame share the scan and sort
+    if summary is None:
+        df = prepare_labels(df)
+        summary = report_summary(df)
 
-    df = df.rename(columns={"label": "report"})
-
-    allowed_mask = df["report"].isin(allowed_report)
-    gear_mask = df["report"].isin(gear)
-
-    valid_by_traj = (
-        allowed_mask.groupby(df["trajectory_id"]).all() &
-        gear_mask.groupby(df["trajectory_id"]).any()
-    )
-
-    valid_ids = valid_by_traj[valid_by_traj].index
-    df = df[df["trajectory_id"].isin(valid_ids)].reset_index(drop=True)
-
-    df["date_time_utc"] = pd.to_datetime(df["date_time_utc"])
-
-    df = df.sort_values(["trajectory_id", "date_time_utc"]).reset_index(drop=True)
+    df = select_trajectories(df, summary, allowed_report, gear)
 
     df["row_id"] = np.arange(len(df))
 
@@ -96,252 +66,40 @@ def load_ais_w_labels(df, allowed_report, gear):
 
 # RULE 1: HIGH SPEED
 
-def speed_rule(df, speed_threshold, window_len):
+def speed_rule(df, speed_threshold, window_len, min_messages=5, sliding=False):
     print(f"Checking speed rule. Threshold: {speed_threshold} knots.")
-    df = df.copy()
-
-    window_seconds = window_len.total_seconds()
-
-    t0 = df.groupby("trajectory_id")["date_time_utc"].transform("min")
-
-    df["time_bin"] = (
-        (df["date_time_utc"] - t0)
-        .dt.total_seconds()
-        .floordiv(window_seconds)
-        .astype(int)
-    )
 
-    stats = (
-        df.groupby(["trajectory_id", "time_bin"])["speed"]
-        .agg(["mean", "size"])
-        .reset_index()
-    )
-
-    bad_bins = stats[
-        (stats["size"] >= 5) &
-        (stats["mean"] > speed_threshold)
-    ][["trajectory_id", "time_bin"]]
-
-    df = df.merge(
-        bad_bins.assign(high_speed_new=1),
-        on=["trajectory_id", "time_bin"],
-        how="left"
-    )
-
-    df["high_speed"] = df["high_speed_new"].fillna(0).astype(int)
+    # Per-(trajectory, time bin) mean/size as run reductions on the sorted
+    # arrays and broadcast straight back to the rows, so no merge/frame copy.
+    # sliding=True uses a window centred on every message instead of bins.
+    df["high_speed"] = high_speed_flags(
+        df, speed_threshold, window_len, min_messages=min_messages, sliding=sliding
+    ).astype(int)
 
-    return df.drop(columns=["time_bin", "high_speed_new"])
+    return df
 
-def close_to_shore(df, threshold_km, raster_path="distance-from-shore.tif"):
+def close_to_shore(df, threshold_km, raster_path="distance-from-shore.tif", decimals=4):
     print(f"Checking distance to shore. Shore threshold: {threshold_km}")
     df = df.copy()
-    print("Rounding coordinates...")
-    df["lon_r"] = df["lon"].round(4)
-    df["lat_r"] = df["lat"].round(4)
-
-    print("Finding unique coordinates...")
-    unique_pts = df[["lon_r", "lat_r"]].drop_duplicates().copy()
-
-    with rasterio.open(raster_path) as src:
-        print("Reading raster...")
-        band = src.read(1)
-        transform = src.transform
-        nodata = src.nodata
-
-        print("Preparing coordinate arrays...")
-        lon = unique_pts["lon_r"].to_numpy()
-        lat = unique_pts["lat_r"].to_numpy()
-
-        print("Converting to raster indices...")
-        cols, rows = ~transform * (lon, lat)
-        rows = rows.astype(int)
-        cols = cols.astype(int)
-
-        print("Filtering valid indices...")
-        valid = (
-            (rows >= 0) & (rows < band.shape[0]) &
-            (cols >= 0) & (cols < band.shape[1])
-        )
-
-        print("Sampling raster (vectorized)...")
-        dist = np.full(len(unique_pts), np.nan, dtype="float32")
-
-        # tqdm here to track assignment progress (optional but visible)
-        dist[valid] = band[rows[valid], cols[valid]]
 
-        if nodata is not None:
-            dist[dist == nodata] = np.nan
-
-        unique_pts["dist_to_shore_km"] = dist
-
-    print("Merging back...")
-    df = df.merge(unique_pts, on=["lon_r", "lat_r"], how="left")
+    # Every point is sampled at its rounded coordinate, which gives the same
+    # value the old unique-points + merge-back did, but the raster row/col is
+    # computed per point and gathered straight into the column (no join).
+    print("Sampling raster (direct index gather)...")
+    lon = np.round(df["lon"].to_numpy(dtype="float64"), decimals)
+    lat = np.round(df["lat"].to_numpy(dtype="float64"), decimals)
+    df["dist_to_shore_km"] = sample_shore_distance(lon, lat, raster_path=raster_path)
 
     df["close_to_shore"] = (df["dist_to_shore_km"] < threshold_km).astype(int)
 
-    print("Cleaning up...")
-    df = df.drop(columns=["lon_r", "lat_r"])
-
     return df
 
 def features_for_clustering(df, half_window, min_messages):
     print("Building features for clustering")
 
-    feat_names = [
-        "mean_speed", "std_speed", "min_speed", "max_speed",
-        "mean_acc", "std_acc", "mean_abs_acc",
-        "mean_abs_dcog", "std_dcog", "cum_abs_turn",
-        "path_length", "net_displacement", "straightness"
-    ]
-
-    def window_sum(x, lo, hi):
-        cs = np.r_[0, np.cumsum(x)]
-        return cs[hi] - cs[lo]
-
-    def features_for_trip(d):
-        d = d.sort_values("date_time_utc").reset_index(drop=True)
-
-        if len(d) < min_messages:
-            return None
-
-        d["dt"] = d["date_time_utc"].diff().dt.total_seconds()
-
-        lon = d["lon"].to_numpy()
-        lat = d["lat"].to_numpy()
-
-        dist = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
-        d["dist_to_prev"] = np.r_[np.nan, dist]
-
-        d["speed_calc_ms"] = d["dist_to_prev"] / d["dt"]
-        d["accel"] = d["speed_calc_ms"].diff() / d["dt"]
-        d["jerk"] = d["accel"].diff() / d["dt"]
-
-        # Faster than .diff().apply(ff.angle_wrap)
-        dcog_raw = d["cog"].diff().to_numpy()
-        dcog_wrapped = ((dcog_raw + 180) % 360) - 180
-        d["dcog"] = dcog_wrapped / d["dt"].to_numpy()
-
-        no_nan_cols = ["dt", "dist_to_prev", "speed_calc_ms", "accel", "jerk", "dcog"]
-        d = d.dropna(subset=no_nan_cols).reset_index(drop=True)
-
-        n = len(d)
-        if n < min_messages:
-            return None
-
-        times = d["date_time_utc"].to_numpy()
-        times_ns = times.astype("datetime64[ns]").astype("int64")
-        half_ns = int(half_window.value)
-
-        lat = d["lat"].to_numpy()
-        lon = d["lon"].to_numpy()
-        sog = d["speed_calc_ms"].to_numpy()
-        acc = d["accel"].to_numpy()
-        dcog = d["dcog"].to_numpy()
-        dist = d["dist_to_prev"].to_numpy()
-
-        abs_acc = np.abs(acc)
-        abs_dcog = np.abs(dcog)
-
-        lo_idx = np.searchsorted(times_ns, times_ns - half_ns, side="left")
-        hi_idx = np.searchsorted(times_ns, times_ns + half_ns, side="left")
-
-        counts = hi_idx - lo_idx
-        keep = counts >= min_messages
-
-        # Remove edge windows that are not fully inside trajectory
-        keep &= (times_ns - half_ns >= times_ns[0])
-        keep &= (times_ns + half_ns <= times_ns[-1])
-
-        if not keep.any():
-            return None
-
-        out = np.full((n, len(feat_names)), np.nan)
-
-        cnt = counts.astype(float)
-
-        sum_sog = window_sum(sog, lo_idx, hi_idx)
-        sum_sog2 = window_sum(sog ** 2, lo_idx, hi_idx)
-
-        sum_acc = window_sum(acc, lo_idx, hi_idx)
-        sum_acc2 = window_sum(acc ** 2, lo_idx, hi_idx)
-
-        sum_abs_acc = window_sum(abs_acc, lo_idx, hi_idx)
-
-        sum_dcog = window_sum(dcog, lo_idx, hi_idx)
-        sum_dcog2 = window_sum(dcog ** 2, lo_idx, hi_idx)
-        sum_abs_dcog = window_sum(abs_dcog, lo_idx, hi_idx)
-
-        path = window_sum(dist, lo_idx, hi_idx)
-
-        def fast_std(sum_x, sum_x2, cnt):
-            std = np.full_like(cnt, np.nan, dtype="float64")
-
-            valid = cnt > 1
-
-            var = (sum_x2[valid] - (sum_x[valid] ** 2) / cnt[valid]) / (cnt[valid] - 1)
-            var = np.maximum(var, 0)
-
-            std[valid] = np.sqrt(var)
-
-            return std
-
-        mean_sog = sum_sog / cnt
-        std_sog = fast_std(sum_sog, sum_sog2, cnt)
-
-        mean_acc = sum_acc / cnt
-        std_acc = fast_std(sum_acc, sum_acc2, cnt)
-
-        mean_dcog = sum_dcog / cnt
-        std_dcog = fast_std(sum_dcog, sum_dcog2, cnt)
-
-        net = haversine(
-            lat[lo_idx],
-            lon[lo_idx],
-            lat[hi_idx - 1],
-            lon[hi_idx - 1]
-        )
-
-        # min/max are harder to fully vectorize for variable windows.
-        # This loop is much cheaper now because only min/max remain.
-        min_sog = np.full(n, np.nan)
-        max_sog = np.full(n, np.nan)
-
-        valid_i = np.where(keep)[0]
-        for i in valid_i:
-            s = sog[lo_idx[i]:hi_idx[i]]
-            min_sog[i] = s.min()
-            max_sog[i] = s.max()
-
-        out[:, 0] = mean_sog
-        out[:, 1] = std_sog
-        out[:, 2] = min_sog
-        out[:, 3] = max_sog
-        out[:, 4] = mean_acc
-        out[:, 5] = std_acc
-        out[:, 6] = sum_abs_acc / cnt
-        out[:, 7] = sum_abs_dcog / cnt
-        out[:, 8] = std_dcog
-        out[:, 9] = sum_abs_dcog
-        out[:, 10] = path
-        out[:, 11] = net
-        out[:, 12] = np.where(path > 0, net / path, np.nan)
-
-        feat_df = pd.DataFrame(out, columns=feat_names)
-
-        small_d = d[["row_id", "report"]].reset_index(drop=True)
-        return pd.concat([small_d, feat_df], axis=1).loc[keep].reset_index(drop=True)
-
-    results = []
-
-    for traj_id, d in df.groupby("trajectory_id"):
-        feats = features_for_trip(d)
-        if feats is not None:
-            results.append(feats)
-
-    if not results:
-        return pd.DataFrame()
-
-    return pd.concat(results, ignore_index=True)
+    # Flat (trajectory, time) sorted arrays + trajectory offsets, one
+    # vectorized pass for all 13 features (see feature_engine.py)
+    return trajectory_features(df, half_window=half_window, min_messages=min_messages)
 
 def cluster_no_fishing(df, df_cluster_feats, n_clusters):
     print(f"Clustering with K-means into {n_clusters} clusters.")
@@ -436,8 +194,10 @@ def main():
     for y in range(2025, 2025+1): # should maybe do the clustering across all months .
         print(f"Loading all ais-data for {y}...")
         path = f"ais_ers_labels_full_{y}.parquet"
-        base_df = pd.read_parquet(path, engine="pyarrow")
+        base_df = read_compact(path)
         print(base_df.memory_usage(deep=True).sum() / 1e9, "GB")
+        base_df = prepare_labels(base_df)
+        summary = report_summary(base_df)
 
         for i in range(3):  # test on only Not and Trål
             g = LIST[i]
@@ -445,7 +205,7 @@ def main():
 
             print(f"Making for {g} year {y}")
 
-            df = load_ais_w_labels(base_df, allowed_report=allowed, gear=g)
+            df = load_ais_w_labels(base_df, allowed_report=allowed, gear=g, summary=summary)
  
             df = speed_rule(df, speed_threshold=SPEED_THRESHOLD, window_len=SPEED_WINDOW)
       
@@ -476,6 +236,8 @@ def main2():
         print(f"Loading all ais-data for month {m}...")
         base_df = concat_month(m, "ais_ers_labels_")
         #print(base_df.memory_usage(deep=True).sum() / 1e9, "GB")
+        base_df = prepare_labels(base_df)
+        summary = report_summary(base_df)
 
         for i in range(3):  # test on only Not and Trål
             g = LIST[i]
@@ -483,7 +245,7 @@ def main2():
 
             print(f"Making for {g} month {m}")
 
-            df = load_ais_w_labels(base_df, allowed_report=allowed, gear=g)
+            df = load_ais_w_labels(base_df, allowed_report=allowed, gear=g, summary=summary)
  
             df = speed_rule(df, speed_threshold=SPEED_THRESHOLD, window_len=SPEED_WINDOW)
       
@@ -516,10 +278,11 @@ def main3():
             dfs = []
             for i in range(start, start + 3):
                 df = pd.read_parquet(f"{path}{i:02d}_{year}.parquet")
-                df["trajectory_id"] = df["trajectory_id"].astype(str) + "-" + str(year) + "-" + str(i) # new unique traj_id
+                df = with_trajectory_keys(df, year, i) # new unique traj_id, packed int64
                 dfs.append(df)
 
-            base_df = pd.concat(dfs, ignore_index=True)
+            base_df = prepare_labels(pd.concat(dfs, ignore_index=True))
+            summary = report_summary(base_df)
     
             for i in range(6):  # ALL gear
                 g = LIST[i]
@@ -527,7 +290,7 @@ def main3():
 
                 print(f"Making for {g} year {year} months {start} to {start+3}")
 
-                df = load_ais_w_labels(base_df, allowed_report=allowed, gear=g)
+                df = load_ais_w_labels(base_df, allowed_report=allowed, gear=g, summary=summary)
     
                 df = speed_rule(df, speed_threshold=SPEED_THRESHOLD, window_len=SPEED_WINDOW)
         
@@ -591,7 +354,7 @@ def plot(df, gear_set):
         ax.set_xlabel("Longitude")
         ax.set_ylabel("Latitude")
         ax.set_title(
-            f"Trajectory {traj_id} | "
+            f"Trajectory {trajectory_label(traj_id)} | "
             f"reported gear: {reported_gear}, "
             f"confident={len(confident)}, "
             f"unknown={len(unknown)}"
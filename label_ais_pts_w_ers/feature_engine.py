@@ -0,0 +1,298 @@
+import numpy as np
+import pandas as pd
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from geodesy import haversine
+from kinematics import KINEMATICS_COLUMNS, kinematics_from_arrays
+
+# Array based version of features_for_clustering. Works on flat arrays sorted
+# by (trajectory, time) plus trajectory offsets, so there is no groupby, no
+# DataFrame per trip and no Python loop over windows. The per-message
+# kinematics come from the labeled file when it carries them (see
+# kinematics.py) and are only computed here for files that do not.
+
+FEATURE_NAMES = [
+    "mean_speed", "std_speed", "min_speed", "max_speed",
+    "mean_acc", "std_acc", "mean_abs_acc",
+    "mean_abs_dcog", "std_dcog", "cum_abs_turn",
+    "path_length", "net_displacement", "straightness"
+]
+
+
+def _seg_ids(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _segmented_searchsorted(seg, t, queries, side="left"):
+    """
+    searchsorted of each query inside its own trajectory, as global positions.
+    seg and t are sorted by (seg, t) and every query array is aligned with t.
+    Times are replaced by their rank so (seg, rank) fits in one int64 key.
+    """
+    all_t = np.unique(np.concatenate([t] + list(queries)))
+    stride = np.int64(len(all_t) + 1)
+    key = seg * stride + np.searchsorted(all_t, t)
+    return [
+        np.searchsorted(key, seg * stride + np.searchsorted(all_t, q), side=side)
+        for q in queries
+    ]
+
+
+def _window_sum(x, lo, hi):
+    cs = np.r_[0, np.cumsum(x)]
+    return cs[hi] - cs[lo]
+
+
+def window_min_max(x, lo, hi):
+    """
+    min and max of x[lo:hi] for every window (hi > lo), with a sparse table
+    built one level at a time: level j holds min/max over 2**j elements, and
+    a window of length L is covered by two level-floor(log2 L) blocks. Only
+    the current level is kept, so memory stays O(n).
+    """
+    length = hi - lo
+    level = np.zeros(len(lo), dtype=np.int64)
+    pos = length > 1
+    level[pos] = np.floor(np.log2(length[pos])).astype(np.int64)
+
+    out_min = np.full(len(lo), np.nan)
+    out_max = np.full(len(lo), np.nan)
+
+    cur_min = np.asarray(x, dtype="float64").copy()
+    cur_max = cur_min.copy()
+    j = 0
+    while True:
+        q = np.flatnonzero((level == j) & (length > 0))
+        if len(q):
+            a = lo[q]
+            b = hi[q] - (1 << j)
+            out_min[q] = np.minimum(cur_min[a], cur_min[b])
+            out_max[q] = np.maximum(cur_max[a], cur_max[b])
+
+        if not (level > j).any():
+            break
+
+        step = 1 << j
+        cur_min = np.minimum(cur_min[:-step], cur_min[step:])
+        cur_max = np.maximum(cur_max[:-step], cur_max[step:])
+        j += 1
+
+    return out_min, out_max
+
+
+def _fast_std(sum_x, sum_x2, cnt):
+    std = np.full_like(cnt, np.nan, dtype="float64")
+    valid = cnt > 1
+    var = (sum_x2[valid] - (sum_x[valid] ** 2) / cnt[valid]) / (cnt[valid] - 1)
+    std[valid] = np.sqrt(np.maximum(var, 0))
+    return std
+
+
+def _renumber(seg):
+    # consecutive trajectory numbers 0..k-1 after rows have been dropped
+    return np.r_[0, np.cumsum(np.diff(seg) != 0)] if len(seg) else seg
+
+
+def _offsets_from_seg(seg):
+    return np.r_[0, np.flatnonzero(np.diff(seg)) + 1, len(seg)]
+
+
+def _drop_short(offsets, min_messages):
+    # row mask keeping only trajectories with at least min_messages rows
+    lengths = np.diff(offsets)
+    return np.repeat(lengths >= min_messages, lengths)
+
+
+def features_from_arrays(offsets, t_ns, lat, lon, cog, half_ns, min_messages, kin=None):
+    """
+    offsets: start of every trajectory plus len(t_ns) at the end, rows sorted
+    by time inside each trajectory. kin: optional precomputed KINEMATICS_COLUMNS
+    aligned with t_ns. Returns (rows, features) where rows are the input
+    positions that get a feature vector and features is a (len(rows), 13)
+    array in FEATURE_NAMES order.
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty((0, len(FEATURE_NAMES))))
+
+    rows = np.arange(len(t_ns))
+    keep = _drop_short(offsets, min_messages)
+    seg = _renumber(_seg_ids(offsets)[keep])
+    rows, t_ns, lat, lon, cog = rows[keep], t_ns[keep], lat[keep], lon[keep], cog[keep]
+    if len(rows) == 0:
+        return empty
+
+    if kin is None:
+        kin = kinematics_from_arrays(_offsets_from_seg(seg)[:-1], t_ns, lat, lon, cog)
+    else:
+        # whole trajectories are dropped, so the steps inside the kept ones are unchanged
+        kin = {c: np.asarray(kin[c], dtype="float64")[keep] for c in KINEMATICS_COLUMNS}
+    dt, dist, speed = kin["dt_s"], kin["dist_to_prev_m"], kin["speed_calc_ms"]
+    accel, jerk, dcog = kin["accel"], kin["jerk"], kin["dcog"]
+
+    # same as dropna on dt, dist_to_prev, speed_calc_ms, accel, jerk, dcog (inf is kept)
+    keep = ~(np.isnan(dt) | np.isnan(dist) | np.isnan(speed) | np.isnan(accel) | np.isnan(jerk) | np.isnan(dcog))
+    seg = seg[keep]
+    if len(seg) == 0:
+        return empty
+    keep2 = _drop_short(_offsets_from_seg(seg), min_messages)
+    keep[keep] = keep2
+    seg = _renumber(seg[keep2])
+    if len(seg) == 0:
+        return empty
+
+    rows, t_ns, lat, lon = rows[keep], t_ns[keep], lat[keep], lon[keep]
+    sog, acc, dcog, dist = speed[keep], accel[keep], dcog[keep], dist[keep]
+    offsets = _offsets_from_seg(seg)
+
+    lo_idx, hi_idx = _segmented_searchsorted(seg, t_ns, [t_ns - half_ns, t_ns + half_ns], side="left")
+    counts = hi_idx - lo_idx
+
+    # Remove edge windows that are not fully inside trajectory
+    seg_first_t = t_ns[offsets[:-1]][seg]
+    seg_last_t = t_ns[offsets[1:] - 1][seg]
+    keep = counts >= min_messages
+    keep &= (t_ns - half_ns >= seg_first_t)
+    keep &= (t_ns + half_ns <= seg_last_t)
+    if not keep.any():
+        return empty
+
+    lo_idx, hi_idx = lo_idx[keep], hi_idx[keep]
+    cnt = counts[keep].astype(float)
+
+    # Prefix sums over the whole array are fine since windows never cross
+    # trajectories. Non-finite samples (dt == 0) are summed as 0 and windows
+    # that contain one get NaN sums instead of poisoning every later window.
+    bad = ~(np.isfinite(sog) & np.isfinite(acc) & np.isfinite(dcog))
+    n_bad = _window_sum(bad, lo_idx, hi_idx)
+
+    def wsum(x):
+        s = _window_sum(np.where(bad, 0.0, x), lo_idx, hi_idx)
+        s[n_bad > 0] = np.nan
+        return s
+
+    sum_sog, sum_sog2 = wsum(sog), wsum(sog ** 2)
+    sum_acc, sum_acc2 = wsum(acc), wsum(acc ** 2)
+    sum_abs_acc = wsum(np.abs(acc))
+    sum_dcog, sum_dcog2 = wsum(dcog), wsum(dcog ** 2)
+    sum_abs_dcog = wsum(np.abs(dcog))
+    path = wsum(dist)
+
+    net = haversine(lat[lo_idx], lon[lo_idx], lat[hi_idx - 1], lon[hi_idx - 1])
+    min_sog, max_sog = window_min_max(sog, lo_idx, hi_idx)
+
+    out = np.empty((len(lo_idx), len(FEATURE_NAMES)))
+    out[:, 0] = sum_sog / cnt
+    out[:, 1] = _fast_std(sum_sog, sum_sog2, cnt)
+    out[:, 2] = min_sog
+    out[:, 3] = max_sog
+    out[:, 4] = sum_acc / cnt
+    out[:, 5] = _fast_std(sum_acc, sum_acc2, cnt)
+    out[:, 6] = sum_abs_acc / cnt
+    out[:, 7] = sum_abs_dcog / cnt
+    out[:, 8] = _fast_std(sum_dcog, sum_dcog2, cnt)
+    out[:, 9] = sum_abs_dcog
+    out[:, 10] = path
+    out[:, 11] = net
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[:, 12] = np.where(path > 0, net / path, np.nan)
+
+    return rows[keep], out
+
+
+def high_speed_from_arrays(seg, t_ns, speed, window_ns, speed_threshold, min_messages, sliding=False):
+    """
+    seg and t_ns sorted by (seg, t_ns). Flags rows in windows with at least
+    min_messages messages and mean speed above speed_threshold (NaN speeds
+    count as messages but not in the mean, like groupby mean/size).
+    Fixed: bins of window_ns from the first message of each trajectory.
+    Sliding: the window [t - window_ns/2, t + window_ns/2) around every row.
+    """
+    n = len(seg)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+
+    finite = ~np.isnan(speed)
+    speed0 = np.where(finite, speed, 0.0)
+
+    if sliding:
+        half = window_ns // 2
+        lo, hi = _segmented_searchsorted(seg, t_ns, [t_ns - half, t_ns + half], side="left")
+        count = hi - lo
+        n_speed = _window_sum(finite, lo, hi)
+        sum_speed = _window_sum(speed0, lo, hi)
+    else:
+        offsets = _offsets_from_seg(seg)
+        t0 = np.repeat(t_ns[offsets[:-1]], np.diff(offsets))
+        time_bin = (t_ns - t0) // window_ns
+        # bins are non-decreasing inside a trajectory, so every (seg, bin) is one run
+        starts = np.flatnonzero(np.r_[True, (seg[1:] != seg[:-1]) | (time_bin[1:] != time_bin[:-1])])
+        run_len = np.diff(np.r_[starts, n])
+        count = np.repeat(run_len, run_len)
+        n_speed = np.repeat(np.add.reduceat(finite.astype(np.int64), starts), run_len)
+        sum_speed = np.repeat(np.add.reduceat(speed0, starts), run_len)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sum_speed / n_speed
+    return (count >= min_messages) & (n_speed > 0) & (mean > speed_threshold)
+
+
+def trajectory_features(df, half_window, min_messages):
+    """
+    DataFrame wrapper: sorts by (trajectory_id, date_time_utc), builds the
+    offsets and returns row_id, report and the 13 features per kept row.
+    """
+    codes, _ = pd.factorize(df["trajectory_id"], sort=True)
+    t_ns = df["date_time_utc"].to_numpy().astype("datetime64[ns]").astype("int64")
+    order = np.lexsort((t_ns, codes))
+    order = order[codes[order] >= 0]  # groupby drops missing trajectory ids
+
+    codes = codes[order]
+    offsets = _offsets_from_seg(codes) if len(codes) else np.array([0])
+
+    kin = None
+    if all(c in df for c in KINEMATICS_COLUMNS):
+        kin = {c: df[c].to_numpy(dtype="float64")[order] for c in KINEMATICS_COLUMNS}
+
+    rows, feats = features_from_arrays(
+        offsets,
+        t_ns[order],
+        df["lat"].to_numpy(dtype="float64")[order],
+        df["lon"].to_numpy(dtype="float64")[order],
+        df["cog"].to_numpy(dtype="float64")[order],
+        half_ns=int(pd.Timedelta(half_window).value),
+        min_messages=min_messages,
+        kin=kin,
+    )
+    if len(rows) == 0:
+        return pd.DataFrame()
+
+    src = order[rows]
+    out = pd.DataFrame({
+        "row_id": df["row_id"].to_numpy()[src],
+        "report": df["report"].to_numpy()[src],
+    })
+    return pd.concat([out, pd.DataFrame(feats, columns=FEATURE_NAMES)], axis=1)
+
+
+def high_speed_flags(df, speed_threshold, window_len, min_messages=5, sliding=False):
+    """
+    DataFrame wrapper for high_speed_from_arrays, returns a flag per row of
+    df in its own row order. Rows without a trajectory_id are not flagged.
+    """
+    codes, _ = pd.factorize(df["trajectory_id"], sort=True)
+    t_ns = df["date_time_utc"].to_numpy().astype("datetime64[ns]").astype("int64")
+    order = np.lexsort((t_ns, codes))
+    order = order[codes[order] >= 0]
+
+    flags = np.zeros(len(df), dtype=bool)
+    flags[order] = high_speed_from_arrays(
+        codes[order],
+        t_ns[order],
+        df["speed"].to_numpy(dtype="float64")[order],
+        window_ns=int(pd.Timedelta(window_len).value),
+        speed_threshold=speed_threshold,
+        min_messages=min_messages,
+        sliding=sliding,
+    )
+    return flags
@@ -1,6 +1,14 @@
+import sys
+from pathlib import Path
 import pandas as pd
 import pyarrow.parquet as pq
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from interval_join import assign_labels, build_interval_index
+from ers_ingest import load_ers
+from label_schema import write_compact
+from kinematics import read_kinematics
+
 GEAR_TYPES = ["Trål", "Not", "Krokredskap", "Snurrevad", "Garn", "Bur og ruser"]
 #GEAR_TYPES = ["Krokredskap"]
 
@@ -14,7 +22,8 @@ DURATION_LIMITS = {
 }
 
 def get_ers(ers_path, gear_types=GEAR_TYPES, activities=["I fiske"]):
-    df_ers = pd.read_csv(ers_path)
+    # Typed, cached read: times parsed, callsigns normalized, gear columns stripped
+    df_ers = load_ers(ers_path)
 
     print(df_ers["Redskap - gruppe"].unique())
 
@@ -32,40 +41,15 @@ def get_ers(ers_path, gear_types=GEAR_TYPES, activities=["I fiske"]):
     )
     df_ers = df_ers.drop_duplicates(keep="first")
 
-    df_ers = df_ers[
-        df_ers["Starttidspunkt"].str.contains(" ", na=False) &
-        df_ers["Stopptidspunkt"].str.contains(" ", na=False)
-    ]
-
-    fmt = "%d.%m.%Y %H:%M:%S"
-    df_ers["Starttidspunkt"] = pd.to_datetime(df_ers["Starttidspunkt"], format=fmt)
-    df_ers["Stopptidspunkt"] = pd.to_datetime(df_ers["Stopptidspunkt"], format=fmt)
-
     df_ers = df_ers.loc[df_ers["Stopptidspunkt"] >= df_ers["Starttidspunkt"]].copy()
-    df_ers["Varighet"] = pd.to_numeric(df_ers["Varighet"], errors="coerce")
-
-    df_ers["Radiokallesignal (ERS)"] = (
-        df_ers["Radiokallesignal (ERS)"].astype("string").str.strip().str.upper()
-    )
-
-    df_ers["Redskap - gruppe"] = (
-        df_ers["Redskap - gruppe"].astype("string").str.strip()
-    )
-
-    df_ers["Redskap FDIR"] = (
-        df_ers["Redskap FDIR"].astype("string").str.strip()
-    )
-
-    df_ers["Redskap FAO"] = (
-        df_ers["Redskap FAO"].astype("string").str.strip()
-    )
 
     df_ers = df_ers.loc[df_ers["Redskap - gruppe"].isin(gear_types)].copy()
     df_ers = df_ers.loc[df_ers["Aktivitet"].isin(activities)].copy()
 
     # apply duration limits for each gear type
-    df_ers["min_duration"] = df_ers["Redskap - gruppe"].map(lambda g: DURATION_LIMITS[g][0])
-    df_ers["max_duration"] = df_ers["Redskap - gruppe"].map(lambda g: DURATION_LIMITS[g][1])
+    gear = df_ers["Redskap - gruppe"].astype("string")  # categorical keeps every gear as a category
+    df_ers["min_duration"] = gear.map(lambda g: DURATION_LIMITS[g][0])
+    df_ers["max_duration"] = gear.map(lambda g: DURATION_LIMITS[g][1])
 
     df_ers = df_ers.loc[
         (df_ers["Varighet"] >= df_ers["min_duration"]) &
@@ -83,7 +67,8 @@ def get_registered_callsigns(df_ers):
 def read_ais_parquet(parquet_path, callsigns=None):
     columns = ["mmsi", "trajectory_id", "callsign", "date_time_utc", "lon", "lat", "speed", "cog"]
 
-    df_ais = pd.read_parquet(parquet_path, columns=columns, engine="pyarrow")
+    # the kinematics sidecar (kinematics.py) is joined onto the AIS columns
+    df_ais = read_kinematics(parquet_path, columns=columns)
 
     df_ais["callsign"] = (
         df_ais["callsign"]
@@ -106,39 +91,10 @@ def read_ais_parquet(parquet_path, callsigns=None):
 
     return df_ais
 
-def assign_ais_message_to_label(df_ais, df_ers):
-
-    df_ais["label"] = pd.NA
-    df_ais["label_sub1"] = pd.NA  # Redskap FAO
-    df_ais["label_sub2"] = pd.NA  # Redskap FDIR
-
-    ers_groups = {
-        callsign: d.sort_values("Starttidspunkt").reset_index(drop=True)
-        for callsign, d in df_ers.groupby("Radiokallesignal (ERS)", sort=False)
-    }
-
-    labeled_parts = []
-
-    for callsign, d_ais in df_ais.groupby("callsign", sort=False):
-        d_ais = d_ais.sort_values("date_time_utc").copy()
-        if callsign not in ers_groups:
-            labeled_parts.append(d_ais)
-            continue
-
-        d_ers = ers_groups[callsign]
-        for _, row in d_ers.iterrows():
-            mask = (
-                (d_ais["date_time_utc"] >= row["Starttidspunkt"]) &
-                (d_ais["date_time_utc"] <= row["Stopptidspunkt"])
-            )
-            d_ais.loc[mask, "label"] = row["Redskap - gruppe"]
-            d_ais.loc[mask, "label_sub1"] = row["Redskap FAO"]
-            d_ais.loc[mask, "label_sub2"] = row["Redskap FDIR"]
-
-        labeled_parts.append(d_ais)
-
-    df_labeled = pd.concat(labeled_parts, ignore_index=True)
-    return df_labeled
+def assign_ais_message_to_label(df_ais, df_ers, ers_index=None):
+    # Sorted interval join per callsign, same "last window wins" result as
+    # looping over the ERS windows in start order (see interval_join.py)
+    return assign_labels(df_ais, df_ers, ers_index=ers_index)
 
 
 def local_main():
@@ -159,6 +115,7 @@ def main():
         df_ers = get_ers(ers_path=f"ers-fangstmelding-nonan-{year}.csv")
         registered_callsigns = get_registered_callsigns(df_ers)
         print("Nr of vessels in ERS", len(registered_callsigns))
+        ers_index = build_interval_index(df_ers)
 
         for month in range(1, 13):
             filepath = f"../../../Test/IDUN/Processed_AIS_{year}/Cleaned_pq_new/{month:02d}.parquet"
@@ -166,8 +123,8 @@ def main():
             df_ais = read_ais_parquet(parquet_path=filepath, callsigns=registered_callsigns)
             print("Callsigns matched in ais ", df_ais["callsign"].nunique())
 
-            df_ais_with_labels = assign_ais_message_to_label(df_ais, df_ers)
-            df_ais_with_labels.to_parquet(f"sub_labels/ais_ers_sub_labels_{month:02d}_{year}.parquet", index=False)
+            df_ais_with_labels = assign_ais_message_to_label(df_ais, df_ers, ers_index=ers_index)
+            write_compact(df_ais_with_labels, f"sub_labels/ais_ers_sub_labels_{month:02d}_{year}.parquet")
 
 
 if __name__ == "__main__":
@@ -1,6 +1,16 @@
+import sys
+from pathlib import Path
 import pandas as pd
+import pyarrow as pa
 import pyarrow.parquet as pq
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from interval_join import assign_labels, build_interval_index
+from ers_ingest import load_ers
+from parallel_driver import run_units, atomic_output, N_WORKERS
+from label_schema import compact_schema, to_table
+from kinematics import KINEMATICS_COLUMNS, build_kinematics, iter_kinematics, read_kinematics
+
 GEAR_TYPES = ["Trål", "Not", "Krokredskap", "Snurrevad", "Garn", "Bur og ruser"]
 #GEAR_TYPES = ["Bur og ruser"]
 
@@ -13,8 +23,19 @@ DURATION_LIMITS = {
     "Bur og ruser": (10, 300)
 }
 
+# the kinematics sidecar of the AIS file is joined onto SOURCE_COLUMNS, so
+# every labeled file carries them and the feature stage does not recompute them
+SOURCE_COLUMNS = ["mmsi", "trajectory_id", "callsign", "date_time_utc", "lon", "lat", "speed", "cog"]
+LABEL_COLUMNS = ["label", "label_sub1", "label_sub2"]
+
+# Streaming mode: label the monthly AIS file in record batches of this many
+# rows, so peak memory follows BATCH_SIZE instead of the size of the month
+STREAMING = True
+BATCH_SIZE = 2_000_000
+
 def get_ers(ers_path, gear_types=GEAR_TYPES, activities=["I fiske"]):
-    df_ers = pd.read_csv(ers_path)
+    # Typed, cached read: times parsed, callsigns normalized, gear columns stripped
+    df_ers = load_ers(ers_path)
 
     print(df_ers["Redskap - gruppe"].unique())
 
@@ -32,40 +53,15 @@ def get_ers(ers_path, gear_types=GEAR_TYPES, activities=["I fiske"]):
     )
     df_ers = df_ers.drop_duplicates(keep="first")
 
-    df_ers = df_ers[
-        df_ers["Starttidspunkt"].str.contains(" ", na=False) &
-        df_ers["Stopptidspunkt"].str.contains(" ", na=False)
-    ]
-
-    fmt = "%d.%m.%Y %H:%M:%S"
-    df_ers["Starttidspunkt"] = pd.to_datetime(df_ers["Starttidspunkt"], format=fmt)
-    df_ers["Stopptidspunkt"] = pd.to_datetime(df_ers["Stopptidspunkt"], format=fmt)
-
     df_ers = df_ers.loc[df_ers["Stopptidspunkt"] >= df_ers["Starttidspunkt"]].copy()
-    df_ers["Varighet"] = pd.to_numeric(df_ers["Varighet"], errors="coerce")
-
-    df_ers["Radiokallesignal (ERS)"] = (
-        df_ers["Radiokallesignal (ERS)"].astype("string").str.strip().str.upper()
-    )
-
-    df_ers["Redskap - gruppe"] = (
-        df_ers["Redskap - gruppe"].astype("string").str.strip()
-    )
-
-    df_ers["Redskap FDIR"] = (
-        df_ers["Redskap FDIR"].astype("string").str.strip()
-    )
-
-    df_ers["Redskap FAO"] = (
-        df_ers["Redskap FAO"].astype("string").str.strip()
-    )
 
     df_ers = df_ers.loc[df_ers["Redskap - gruppe"].isin(gear_types)].copy()
     df_ers = df_ers.loc[df_ers["Aktivitet"].isin(activities)].copy()
 
     # apply duration limits for each gear type
-    df_ers["min_duration"] = df_ers["Redskap - gruppe"].map(lambda g: DURATION_LIMITS[g][0])
-    df_ers["max_duration"] = df_ers["Redskap - gruppe"].map(lambda g: DURATION_LIMITS[g][1])
+    gear = df_ers["Redskap - gruppe"].astype("string")  # categorical keeps every gear as a category
+    df_ers["min_duration"] = gear.map(lambda g: DURATION_LIMITS[g][0])
+    df_ers["max_duration"] = gear.map(lambda g: DURATION_LIMITS[g][1])
 
     df_ers = df_ers.loc[
         (df_ers["Varighet"] >= df_ers["min_duration"]) &
@@ -80,11 +76,7 @@ def get_ers(ers_path, gear_types=GEAR_TYPES, activities=["I fiske"]):
 def get_registered_callsigns(df_ers):
     return df_ers["Radiokallesignal (ERS)"].unique()
 
-def read_ais_parquet(parquet_path):
-    columns = ["mmsi", "trajectory_id", "callsign", "date_time_utc", "lon", "lat", "speed", "cog"]
-
-    df_ais = pd.read_parquet(parquet_path, columns=columns, engine="pyarrow")
-
+def clean_ais(df_ais):
     df_ais["callsign"] = (
         df_ais["callsign"]
         .astype("string")
@@ -97,39 +89,64 @@ def read_ais_parquet(parquet_path):
 
     return df_ais
 
-def assign_ais_message_to_label(df_ais, df_ers):
-
-    df_ais["label"] = pd.NA
-    df_ais["label_sub1"] = pd.NA  # Redskap FAO
-    df_ais["label_sub2"] = pd.NA  # Redskap FDIR
-
-    ers_groups = {
-        callsign: d.sort_values("Starttidspunkt").reset_index(drop=True)
-        for callsign, d in df_ers.groupby("Radiokallesignal (ERS)", sort=False)
-    }
-
-    labeled_parts = []
-
-    for callsign, d_ais in df_ais.groupby("callsign", sort=False):
-        d_ais = d_ais.sort_values("date_time_utc").copy()
-        if callsign not in ers_groups:
-            labeled_parts.append(d_ais)
-            continue
-
-        d_ers = ers_groups[callsign]
-        for _, row in d_ers.iterrows():
-            mask = (
-                (d_ais["date_time_utc"] >= row["Starttidspunkt"]) &
-                (d_ais["date_time_utc"] <= row["Stopptidspunkt"])
-            )
-            d_ais.loc[mask, "label"] = row["Redskap - gruppe"]
-            d_ais.loc[mask, "label_sub1"] = row["Redskap FAO"]
-            d_ais.loc[mask, "label_sub2"] = row["Redskap FDIR"]
-
-        labeled_parts.append(d_ais)
-
-    df_labeled = pd.concat(labeled_parts, ignore_index=True)
-    return df_labeled
+def read_ais_parquet(parquet_path):
+    df_ais = read_kinematics(parquet_path, columns=SOURCE_COLUMNS)
+    return clean_ais(df_ais)
+
+def assign_ais_message_to_label(df_ais, df_ers, ers_index=None):
+    # Sorted interval join per callsign, same "last window wins" result as
+    # looping over the ERS windows in start order (see interval_join.py)
+    return assign_labels(df_ais, df_ers, ers_index=ers_index)
+
+
+def labeled_schema(parquet_path):
+    """
+    Schema of the labeled file of parquet_path, fixed before the first
+    batch so an all-null column in one batch cannot change the types.
+    """
+    source = pq.read_schema(parquet_path)
+    fields = []
+    for c in SOURCE_COLUMNS:
+        t = source.field(c).type
+        if c == "date_time_utc" and not pa.types.is_timestamp(t):
+            t = pa.timestamp("ns")  # clean_ais parses the strings
+        fields.append(pa.field(c, t))
+    fields += [pa.field(c, pa.float32()) for c in KINEMATICS_COLUMNS]
+    fields += [pa.field(c, pa.string()) for c in LABEL_COLUMNS]
+    return compact_schema(pa.schema(fields))
+
+
+def label_ais_parquet_streaming(parquet_path, save_path, df_ers, ers_index=None, batch_size=BATCH_SIZE):
+    """
+    Same labels as read_ais_parquet + assign_ais_message_to_label + to_parquet,
+    but the AIS file is read batch by batch (with its kinematics) and every
+    labeled batch is appended to the output file. Rows come out grouped by
+    callsign and time sorted within each batch, not across the whole month.
+    """
+    if ers_index is None:
+        ers_index = build_interval_index(df_ers)
+
+    schema = labeled_schema(parquet_path)
+    n_rows = 0
+    # a month without any AIS rows still gets a (typed) empty file
+    with pq.ParquetWriter(save_path, schema) as writer:
+        for batch in iter_kinematics(parquet_path, columns=SOURCE_COLUMNS, batch_size=batch_size):
+            if batch.num_rows == 0:
+                continue
+
+            df_ais = clean_ais(batch.to_pandas())
+            if df_ais.empty:
+                continue
+
+            df_labeled = assign_ais_message_to_label(df_ais, df_ers, ers_index=ers_index)
+            # also types the all-null label columns of a batch without ERS matches
+            table = to_table(df_labeled[schema.names], schema=schema)
+
+            writer.write_table(table)
+            n_rows += table.num_rows
+
+    print(f"Labeled {n_rows} AIS messages from {parquet_path}")
+    return n_rows
 
 
 def local_main():
@@ -144,20 +161,51 @@ def local_main():
     print(df_ais_with_labels.head())
     #df_ais_with_labels.to_parquet("ais_ers_krok_09_2024.parquet")
 
+YEARS = range(2023, 2023+1)
+MONTHS = range(1, 13)
+
+def ais_month_path(year, month):
+    return f"../../../Test/IDUN/Processed_AIS_{year}/Cleaned_pq_new/{month:02d}.parquet"
+
+def labels_path(year, month):
+    return f"new_duration_limits/ais_ers_labels_{month:02d}_{year}.parquet"
+
+def label_month(unit, ers_by_year):
+    year, month = unit
+    df_ers, ers_index = ers_by_year[year]
+    filepath = ais_month_path(year, month)
+
+    with atomic_output(labels_path(year, month)) as tmp_path:
+        if STREAMING:
+            label_ais_parquet_streaming(filepath, tmp_path, df_ers, ers_index=ers_index)
+            return
+
+        df_ais = read_ais_parquet(parquet_path=filepath)
+
+        df_ais_with_labels = assign_ais_message_to_label(df_ais, df_ers, ers_index=ers_index)
+        pq.write_table(to_table(df_ais_with_labels), tmp_path)
+
 # yeeha
-def main():
-    for year in range(2023, 2023+1):
+def main(n_workers=N_WORKERS):
+    # ERS is parsed once per year in the parent and shared read-only with the workers
+    ers_by_year = {}
+    for year in YEARS:
         df_ers = get_ers(ers_path=f"ers-fangstmelding-nonan-{year}.csv")
         registered_callsigns = get_registered_callsigns(df_ers)
         print("Nr of vessels in ERS", len(registered_callsigns))
-
-        for month in range(1, 13):
-            filepath = f"../../../Test/IDUN/Processed_AIS_{year}/Cleaned_pq_new/{month:02d}.parquet"
-
-            df_ais = read_ais_parquet(parquet_path=filepath)
-
-            df_ais_with_labels = assign_ais_message_to_label(df_ais, df_ers)
-            df_ais_with_labels.to_parquet(f"new_duration_limits/ais_ers_labels_{month:02d}_{year}.parquet", index=False)
+        ers_by_year[year] = (df_ers, build_interval_index(df_ers))
+
+    units = [(year, month) for year in YEARS for month in MONTHS]
+    # kinematics sidecars first, one month at a time in the parent, so the
+    # streaming workers only read them (see kinematics.py)
+    build_kinematics([ais_month_path(*u) for u in units])
+    run_units(
+        label_month,
+        units,
+        outputs=lambda u: [labels_path(*u)],
+        shared=ers_by_year,
+        n_workers=n_workers,
+    )
 
 
 if __name__ == "__main__":
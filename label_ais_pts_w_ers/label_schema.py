@@ -0,0 +1,90 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+from parallel_driver import atomic_output
+
+# Compact column types for the labeled AIS files and the confident-negative
+# outputs. Strings are written as plain strings (parquet dictionary-encodes
+# them on disk) and read back as categoricals, kinematics are float32 and the
+# 0/1 rule flags uint8. lat/lon stay float64: float32 rounds them to about a
+# metre, which is a large part of the distance between two 10 s messages.
+
+CATEGORY_COLUMNS = ["callsign", "label", "label_sub1", "label_sub2", "report"]
+# per-message kinematics carried over from the AIS files (kinematics.py)
+KINEMATICS_COLUMNS = ["dt_s", "dist_to_prev_m", "speed_calc_ms", "accel", "jerk", "dcog"]
+FLOAT32_COLUMNS = ["speed", "cog", "dist_to_shore_km"] + KINEMATICS_COLUMNS
+FLAG_COLUMNS = ["high_speed", "close_to_shore", "no_fish_cl", "passed_any_rule"]
+
+
+def compact(df):
+    """
+    Casts the known columns of df to the compact types, in place. Columns
+    that are missing are skipped, so it works on any stage of the pipeline.
+    """
+    for c in CATEGORY_COLUMNS:
+        if c in df and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    for c in FLOAT32_COLUMNS:
+        if c in df:
+            df[c] = df[c].astype("float32")
+    for c in FLAG_COLUMNS:
+        if c in df:
+            df[c] = df[c].fillna(0).astype("uint8")
+    return df
+
+
+def _arrow_type(name, t):
+    if name in CATEGORY_COLUMNS:
+        return pa.string()
+    if name in FLOAT32_COLUMNS:
+        return pa.float32()
+    if name in FLAG_COLUMNS:
+        return pa.uint8()
+    if pa.types.is_null(t):
+        # a batch where nothing matched has all-null columns
+        return pa.string()
+    return t
+
+
+def compact_schema(schema):
+    """Write-side version of a pyarrow schema, the types to_table produces."""
+    return pa.schema([pa.field(f.name, _arrow_type(f.name, f.type)) for f in schema])
+
+
+def to_table(df, schema=None):
+    """
+    pyarrow Table of df with the write-side schema applied, or cast to
+    schema when given (e.g. one pinned for every batch of a file).
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.cast(compact_schema(table.schema) if schema is None else schema)
+
+
+def write_compact(df, path):
+    with atomic_output(path) as tmp:
+        pq.write_table(to_table(df), tmp)
+
+
+def read_compact(path, columns=None):
+    """
+    pd.read_parquet with the string columns decoded straight to categoricals
+    (no Python string per row) and the rest cast by compact(), so files
+    written before the schema existed come back compact as well.
+    """
+    names = pq.read_schema(path).names
+    dictionary = [c for c in CATEGORY_COLUMNS if c in names and (columns is None or c in columns)]
+    df = pq.read_table(path, columns=columns, read_dictionary=dictionary).to_pandas()
+    return compact(df)
+
+
+def concat_compact(dfs):
+    # pd.concat falls back to object for categoricals whose categories
+    # differ, so give every frame the union of the categories first
+    for c in CATEGORY_COLUMNS:
+        if len(dfs) > 1 and all(c in d and isinstance(d[c].dtype, pd.CategoricalDtype) for d in dfs):
+            categories = union_categoricals([d[c].array for d in dfs]).categories
+            for d in dfs:
+                d[c] = d[c].cat.set_categories(categories)
+    return pd.concat(dfs, ignore_index=True)
@@ -0,0 +1,113 @@
+import os
+import traceback
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+
+# Runs independent work units, e.g. (year, month) or (year, quarter, gear),
+# over a process pool. A unit counts as finished when all its output files
+# exist, so reruns and retries only redo the units that are missing.
+# Workers are started from a fresh forkserver (spawn where there is none),
+# never forked from a parent whose numpy/pyarrow thread pools are running.
+
+# Every worker holds a whole unit (a month, or a quarter of one gear) in
+# memory, so peak memory is about N_WORKERS units. Under SLURM the job's
+# CPU count is used (size --mem-per-cpu for one unit); elsewhere only 2.
+N_WORKERS = int(os.environ.get("SLURM_CPUS_PER_TASK", 2))
+MAX_RETRIES = 2
+
+_SHARED = None
+
+
+def _set_shared(shared):
+    global _SHARED
+    _SHARED = shared
+
+
+def _run_unit(fn, unit):
+    return fn(unit, _SHARED)
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Yields a temporary path next to path. It is renamed to path only if the
+    block finishes, so a crashed or killed unit never leaves a complete
+    looking output behind.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def atomic_to_parquet(df, path):
+    with atomic_output(path) as tmp:
+        df.to_parquet(tmp, index=False)
+
+
+def run_units(fn, units, outputs, shared=None, n_workers=N_WORKERS, max_retries=MAX_RETRIES):
+    """
+    Calls fn(unit, shared) for every unit whose outputs(unit) are not all
+    present. fn must be a module level function and should write its
+    results with atomic_output / atomic_to_parquet.
+
+    shared is pickled to every worker once, when it starts, and must be
+    treated as read-only. Failed units are retried up to max_retries
+    times. Returns the units that still failed.
+    """
+    def done(unit):
+        return all(Path(p).exists() for p in outputs(unit))
+
+    pending = [u for u in units if not done(u)]
+    print(f"{len(units) - len(pending)} of {len(units)} units already done, {len(pending)} to run "
+          f"with {n_workers} workers")
+
+    _set_shared(shared)
+
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt > 0:
+            print(f"Retrying {len(pending)} failed units (attempt {attempt + 1})")
+
+        failed = []
+
+        if n_workers <= 1:
+            for unit in pending:
+                try:
+                    fn(unit, shared)
+                    print(f"Finished {unit}")
+                except Exception:
+                    print(f"Unit {unit} failed:\n{traceback.format_exc()}")
+                    failed.append(unit)
+        else:
+            # forking after numpy/pyarrow started their thread pools can
+            # deadlock the child on a lock held by one of those threads
+            method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+            ctx = mp.get_context(method)
+
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                                     initializer=_set_shared, initargs=(shared,)) as pool:
+                futures = {pool.submit(_run_unit, fn, unit): unit for unit in pending}
+                for fut in as_completed(futures):
+                    unit = futures[fut]
+                    try:
+                        fut.result()
+                        print(f"Finished {unit}")
+                    except Exception:
+                        print(f"Unit {unit} failed:\n{traceback.format_exc()}")
+                        failed.append(unit)
+
+        pending = [u for u in failed if not done(u)]
+
+    if pending:
+        print(f"{len(pending)} units failed after {max_retries + 1} attempts: {pending}")
+
+    return pending
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# Per-trajectory summary of which report labels occur in it, as one uint64
+# bitmask per trajectory (bit k = k-th report category). The base frame is
+# prepared (fillna, rename, datetime, sort) and summarised once, after which
+# the trajectory filter for every gear is a couple of bitwise ops on the
+# summary instead of two groupbys, an isin and a sort over all rows.
+
+MAX_REPORTS = 64
+
+
+def prepare_labels(df):
+    """
+    label -> report (missing = no_fishing) as a categorical, parsed
+    timestamps, rows sorted by (trajectory_id, date_time_utc).
+    """
+    df = df.rename(columns={"label": "report"})
+    report = df["report"].astype("category")
+    if "no_fishing" not in report.cat.categories:
+        report = report.cat.add_categories("no_fishing")
+    df["report"] = report.fillna("no_fishing")
+    df["date_time_utc"] = pd.to_datetime(df["date_time_utc"])
+    return df.sort_values(["trajectory_id", "date_time_utc"]).reset_index(drop=True)
+
+
+def report_summary(df):
+    """
+    One row per trajectory of a prepared frame, in row order: trajectory_id,
+    n_rows and reports (bitmask of report categories). Rows without a
+    trajectory_id are one trailing row with trajectory_id NaN.
+    """
+    categories = df["report"].cat.categories
+    if len(categories) > MAX_REPORTS:
+        raise ValueError(f"{len(categories)} report categories, the bitmask holds {MAX_REPORTS}")
+
+    codes = df["report"].cat.codes.to_numpy().astype(np.uint64)
+    bits = np.left_shift(np.uint64(1), codes)
+
+    traj_codes, _ = pd.factorize(df["trajectory_id"])
+    starts = np.flatnonzero(np.r_[True, traj_codes[1:] != traj_codes[:-1]]) if len(df) else np.array([], dtype=np.int64)
+
+    return pd.DataFrame({
+        "trajectory_id": df["trajectory_id"].to_numpy()[starts],
+        "n_rows": np.diff(np.r_[starts, len(df)]),
+        "reports": np.bitwise_or.reduceat(bits, starts) if len(starts) else np.array([], dtype=np.uint64),
+    })
+
+
+def report_bits(categories, reports):
+    bits = np.uint64(0)
+    for k, c in enumerate(categories):
+        if c in reports:
+            bits |= np.uint64(1) << np.uint64(k)
+    return bits
+
+
+def select_trajectories(df, summary, allowed_report, gear):
+    """
+    Rows of the prepared frame whose trajectory only has allowed_report
+    labels and at least one gear label.
+    """
+    categories = df["report"].cat.categories
+    allowed_bits = report_bits(categories, set(allowed_report))
+    gear_bits = report_bits(categories, set(gear))
+
+    reports = summary["reports"].to_numpy(dtype=np.uint64)
+    valid = (
+        ((reports & ~allowed_bits) == 0) &
+        ((reports & gear_bits) != 0) &
+        summary["trajectory_id"].notna().to_numpy()
+    )
+    keep = np.repeat(valid, summary["n_rows"].to_numpy())
+    return df[keep].reset_index(drop=True)
@@ -0,0 +1,129 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+# Shore-distance lookups without reading the whole GeoTIFF on every call.
+# The band is converted once to a raw .npy next to the .tif and then opened
+# with np.load(mmap_mode="r"): pages are shared through the OS page cache, so
+# all workers use the same memory and only touched tiles are read.
+
+CACHE_VERSION = 1
+
+_RASTERS = {}
+
+
+def _source_fingerprint(path):
+    stat = Path(path).stat()
+    return {"version": CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _cache_paths(raster_path):
+    raster_path = Path(raster_path)
+    return (
+        raster_path.with_name(raster_path.name + ".band1.npy"),
+        raster_path.with_name(raster_path.name + ".band1.json"),
+    )
+
+
+def _build_cache(raster_path, npy_path, meta_path):
+    print(f"Caching {raster_path} as {npy_path.name} ...")
+    with rasterio.open(raster_path) as src:
+        # float32 keeps NaN for nodata and halves the size of a float64 band
+        band = src.read(1).astype("float32")
+        if src.nodata is not None:
+            band[band == src.nodata] = np.nan
+        transform = list(src.transform)[:6]
+
+    # both files are written under a per-process name and moved into place,
+    # so workers building the cache at the same time never see a partial file
+    tmp = npy_path.with_name(f"{npy_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, band)
+    tmp.replace(npy_path)
+
+    meta = {"source": _source_fingerprint(raster_path), "transform": transform, "shape": list(band.shape)}
+    tmp = meta_path.with_name(f"{meta_path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(meta))
+    tmp.replace(meta_path)
+
+
+def open_shore_raster(raster_path="distance-from-shore.tif"):
+    """
+    Memory-mapped band plus its geotransform, cached per path for the life
+    of the process. Rebuilds the .npy cache if the .tif changed.
+    """
+    key = str(Path(raster_path).resolve())
+    if key in _RASTERS:
+        return _RASTERS[key]
+
+    npy_path, meta_path = _cache_paths(raster_path)
+    meta = json.loads(meta_path.read_text()) if meta_path.exists() and npy_path.exists() else None
+    if meta is None or meta["source"] != _source_fingerprint(raster_path):
+        _build_cache(raster_path, npy_path, meta_path)
+        meta = json.loads(meta_path.read_text())
+
+    a, b, c, d, e, f = meta["transform"]
+    det = a * e - b * d
+    raster = {
+        "band": np.load(npy_path, mmap_mode="r"),
+        # inverse affine: (x, y) -> (col, row)
+        "inverse": (e / det, -b / det, (b * f - e * c) / det, -d / det, a / det, (d * c - a * f) / det),
+    }
+    _RASTERS[key] = raster
+    return raster
+
+
+def lonlat_to_colrow(raster, lon, lat):
+    ia, ib, ic, id_, ie, if_ = raster["inverse"]
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    return ia * lon + ib * lat + ic, id_ * lon + ie * lat + if_
+
+
+def _gather(band, rows, cols):
+    out = np.full(rows.shape, np.nan, dtype="float32")
+    valid = (rows >= 0) & (rows < band.shape[0]) & (cols >= 0) & (cols < band.shape[1])
+    out[valid] = band[rows[valid], cols[valid]]
+    return out
+
+
+def sample_shore_distance(lon, lat, raster_path="distance-from-shore.tif", bilinear=False):
+    """
+    Distance to shore (raster units, km) at every (lon, lat). Nearest pixel
+    by default; bilinear=True interpolates between the four surrounding pixel
+    centres and falls back to the nearest pixel next to nodata or the edge.
+    Points outside the raster get NaN.
+    """
+    raster = open_shore_raster(raster_path)
+    band = raster["band"]
+    col_f, row_f = lonlat_to_colrow(raster, lon, lat)
+
+    with np.errstate(invalid="ignore"):  # NaN coordinates become out-of-range indices
+        rows = np.floor(row_f).astype(np.int64)
+        cols = np.floor(col_f).astype(np.int64)
+    nearest = _gather(band, rows, cols)
+    if not bilinear:
+        return nearest
+
+    # pixel centres sit at +0.5
+    x = col_f - 0.5
+    y = row_f - 0.5
+    with np.errstate(invalid="ignore"):
+        c0 = np.floor(x).astype(np.int64)
+        r0 = np.floor(y).astype(np.int64)
+    fx = (x - c0).astype("float32")
+    fy = (y - r0).astype("float32")
+
+    v00 = _gather(band, r0, c0)
+    v01 = _gather(band, r0, c0 + 1)
+    v10 = _gather(band, r0 + 1, c0)
+    v11 = _gather(band, r0 + 1, c0 + 1)
+
+    interp = (
+        v00 * (1 - fx) * (1 - fy) + v01 * fx * (1 - fy) +
+        v10 * (1 - fx) * fy + v11 * fx * fy
+    )
+    return np.where(np.isnan(interp), nearest, interp)
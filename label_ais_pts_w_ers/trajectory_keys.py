@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+# Trajectory ids are only unique within one monthly AIS file. Instead of
+# "<id>-<year>-<month>" strings they are packed into one int64:
+#   key = ((year * 16 + month) << LOCAL_BITS) | local_id
+# so keys from different months never collide, sort by (year, month, id)
+# and group/factorize as plain integers.
+
+LOCAL_BITS = 40
+MONTH_BITS = 4
+LOCAL_MASK = (1 << LOCAL_BITS) - 1
+# rows without a trajectory id share one key per month, like "nan-<year>-<month>" did
+MISSING_LOCAL = LOCAL_MASK
+
+
+def local_trajectory_ids(trajectory_id):
+    """
+    int64 local ids for one month. Integer ids (or strings of integers) are
+    kept as they are; anything else is replaced by its position among the
+    sorted unique ids of the month.
+    """
+    s = pd.Series(trajectory_id)
+    missing = s.isna().to_numpy()
+
+    numeric = pd.to_numeric(s, errors="coerce")
+    if numeric.notna().sum() == (~missing).sum() and (numeric.dropna() % 1 == 0).all():
+        local = numeric.fillna(MISSING_LOCAL).to_numpy().astype(np.int64)
+    else:
+        codes, _ = pd.factorize(s, sort=True)
+        local = np.where(missing, MISSING_LOCAL, codes).astype(np.int64)
+
+    if ((local < 0) | (local > LOCAL_MASK)).any():
+        raise ValueError(f"local trajectory ids must fit in {LOCAL_BITS} bits")
+    return local
+
+
+def encode_trajectory_keys(local_ids, year, month):
+    prefix = np.int64((year << MONTH_BITS) | month) << np.int64(LOCAL_BITS)
+    return prefix | np.asarray(local_ids, dtype=np.int64)
+
+
+def decode_trajectory_keys(keys):
+    """Returns (year, month, local_id) arrays."""
+    keys = np.asarray(keys, dtype=np.int64)
+    ym = keys >> LOCAL_BITS
+    return ym >> MONTH_BITS, ym & ((1 << MONTH_BITS) - 1), keys & LOCAL_MASK
+
+
+def with_trajectory_keys(df, year, month):
+    # replaces df["trajectory_id"] of one monthly file with the packed keys
+    df["trajectory_id"] = encode_trajectory_keys(local_trajectory_ids(df["trajectory_id"]), year, month)
+    return df
+
+
+def trajectory_key_labels(keys):
+    # the old "<id>-<year>-<month>" form, for printing and plot titles
+    year, month, local = decode_trajectory_keys(keys)
+    local = pd.Series(local).astype(str).where(local != MISSING_LOCAL, "nan")
+    return (local + "-" + pd.Series(year).astype(str) + "-" + pd.Series(month).astype(str)).to_numpy()
+
+
+def trajectory_label(traj_id):
+    # one id for a plot title; files written before the packed keys still
+    # hold "<id>-<year>-<month>" strings, which are shown as they are
+    if isinstance(traj_id, (int, np.integer)):
+        return trajectory_key_labels([traj_id])[0]
+    return str(traj_id)